@@ -90,7 +90,7 @@ actp.bestEffortPerDistanceEvolutionPlot(gdi)
 # Obtain metrics from Data Importer
 metricsDF = gdi.activityMetricsDF
 # Then create the plot
-actp.plotDistributionHRzones(metricsDF, StravaHRzones, "HR_Custom_Time_")
+actp.plotDistributionHRzones(metricsDF, StravaHRzones, "HR_Custom_Time_", gdi.rollupStore)
 
 # Same but with Garmin zones already computed in the metrics.
 # That means the bounds used to calculate the time spent in each zone as saved
@@ -106,12 +106,12 @@ GarminHRzones = dict(
     Zone_6= [199, np.inf]
     )
 
-actp.plotDistributionHRzones(metricsDF, GarminHRzones, "HR_Time_")
+actp.plotDistributionHRzones(metricsDF, GarminHRzones, "HR_Time_", gdi.rollupStore)
 
 # -------------------------------------------------------------------------------------------------------
 #%% SHOW DISTRIBUTION OF TIME SPENT IN EACH PACE ZONE EACH MONTH
 # Then create the plot
-actp.plotDistributionPaceZones(metricsDF, StravaPaceZones, "PaceZone_Time_")
+actp.plotDistributionPaceZones(metricsDF, StravaPaceZones, "PaceZone_Time_", gdi.rollupStore)
 
 # -------------------------------------------------------------------------------------------------------
 #%% More graphs and analyses incoming
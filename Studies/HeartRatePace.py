@@ -9,6 +9,7 @@ Created on Sun Jun 25 18:51:35 2023
 # Required libraries
 import Utilities.Functions as Utils
 from Utilities.ActivityImporter import ActivityImporter
+from Utilities.GarminDataImporter import WatchOffloadDataImporter
 import numpy as np
 import pandas as pd
 import seaborn as sns
@@ -45,4 +46,19 @@ plt.figure()
 plt.scatter(xData, Utils.speedToPace(yData))
 plt.plot(xSmooth, Utils.speedToPace(ySmooth))
 plt.grid(True)
-plt.ylim(paceLim)
\ No newline at end of file
+plt.ylim(paceLim)
+
+#%% Kernel regression smoothing over all activities
+# Millions of samples: the binned method only bins them once then smooths them on a grid
+gdi = WatchOffloadDataImporter(Utils.getDataPath() + "\\WatchOffloadClean", importActivities=True,
+                               activityImporterOptions=dict(estimateBestEfforts=False, importWeather=False))
+dfAll = gdi.exportAllActivitiesData()
+xDataAll = dfAll['heart_rate']
+yDataAll = dfAll['speed']
+xSmoothAll = np.linspace(120.0, max(xDataAll)+5, 1000)
+ySmoothAll = Utils.kernelRegressionSmoothing(xDataAll, yDataAll, xSmoothAll, 5, method='binned', tolerance=1.0e-4)
+
+plt.figure()
+plt.plot(xSmoothAll, Utils.speedToPace(ySmoothAll))
+plt.grid(True)
+plt.ylim(paceLim)
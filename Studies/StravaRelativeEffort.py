@@ -148,4 +148,19 @@ print('MSE:', metrics.mean_squared_error(y_test, y_pred))
 print('RMSE:', np.sqrt(metrics.mean_squared_error(y_test, y_pred)))
 
 yDF = pd.DataFrame(dict(trueValue=y_test, prediction=y_pred))
-sns.scatterplot(data=yDF, x='trueValue', y='prediction')
\ No newline at end of file
+sns.scatterplot(data=yDF, x='trueValue', y='prediction')
+
+#%% ---------------- EFFORT SCORE ENGINE ----------------
+# The HR histograms of all activities are stored once in the EffortScoreEngine
+# so other zones or formulas can be tried without importing the FIT files again.
+from Utilities.EffortScore import EffortScoreEngine
+
+effortEngine = EffortScoreEngine()
+effortEngine.updateFromImporter(gdi)
+# Zone weights from the linear regression above, per minute
+effortEngine.registerZoneWeightedFormula('StravaFit', StravaHRzones, lmCustom.coef_ * 60.0)
+effortEngine.addScoresToMetrics(metricsDF)
+
+fullDF_Effort = pd.merge(metricsDF[['Metric_StartTime', 'Effort_TRIMP_Banister', 'Effort_TRIMP_Edwards', 'Effort_StravaFit']],
+                         stravaDF_light, on='Metric_StartTime', how='inner')
+sns.pairplot(fullDF_Effort[['Effort_TRIMP_Banister', 'Effort_TRIMP_Edwards', 'Effort_StravaFit', 'Relative Effort']])
@@ -86,6 +86,22 @@ plt.legend(['5k Prediction', '5k Real', '10k Prediction', '10k Real', 'Half Pred
 plt.grid(True)
 plt.title('Race Pace Prediction vs Personal Records')
 
+#%% Compare the race predictions with the critical speed model and Riegel
+from Utilities.CriticalSpeed import CriticalSpeedModel
+csModel = CriticalSpeedModel(windowDays=90)
+csModel.fitFromImporter(gdi)
+dfRaceCompare = csModel.compareWithRacePredictions(gdi.df_RacePred)
+
+plt.figure()
+plt.plot(dfRaceCompare.index, dfRaceCompare['raceTime10K'] / 60.0)
+plt.plot(dfRaceCompare.index, dfRaceCompare['raceTime10K_CS'] / 60.0)
+plt.plot(dfRaceCompare.index, dfRaceCompare['raceTime10K_Riegel'] / 60.0)
+plt.xlabel('Date')
+plt.ylabel('10k Time Prediction (min)')
+plt.legend(['Garmin', 'Critical Speed', 'Riegel'])
+plt.grid(True)
+plt.title('10k Prediction: Garmin vs Critical Speed Model')
+
 #%% Look at metrics of activities
 metricsDF = gdi.activityMetricsDF
 
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Script to check the compact storage profile of the ActivityImporter.
+It measures the memory of the stored time series with and without compactData,
+checks the rebuilt DataFrame and the metrics are the same as the full ones,
+and times the access to the data with and without the expanded data cache.
+
+Created on Fri Oct 30 09:14:52 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import useful modules
+import Utilities.Functions as Utils
+from Utilities.ActivityImporter import ActivityImporter
+import numpy as np
+import pandas as pd
+import time
+
+#%% Script settings
+filePath = Utils.getDataPath() + "\\WatchOffloadClean\\2023_10_15-08_39_48_running.fit"
+importOptions = dict(estimateBestEfforts=True, importWeather=False)
+Naccess = 50
+minMemoryReduction = 0.5
+
+#%% Import the same activity with both storage profiles
+actFull = ActivityImporter(filePath, compactData=False, **importOptions)
+actCompact = ActivityImporter(filePath, compactData=True, **importOptions)
+
+#%% Memory of the stored time series
+memoryFull = actFull.storedData.memory_usage(deep=True).sum()
+memoryCompact = actCompact.storedData.memory_usage(deep=True).sum()
+memoryReduction = 1.0 - memoryCompact / memoryFull
+print(f"Stored data: full {memoryFull/1e3:.0f}kB - compact {memoryCompact/1e3:.0f}kB - reduction {memoryReduction*100:.0f}%")
+assert memoryReduction >= minMemoryReduction, f"Compact storage saves less than {minMemoryReduction*100:.0f}% of the memory"
+
+#%% Rebuilt data and metrics are the same
+dfFull = actFull.data
+dfCompact = actCompact.data
+numericColumns = dfFull.select_dtypes('number').columns
+maxDifferences = (dfFull[numericColumns] - dfCompact[numericColumns]).abs().max()
+print("Largest differences of the rebuilt channels:")
+print(maxDifferences.sort_values(ascending=False).head(5))
+
+metricsFull = pd.Series(actFull.exportUsefulMetrics())
+metricsCompact = pd.Series(actCompact.exportUsefulMetrics())
+isNumeric = metricsFull.apply(lambda value: isinstance(value, (int, float, np.number)))
+metricsDifferences = (metricsFull[isNumeric].astype(float) - metricsCompact[isNumeric].astype(float)).abs()
+print(f"Largest difference of the numeric metrics: {metricsDifferences.max():.3g} ({metricsDifferences.idxmax()})")
+
+#%% Access time with and without the expanded data cache
+ActivityImporter.releaseExpandedData()
+tStart = time.perf_counter()
+for i in np.arange(Naccess):
+    ActivityImporter.releaseExpandedData()
+    actCompact.data
+timeRebuild = (time.perf_counter() - tStart) / Naccess
+
+tStart = time.perf_counter()
+for i in np.arange(Naccess):
+    actCompact.data
+timeCached = (time.perf_counter() - tStart) / Naccess
+print(f"Access to the compact data: rebuilt {timeRebuild*1e3:.2f}ms - cached {timeCached*1e6:.2f}us")
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Script to benchmark the cold import time of the framework.
+Each import is done in a fresh interpreter so nothing is cached in sys.modules.
+It also checks that the heavy optional libraries (plotting, weather, progress bar)
+are not loaded by a batch import job that does not use them.
+
+Created on Sun Oct 18 10:12:31 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import useful modules
+import subprocess
+import sys
+import os
+import numpy as np
+
+#%% Script settings
+Ntest = 10
+rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Must run from the root of the repository
+importStatement = "from Utilities.GarminDataImporter import WatchOffloadDataImporter"
+heavyModules = ['plotly', 'matplotlib', 'meteostat', 'tqdm']
+
+# Code run in the fresh interpreter. Prints the import time then the heavy modules loaded
+benchmarkCode = f"""
+import time, sys
+tStart = time.perf_counter()
+{importStatement}
+tImport = time.perf_counter() - tStart
+print(tImport)
+print(','.join(mod for mod in {heavyModules} if mod in sys.modules))
+"""
+
+#%% Time the cold import
+importTimes = np.ones(Ntest) * np.nan
+for i in np.arange(Ntest):
+    result = subprocess.run([sys.executable, "-c", benchmarkCode], cwd=rootFolder, capture_output=True, text=True, check=True)
+    outputLines = result.stdout.strip().split('\n')
+    importTimes[i] = float(outputLines[0])
+    loadedHeavyModules = outputLines[1] if len(outputLines) > 1 else ""
+
+print(f"Cold import of '{importStatement}'")
+print(f"Mean {importTimes.mean()*1e3:.1f}ms - Min {importTimes.min()*1e3:.1f}ms - Max {importTimes.max()*1e3:.1f}ms over {Ntest} runs")
+if loadedHeavyModules:
+    print("Heavy modules loaded at import: " + loadedHeavyModules)
+else:
+    print("No heavy optional module loaded at import")
+
+#%% Detailed import profile of the slowest modules
+result = subprocess.run([sys.executable, "-X", "importtime", "-c", importStatement], cwd=rootFolder, capture_output=True, text=True, check=True)
+# Lines are "import time: self [us] | cumulative | imported package"
+profileLines = [line.split('|') for line in result.stderr.split('\n') if line.startswith('import time:') and not 'self [us]' in line]
+profile = sorted(((int(line[1]), line[2].strip()) for line in profileLines), reverse=True)
+print("Slowest imports (cumulative):")
+for cumulativeTime, moduleName in profile[:10]:
+    print(f"    {cumulativeTime/1e3:8.1f}ms  {moduleName}")
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Script to check the simplification of the GPS tracks with the Douglas-Peucker
+algorithm. For several tolerances, checks that every sample of the full track is
+within tolerance of the simplified track, compares the kept points with a simple
+recursive implementation and shows the compression and the computation time.
+
+Created on Wed Oct 21 14:07:38 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import useful modules
+import Utilities.Functions as Utils
+from Utilities.ActivityImporter import ActivityImporter
+import numpy as np
+import time
+
+#%% Imports an activity
+filePath = Utils.getDataPath() + "\\11329404102_ACTIVITY.fit"
+print(filePath)
+thisActivity = ActivityImporter(filePath, estimateBestEfforts=False, importWeather=False)
+
+# Full track in meters, the same way as in getSimplifiedTrack
+df = thisActivity.data
+dfFull = df.loc[df['position_lat_deg'].notna() & df['position_long_deg'].notna()]
+(x, y) = Utils.latLonToLocalMeters(dfFull['position_lat_deg'].values, dfFull['position_long_deg'].values,
+                                   dfFull['position_lat_deg'].iloc[0], dfFull['position_long_deg'].iloc[0])
+
+#%% Reference recursive implementation
+def recursiveDouglasPeucker(x, y, tolerance, idxStart, idxEnd):
+    if idxEnd - idxStart < 2:
+        return [idxStart]
+    distances = Utils.pointToSegmentDistance(x[idxStart+1:idxEnd], y[idxStart+1:idxEnd], x[idxStart], y[idxStart], x[idxEnd], y[idxEnd])
+    idxFarthest = np.argmax(distances)
+    if distances[idxFarthest] <= tolerance:
+        return [idxStart]
+    idxSplit = idxStart + 1 + idxFarthest
+    return recursiveDouglasPeucker(x, y, tolerance, idxStart, idxSplit) + recursiveDouglasPeucker(x, y, tolerance, idxSplit, idxEnd)
+
+#%% Check the error bound for several tolerances
+toleranceList = [0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0]
+for tolerance in toleranceList:
+    tStart = time.perf_counter()
+    dfTrack = thisActivity.getSimplifiedTrack(tolerance)
+    tSimplify = time.perf_counter() - tStart
+
+    # Position of the kept samples in the full track
+    idxKept = np.searchsorted(dfFull.index.values, dfTrack.index.values)
+    maxDeviation = Utils.polylineMaxDeviation(x, y, idxKept)
+    idxReference = np.array(recursiveDouglasPeucker(x, y, tolerance, 0, len(x)-1) + [len(x)-1])
+
+    print(f"Tolerance {tolerance:5.1f}m: {len(dfTrack):5d} of {len(dfFull)} points ({len(dfTrack)/len(dfFull)*100:5.1f}%) " + \
+          f"- max deviation {maxDeviation:6.2f}m - {tSimplify*1e3:6.1f}ms - same as reference: {np.array_equal(idxKept, idxReference)}")
+    assert maxDeviation <= tolerance, f"Simplified track is {maxDeviation:.2f}m away for a tolerance of {tolerance}m"
+
+# Second call must come from the cache
+tStart = time.perf_counter()
+thisActivity.getSimplifiedTrack(toleranceList[0])
+print(f"Cached call: {(time.perf_counter() - tStart)*1e6:.1f}us")
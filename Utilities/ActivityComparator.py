@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+ActivityComparator class
+Class to align many activities, best efforts or pacing plans on a shared
+distance axis, like ghosts in a race. All activities are held in dense arrays
+of shape (Nactivities, Ndistances) so comparisons are vectorized and do not
+depend on a loop over the activities.
+
+Created on Mon Oct 19 09:14:52 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+
+
+#%% Define the ActivityComparator class
+class ActivityComparator:
+    """
+    This class interpolates a list of activities onto the same distance grid.
+    The time, speed and heart rate of all activities are then available as
+    arrays with one row per activity and one column per distance.
+    """
+
+    def __init__(self, dfList, namesList, distanceStep=1.0, endDistance=None):
+        """
+        Constructor.
+        dfList contains all dataFrames of activities to compare. They can be full
+        activities, best efforts from extractBestEffortTimeSeries, or pacing
+        plans from createDFgivenPace.
+        namesList contains their respective names.
+        distanceStep is the spacing of the distance grid in meters.
+        endDistance is the end of the distance grid. By default it is the distance
+        of the shortest activity. If longer, activities are NaN after their end.
+        """
+
+        self.namesList = list(namesList)
+        self.Nactivities = len(dfList)
+
+        # Get distance and time from the start of each activity or effort
+        distanceList = [thisDF['distanceEffort'].values if 'distanceEffort' in thisDF.columns
+                        else thisDF['distance'].values - thisDF['distance'].iloc[0] for thisDF in dfList]
+        timeList = [thisDF['timeEffort'].values if 'timeEffort' in thisDF.columns
+                    else thisDF['time'].values - thisDF['time'].iloc[0] for thisDF in dfList]
+        self.endDistances = np.array([thisDistance[-1] for thisDistance in distanceList])
+
+        # Create the common distance grid
+        if endDistance is None:
+            endDistance = self.endDistances.min()
+        self.distance = np.arange(0, endDistance, distanceStep)
+        if self.distance[-1] < endDistance:
+            self.distance = np.append(self.distance, endDistance)
+
+        # Interpolates all activities at once
+        (self.time, self.speed, self.heartRate) = Utils.interpolateOnCommonGrid(
+                                                        distanceList,
+                                                        [timeList,
+                                                         [thisDF['speed'].values for thisDF in dfList],
+                                                         [thisDF['heart_rate'].values for thisDF in dfList]],
+                                                        self.distance)
+        # Activities don't have data after their end
+        isAfterEnd = self.distance[np.newaxis, :] > self.endDistances[:, np.newaxis]
+        self.time[isAfterEnd] = np.nan
+        self.speed[isAfterEnd] = np.nan
+        self.heartRate[isAfterEnd] = np.nan
+
+    #%% Comparison functions
+    def getChannel(self, channelName):
+        """
+        Returns the array of shape (Nactivities, Ndistances) for the given channel.
+        The channel can be time, speed, heart_rate or pace.
+        """
+        if channelName == 'time':
+            return self.time
+        elif channelName == 'speed':
+            return self.speed
+        elif channelName == 'heart_rate':
+            return self.heartRate
+        elif channelName == 'pace':
+            return self.getPace()
+        else:
+            raise ValueError(f"{channelName} is not a channel of the ActivityComparator")
+
+    def getPace(self):
+        """
+        Returns the pace of all activities as an array of datetime64.
+        """
+        return Utils.speedToPace(self.speed.ravel()).values.reshape(self.speed.shape)
+
+    def getTimeDelta(self, baselineIdx=0):
+        """
+        Returns the time difference of every activity to the baseline activity
+        at each distance. Positive means behind the baseline.
+        """
+        return self.time - self.time[baselineIdx, :]
+
+    def getPercentileBands(self, percentiles=(10, 50, 90), channelName='time', activityIdx=None):
+        """
+        Returns the percentiles of a channel across activities at each distance
+        as an array of shape (Npercentiles, Ndistances).
+        For instance the 10th to 90th percentile band of the time on a course.
+        activityIdx optionally restricts the calculation to a subset of activities.
+        Activities without data at a distance are ignored.
+        """
+        if channelName == 'pace':
+            # Percentiles of the speed then converted. Reversed so the 10th percentile is the 10% fastest pace
+            speedBands = self.getPercentileBands(100 - np.asarray(percentiles), 'speed', activityIdx)
+            return Utils.speedToPace(speedBands.ravel()).values.reshape(speedBands.shape)
+        channelData = self.getChannel(channelName)
+        if activityIdx is not None:
+            channelData = channelData[activityIdx, :]
+        return Utils.nanPercentileColumns(channelData, percentiles)
+
+    def getTimeDeltaToPercentile(self, percentile=50):
+        """
+        Returns the time difference of every activity to the given percentile of
+        all activities at each distance. For instance how far ahead or behind of
+        the median performance on a course.
+        """
+        return self.time - Utils.nanPercentileColumns(self.time, percentile)[0, :]
+
+    def getFinishTimes(self):
+        """
+        Returns the time of each activity at the end of the distance grid.
+        """
+        return self.time[:, -1]
+
+    #%% Export functions
+    def exportToDataFrame(self, baselineIdx=0):
+        """
+        Exports the aligned activities into a single long DataFrame with one row
+        per activity and distance. Useful for plotting with seaborn or plotly express.
+        """
+        Ndistances = len(self.distance)
+        speedFlat = self.speed.ravel()
+        return pd.DataFrame(data={'activityName': np.repeat(self.namesList, Ndistances),
+                                  'distance': np.tile(self.distance, self.Nactivities),
+                                  'time': self.time.ravel(),
+                                  'timeDelta': self.getTimeDelta(baselineIdx).ravel(),
+                                  'speed': speedFlat,
+                                  'speed_kph': speedFlat*3.6,
+                                  'pace': Utils.speedToPace(speedFlat),
+                                  'heart_rate': self.heartRate.ravel()
+                                  })
+
+    #%% Static methods
+    @staticmethod
+    def fromActivities(activityList, effortName, namesList, **kwargs):
+        """
+        Creates an ActivityComparator from a list of ActivityImporter for a given
+        best effort name (like '5km' or '20mins'). Activities without that best
+        effort are skipped. Other arguments are given to the constructor.
+        """
+        dfList = []
+        keptNamesList = []
+        for thisActivity, thisName in zip(activityList, namesList):
+            dfEffort = thisActivity.extractBestEffortTimeSeries(effortName)
+            if isinstance(dfEffort, pd.DataFrame):
+                dfList.append(dfEffort)
+                keptNamesList.append(thisName)
+        return ActivityComparator(dfList, keptNamesList, **kwargs)
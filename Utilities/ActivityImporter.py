@@ -17,7 +17,8 @@ import Utilities.Functions as Utils
 import numpy as np
 import pandas as pd
 import datetime
-from meteostat import Point, Hourly
+import collections
+# meteostat is only imported when the weather is requested because it is slow to import
 
 
 #%% Define the ActivityImporter class
@@ -27,15 +28,36 @@ class ActivityImporter:
     It also contains functions to create advanced metrics.
     """
     
+    # With the compact storage profile, the expanded DataFrames of the last activities
+    # accessed are kept so the successive import and batch steps don't rebuild them
+    expandedDataCacheSize = 8
+    expandedDataCache = collections.deque()
+    
     def __init__(self, filePath, estimateBestEfforts=True, importWeather=True, customHRzones=dict(),
-                       customPaceZones=dict(), resampleDataTo1s=True):
+                       customPaceZones=dict(), resampleDataTo1s=True, compactData=False, elevationCorrector=None,
+                       gradeAdjustedBasis=False, filterArtefacts=False):
         """
         Contructor. Give path to the .fit file as input
+        
+        With compactData, the time series are kept in memory in a compact storage
+        profile (see Utils.compactDataFrame) and derived channels are computed
+        each time the data is accessed.
+        elevationCorrector is an optional ElevationCorrector to add the altitude
+        from a DEM and the corresponding total ascent and descent.
+        With gradeAdjustedBasis, best efforts and time in pace zones are also
+        calculated with the grade adjusted pace (pace_gap channel).
+        With filterArtefacts, spikes and dropouts of the heart rate, speed, distance
+        and GPS are removed before the best efforts (see filterSensorArtefacts).
         """
         
         # Declare Main variables so we know they exist
         self.ObjInfo = dict()
         
+        # Store whether the data is kept in the compact storage profile
+        # Must be set before the data is assigned
+        self.compactData = compactData
+        self.expandedData = None
+        
         # Store custom HR and pace zones
         self.customHRzones = customHRzones
         self.customPaceZones = customPaceZones
@@ -43,6 +65,9 @@ class ActivityImporter:
         # Store whether we resample the data to 1s
         self.resampleDataTo1s = resampleDataTo1s
         
+        # Store whether efforts and zones are also calculated on the grade adjusted basis
+        self.gradeAdjustedBasis = gradeAdjustedBasis
+        
         # Creates a stream and decoder object from the Garmin SDK to import data
         stream = Stream.from_file(filePath)
         decoder = Decoder(stream)
@@ -75,12 +100,27 @@ class ActivityImporter:
                 # Adds file path to the file info
                 self.fileInfo['filePath'] = filePath
                 
+                # Remove the sensor artefacts before they affect the best efforts
+                if filterArtefacts:
+                    self.filterSensorArtefacts()
+                else:
+                    self.ObjInfo['hasArtefactFilter'] = False
+                
+                # Correct the altitude with a DEM if requested, before the grade adjusted efforts use the grade
+                if elevationCorrector is not None:
+                    self.correctElevation(elevationCorrector)
+                else:
+                    self.ObjInfo['hasDEMAltitude'] = False
+                
                 # Get best efforts if requested
                 if estimateBestEfforts:
                     self.getBestEfforts()
                     self.ObjInfo['hasBestEfforts'] = True
+                    if gradeAdjustedBasis:
+                        self.getBestEfforts(gradeAdjusted=True)
                 else:
                     self.ObjInfo['hasBestEfforts'] = False
+                self.ObjInfo['hasGradeAdjustedEfforts'] = estimateBestEfforts and gradeAdjustedBasis
                 
                 # Import Weather if requested
                 if importWeather:
@@ -88,7 +128,7 @@ class ActivityImporter:
                     self.ObjInfo['hasWeather'] = True
                 else:
                     self.ObjInfo['hasWeather'] = False
-                    
+                
                 # Calculate time in custom HR and pace zones
                 if customHRzones:
                     self.processTimeinHRzones(customHRzones)
@@ -98,10 +138,55 @@ class ActivityImporter:
                     self.processTimeinPaceZones(customPaceZones)
                 else:
                     self.timeInPaceZones = dict() # Empty dict if no custom zones
+                if customPaceZones and gradeAdjustedBasis:
+                    self.processTimeinPaceZones(customPaceZones, gradeAdjusted=True)
+                else:
+                    self.timeInPaceZonesGAP = dict()
                     
         else:
             self.ObjInfo['isSportActivity'] = False
        
+    #%% Data storage
+    @property
+    def data(self):
+        """
+        Time series of the activity as a DataFrame.
+        With the compact storage profile, the full DataFrame is rebuilt from the
+        stored compact one so modifications must be assigned back to self.data.
+        The rebuilt DataFrame is shared by the next accesses until it is evicted
+        from expandedDataCache, so it must not be modified in place either.
+        """
+        if self.compactData:
+            if self.expandedData is None:
+                self.expandedData = Utils.expandCompactDataFrame(self.storedData, self.dataStartTime)
+                ActivityImporter.expandedDataCache.append(self)
+                if len(ActivityImporter.expandedDataCache) > ActivityImporter.expandedDataCacheSize:
+                    ActivityImporter.expandedDataCache.popleft().expandedData = None
+            return self.expandedData
+        else:
+            return self.storedData
+    
+    @data.setter
+    def data(self, df):
+        if self.compactData:
+            (self.storedData, self.dataStartTime) = Utils.compactDataFrame(df)
+            ActivityImporter.releaseExpandedData(self)
+        else:
+            self.storedData = df
+        # Simplified tracks are cached per tolerance and must follow the data
+        self.simplifiedTracks = dict()
+            
+    @staticmethod
+    def releaseExpandedData(activity=None):
+        """
+        Drops the cached expanded DataFrame of an activity, or of all activities
+        if None, for instance to free the memory after a batch step.
+        """
+        cachedActivities = list(ActivityImporter.expandedDataCache) if activity is None else [activity]
+        for cachedActivity in cachedActivities:
+            cachedActivity.expandedData = None
+            if cachedActivity in ActivityImporter.expandedDataCache:
+                ActivityImporter.expandedDataCache.remove(cachedActivity)
             
     #%% Data formatting functions
     def transformRecordsToDataFrame(self, recordMessages):
@@ -131,18 +216,6 @@ class ActivityImporter:
             # Finally replace the original DataFrame
             df = dfInterp.copy()
         
-        # Get Cadence in Steps Per Minute
-        # https://forums.garmin.com/developer/fit-sdk/f/discussion/288454/fractional-cadence-values
-        if ('cadence' in df.columns) and ('fractional_cadence' in df.columns):
-            # Raw cadence is the "RPM" of the legs, which must be multiplied by 2
-            # to get the number of steps. Fractional_cadence allows odd numbers
-            df['cadence_spm'] = Utils.convertRPMtoCadence(df['cadence'], df['fractional_cadence'])
-        
-        # Get position in degrees instead of semicircles
-        # https://forums.garmin.com/developer/fit-sdk/f/discussion/280125/record-the-latitude-and-longitude-format-of-the-message
-        if ('position_lat' in df.columns) and ('position_long' in df.columns):
-            (df['position_lat_deg'], df['position_long_deg']) = Utils.SemiToDeg(df['position_lat'], df['position_long'])
-                    
         # Drop enhanced fields because they are of no use for running
         # https://www.thisisant.com/forum/viewthread/4561
         if 'enhanced_speed' in df.columns:
@@ -150,15 +223,15 @@ class ActivityImporter:
         if 'enhanced_altitude' in df.columns:
             df.drop(columns='enhanced_altitude', inplace=True)
         
-        # Get pace in min/km and speed in kph
-        if 'speed' in df.columns:
-            df['speed_kph']  = df['speed'] * 3.6
-            df['pace'] = Utils.speedToPace(df['speed'])
+        # Elapsed time in seconds, required by the grade adjusted distance
+        df['time'] = (df['timestamp'] - df['timestamp'].iloc[0]).apply(lambda x: x.total_seconds())
+        
+        # Get cadence in steps per minute, position in degrees, speed in kph, pace and grade adjusted pace
+        df = Utils.addDerivedChannels(df)
         
         # Check the distance channel vs the integration of speed
         # Some activities have very bad distance estimations
         # No more than 30% error
-        df['time'] = (df['timestamp'] - df['timestamp'].iloc[0]).apply(lambda x: x.total_seconds())
         estimatedDistance = np.trapz(x=df['time'], y=df['speed'].fillna(0.0))
         finalDistance = df['distance'].iloc[-1]
         if abs(estimatedDistance-finalDistance)/finalDistance*100 > 30:
@@ -169,6 +242,36 @@ class ActivityImporter:
         # Save df into object name
         self.data = df
         
+        # Replace a wrong distance by the one reconstructed from GPS or speed
+        self.ObjInfo['distanceSource'] = 'device'
+        if not self.ObjInfo['isDistanceValid']:
+            self.reconstructDistance()
+        
+    def reconstructDistance(self, maxSpeed=10.0, smoothingWindow=5, minValidPositionRatio=0.8):
+        """
+        Replaces the distance channel when it is not valid. The distance is
+        reconstructed from the GPS positions (see Utils.reconstructDistanceFromGPS)
+        if at least minValidPositionRatio of the samples have a position, else
+        from the integration of the speed. The source used is saved in
+        ObjInfo['distanceSource'] as 'gps' or 'speed'.
+        Best efforts must be recomputed afterwards if they were already calculated.
+        """
+        df = self.data
+        speedArray = df['speed'].values if 'speed' in df.columns else None
+        if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns) and \
+            df['position_lat_deg'].notna().mean() >= minValidPositionRatio:
+            df['distance'] = Utils.reconstructDistanceFromGPS(df['time'].values, df['position_lat_deg'].values, df['position_long_deg'].values,
+                                                              speedArray, maxSpeed, smoothingWindow)
+            self.ObjInfo['distanceSource'] = 'gps'
+        elif speedArray is not None:
+            speedArray = np.nan_to_num(speedArray)
+            df['distance'] = np.concatenate(([0.0], np.cumsum(np.diff(df['time'].values) * (speedArray[1:] + speedArray[:-1]) / 2.0)))
+            self.ObjInfo['distanceSource'] = 'speed'
+        else:
+            return
+        # Grade depends on the distance
+        self.data = Utils.addDerivedChannels(df)
+    
     def extractBestEffortTimeSeries(self, effortName):
         """
         Creates a subset of the time series dataFrame that corresponds to the best effort for a Time or a distance.
@@ -214,6 +317,31 @@ class ActivityImporter:
         dfBestEffort['timeEffort'] = dfBestEffort['time'] - dfBestEffort['time'].iloc[0]
         return dfBestEffort
     
+    def getSimplifiedTrack(self, tolerance=5.0):
+        """
+        Returns the GPS track simplified with the Douglas-Peucker algorithm as a
+        subset of the data with time, distance and position in degrees.
+        Every sample of the full track is within tolerance meters of the simplified
+        track. Results are cached per tolerance so maps, route clustering and
+        exports can ask for it repeatedly.
+        """
+        if tolerance in self.simplifiedTracks:
+            return self.simplifiedTracks[tolerance]
+        
+        df = self.data
+        if not('position_lat_deg' in df.columns) or not('position_long_deg' in df.columns):
+            print("This activity has no GPS track.")
+            return -1
+        
+        # Simplify in meters on a local plane around the start, without the samples missing a position
+        dfTrack = df.loc[df['position_lat_deg'].notna() & df['position_long_deg'].notna(), ['time', 'distance', 'position_lat_deg', 'position_long_deg']]
+        if len(dfTrack) > 0:
+            (x, y) = Utils.latLonToLocalMeters(dfTrack['position_lat_deg'].values, dfTrack['position_long_deg'].values,
+                                               dfTrack['position_lat_deg'].iloc[0], dfTrack['position_long_deg'].iloc[0])
+            dfTrack = dfTrack.iloc[Utils.douglasPeucker(x, y, tolerance)].copy()
+        self.simplifiedTracks[tolerance] = dfTrack
+        return dfTrack
+    
     def extractMetricsAndInfo(self, messages):
         """
         Extracts user information, file information, and metrics.
@@ -252,6 +380,8 @@ class ActivityImporter:
         # Splits Information, run/walk/stand
         if 'split_mesgs' in messages.keys(): # This feature seems to have been added only after some time
             self.splitsInfo = Utils.removeNumberColumsFromDataFrame(pd.DataFrame(messages['split_mesgs']))
+        else:
+            self.splitsInfo = pd.DataFrame()
         # Information on Sport
         self.sportInfo = Utils.removeNumberKeysFromDict(messages['sport_mesgs'][0])
         # Heart-Rate zone per lap and for the whole session in last item (Nlaps+1)
@@ -286,6 +416,7 @@ class ActivityImporter:
         metricsExport['File_Path'] = self.fileInfo['filePath']
         metricsExport['File_CreationDate'] = self.fileInfo['time_created']
         metricsExport['File_isDistanceValid'] = self.ObjInfo['isDistanceValid']
+        metricsExport['File_DistanceSource'] = self.ObjInfo['distanceSource']
         # Sport Info
         metricsExport['Sport_Name'] = self.sportInfo['name']
         metricsExport['Sport_Type'] = self.sportInfo['sport']
@@ -300,6 +431,7 @@ class ActivityImporter:
         metricsExport['Metric_AvgSpeed_ms'] = self.sessionMetrics['avg_speed']
         metricsExport['Metric_MaxSpeed_ms'] = self.sessionMetrics['max_speed']
         metricsExport['Metric_AvgPace'] = self.sessionMetrics['avg_pace']
+        metricsExport['Metric_AvgPaceGAP'] = self.getAverageGradeAdjustedPace()
         metricsExport['Metric_MaxPace'] = self.sessionMetrics['max_pace']
         metricsExport['Metric_TotalAscent'] = Utils.valuesOrDict(self.sessionMetrics, 'total_ascent', np.nan) # Not available for all activities, ex Treadmill
         metricsExport['Metric_TotalDescent'] = Utils.valuesOrDict(self.sessionMetrics, 'total_descent', np.nan)
@@ -330,33 +462,114 @@ class ActivityImporter:
         if self.timeInPaceZones:
             for zoneName, zoneTime in self.timeInPaceZones.items():
                 metricsExport['PaceZone_Time_' + zoneName] = zoneTime
-        # Laps metrics
-        metricsExport['Laps_Distance'] = ','.join(str(x) for x in self.lapsMetricsDF['total_distance'])
-        metricsExport['Laps_Time'] = ','.join(str(x) for x in self.lapsMetricsDF['total_timer_time'])
-        metricsExport['Laps_AvgPace'] = ','.join(x.strftime("%M:%S") for x in self.lapsMetricsDF['avg_pace'])
-        metricsExport['Laps_MaxPace'] = ','.join(x.strftime("%M:%S") for x in self.lapsMetricsDF['max_pace'])
-        metricsExport['Laps_AvgHR'] = ','.join(str(x) for x in self.lapsMetricsDF['avg_heart_rate'])
-        metricsExport['Laps_MaxHR'] = ','.join(str(x) for x in self.lapsMetricsDF['max_heart_rate'])
-        metricsExport['Laps_AvgCadence_spm'] = ','.join(str(x) for x in self.lapsMetricsDF['avg_cadence_spm'])
-        metricsExport['Laps_MaxCadence_spm'] = ','.join(str(x) for x in self.lapsMetricsDF['max_cadence_spm'])
+        if self.timeInPaceZonesGAP:
+            for zoneName, zoneTime in self.timeInPaceZonesGAP.items():
+                metricsExport['PaceZoneGAP_Time_' + zoneName] = zoneTime
+        # Laps are not exported here, see the lapsDF table of the data importers
         
         # Get Best efforts if it exists
         if self.ObjInfo['hasBestEfforts']:
             for thisKey in self.bestEffortsMetrics.keys():
                 metricsExport['BestEffort_' + thisKey] = self.bestEffortsMetrics[thisKey]
+        if self.ObjInfo['hasGradeAdjustedEfforts']:
+            for thisKey in self.bestEffortsMetricsGAP.keys():
+                metricsExport['BestEffortGAP_' + thisKey] = self.bestEffortsMetricsGAP[thisKey]
         
         # Get Weather
         if self.ObjInfo['hasWeather']:
             for thisKey in self.weatherMetrics.keys():
                 metricsExport['Weather_' + thisKey] = self.weatherMetrics[thisKey]
         
+        # Get data quality from the artefacts filter
+        if self.ObjInfo['hasArtefactFilter']:
+            for thisKey in self.qualityMetrics.keys():
+                metricsExport['Quality_' + thisKey] = self.qualityMetrics[thisKey]
+        
+        # Get ascent and descent from the DEM altitude
+        if self.ObjInfo['hasDEMAltitude']:
+            for thisKey in self.elevationMetrics.keys():
+                metricsExport['Metric_' + thisKey] = self.elevationMetrics[thisKey]
+        
         # Finally return the metrics
         return metricsExport
     
     #%% Data Analysis functions
-    def getBestEfforts(self):
+    def filterSensorArtefacts(self, window=31, heartRateWindow=61, nSigma=4.0, minHeartRate=30.0, maxHeartRate=230.0, maxSpeed=10.0):
+        """
+        Detects and removes the sensor artefacts, like optical heart rate spikes
+        or GPS jumps, that give impossible best efforts and skew the zone times.
+        Spikes are samples too far from the rolling median of window samples
+        (see Utils.detectSpikes), computed on strided views without loops.
+        Only artefacts shorter than half the window can be detected so the heart
+        rate, which can lock on a wrong value for a while, uses a longer window.
+            - heart rate: out of [minHeartRate, maxHeartRate], dropouts and spikes are interpolated
+            - speed: above maxSpeed m/s, dropouts and spikes are interpolated
+            - distance: steps faster than maxSpeed or spikes of the step speed are
+              replaced by the integration of the filtered speed
+            - GPS: position spikes are removed (set to missing)
+        The percentage of samples with an artefact for each channel and the data
+        quality score (percentage of samples without any artefact) are saved in qualityMetrics.
+        """
+        df = self.data
+        timeArray = df['time'].values
+        isAnyArtefact = np.zeros(len(df), dtype=bool)
+        self.qualityMetrics = dict()
+        
+        # Heart rate
+        if 'heart_rate' in df.columns:
+            heartRate = df['heart_rate'].values.astype(float)
+            isArtefact = np.isnan(heartRate) | (heartRate < minHeartRate) | (heartRate > maxHeartRate)
+            isArtefact |= Utils.detectSpikes(np.where(isArtefact, np.nan, heartRate), heartRateWindow, nSigma, minDeviation=15.0)
+            df['heart_rate'] = np.round(Utils.fillMaskedSamples(timeArray, heartRate, isArtefact))
+            self.qualityMetrics['HR_ArtefactRatio'] = isArtefact.mean() * 100
+            isAnyArtefact |= isArtefact
+        
+        # Speed
+        if 'speed' in df.columns:
+            speed = df['speed'].values.astype(float)
+            isArtefact = np.isnan(speed) | (speed > maxSpeed)
+            isArtefact |= Utils.detectSpikes(np.where(isArtefact, np.nan, speed), window, nSigma, minDeviation=1.5)
+            df['speed'] = Utils.fillMaskedSamples(timeArray, speed, isArtefact)
+            self.qualityMetrics['Speed_ArtefactRatio'] = isArtefact.mean() * 100
+            isAnyArtefact |= isArtefact
+        
+        # Distance from its step speed
+        if ('distance' in df.columns) and ('speed' in df.columns) and len(df) > 1:
+            distance = df['distance'].values.astype(float)
+            timeDelta = np.diff(timeArray)
+            stepDistance = np.diff(distance)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stepSpeed = stepDistance / timeDelta
+            isArtefact = np.isnan(stepSpeed) | (stepSpeed < 0.0) | (stepSpeed > maxSpeed)
+            isArtefact |= Utils.detectSpikes(np.where(isArtefact, np.nan, stepSpeed), window, nSigma, minDeviation=2.0)
+            speed = np.nan_to_num(df['speed'].values)
+            stepDistance = np.where(isArtefact, timeDelta * (speed[1:] + speed[:-1]) / 2.0, stepDistance)
+            df['distance'] = np.nan_to_num(distance[0]) + np.concatenate(([0.0], np.cumsum(stepDistance)))
+            self.qualityMetrics['Distance_ArtefactRatio'] = isArtefact.mean() * 100
+            isAnyArtefact[1:] |= isArtefact
+        
+        # GPS position spikes in meters around the start
+        if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns) and df['position_lat_deg'].notna().any():
+            latDeg = df['position_lat_deg'].values
+            lonDeg = df['position_long_deg'].values
+            idxFirst = np.flatnonzero(~np.isnan(latDeg))[0]
+            (x, y) = Utils.latLonToLocalMeters(latDeg, lonDeg, latDeg[idxFirst], lonDeg[idxFirst])
+            isArtefact = Utils.detectSpikes(x, window, nSigma, minDeviation=25.0) | Utils.detectSpikes(y, window, nSigma, minDeviation=25.0)
+            df.loc[isArtefact, ['position_lat', 'position_long']] = np.nan
+            self.qualityMetrics['GPS_ArtefactRatio'] = isArtefact.mean() * 100
+            isAnyArtefact |= isArtefact
+        
+        self.qualityMetrics['Score'] = (1.0 - isAnyArtefact.mean()) * 100
+        self.ObjInfo['hasArtefactFilter'] = True
+        # Derived channels like pace and positions in degrees follow the filtered data
+        self.data = Utils.addDerivedChannels(df)
+    
+    def getBestEfforts(self, gradeAdjusted=False):
         """
         Obtains the best efforts for each distance and time scale in the data.
+        With gradeAdjusted, the grade adjusted distance is used instead of the
+        distance so efforts on hills are comparable to flat ones. The results
+        are then stored in bestEffortsMetricsGAP and bestEffortDataGAP.
         
         This is a second version of the algorithm which uses a sliding window
         rather than checking all combinations of points.
@@ -382,7 +595,7 @@ class ActivityImporter:
         bestEffortTimeIndex = np.ones((Ntimes,2)) * np.nan # First column for start, second for finish index
 
         # Get nice names for the channels to look at
-        distanceArray = df['distance'].values
+        distanceArray = df['distance_gap'].values if gradeAdjusted else df['distance'].values
         timeArray = df['time'].values
         heartRateArray = df['heart_rate'].values
         # Get total time and distance to filter out efforts we can't estimate
@@ -526,20 +739,26 @@ class ActivityImporter:
                 bestEffortsMetrics['time_' + thisDistName + '_avgHR'] = np.nan
                 bestEffortsMetrics['time_' + thisDistName + '_maxHR'] = np.nan
 
-        # Finally save metrics to class
-        self.bestEffortsMetrics = bestEffortsMetrics
         # And save indexes because they'll be useful in the extractBestEffort function
-        self.bestEffortData = dict()
-        self.bestEffortData['Distance_index'] = bestEffortDistanceIndex
-        self.bestEffortData['Distance_Names'] = distancesNamesList
-        self.bestEffortData['Distance_Distances'] = distancesValuesList
-        self.bestEffortData['Distance_Times'] = bestTimePerDistance # This is now an array
-        self.bestEffortData['Distance_Paces'] = Utils.speedToPace(distancesValuesList/bestTimePerDistance)
-        self.bestEffortData['Time_index'] = bestEffortTimeIndex
-        self.bestEffortData['Time_Names'] = timesNamesList
-        self.bestEffortData['Time_Distances'] = bestDistancePerTime # This is now an array
-        self.bestEffortData['Time_Times'] = timesValuesList
-        self.bestEffortData['Time_Paces'] = Utils.speedToPace(bestDistancePerTime/timesValuesList)
+        bestEffortData = dict()
+        bestEffortData['Distance_index'] = bestEffortDistanceIndex
+        bestEffortData['Distance_Names'] = distancesNamesList
+        bestEffortData['Distance_Distances'] = distancesValuesList
+        bestEffortData['Distance_Times'] = bestTimePerDistance # This is now an array
+        bestEffortData['Distance_Paces'] = Utils.speedToPace(distancesValuesList/bestTimePerDistance)
+        bestEffortData['Time_index'] = bestEffortTimeIndex
+        bestEffortData['Time_Names'] = timesNamesList
+        bestEffortData['Time_Distances'] = bestDistancePerTime # This is now an array
+        bestEffortData['Time_Times'] = timesValuesList
+        bestEffortData['Time_Paces'] = Utils.speedToPace(bestDistancePerTime/timesValuesList)
+        
+        # Finally save metrics to class
+        if gradeAdjusted:
+            self.bestEffortsMetricsGAP = bestEffortsMetrics
+            self.bestEffortDataGAP = bestEffortData
+        else:
+            self.bestEffortsMetrics = bestEffortsMetrics
+            self.bestEffortData = bestEffortData
     
     def processTimeinHRzones(self, HRzones):
         """
@@ -564,7 +783,7 @@ class ActivityImporter:
         # Store the results
         self.timeInCustomHRzones = timeInHRzones
         
-    def processTimeinPaceZones(self, PaceZones):
+    def processTimeinPaceZones(self, PaceZones, gradeAdjusted=False):
         """
         Function to re-process an activity with manually given Pace zones.
         
@@ -572,19 +791,37 @@ class ActivityImporter:
         of that zone, the value is the interval of that zone.
         This function returns a dictionnary with the same keys but the values
         are the time spent in each zone in second.
+        With gradeAdjusted, the grade adjusted pace is used and the results are
+        stored in timeInPaceZonesGAP.
         """
         
         df = self.data
+        paceChannel = 'pace_gap' if gradeAdjusted else 'pace'
         timeInPaceZones = dict()
         for zoneName, zoneBnds in PaceZones.items():
-            yPace = df['pace'].copy()
+            yPace = df[paceChannel].copy()
             idxFilter = (zoneBnds[0] <= yPace) & (yPace < zoneBnds[1])
             yPace[idxFilter] = 1.0
             yPace[~idxFilter] = 0.0            
             timeInPaceZones[zoneName] = np.trapz(x=df['time'], y=yPace)            
         
         # Store the results
-        self.timeInPaceZones = timeInPaceZones
+        if gradeAdjusted:
+            self.timeInPaceZonesGAP = timeInPaceZones
+        else:
+            self.timeInPaceZones = timeInPaceZones
+    
+    def getAverageGradeAdjustedPace(self):
+        """
+        Average grade adjusted pace of the activity. The average speed of the
+        session is scaled by the ratio of the grade adjusted distance to the
+        distance from the speed, so pauses are excluded in the same way.
+        """
+        df = self.data
+        speedDistance = np.trapz(x=df['time'], y=df['speed'].fillna(0.0))
+        if speedDistance <= 0.0:
+            return Utils.speedToPace(np.nan)
+        return Utils.speedToPace(self.sessionMetrics['avg_speed'] * df['distance_gap'].iloc[-1] / speedDistance)
     
     #%% Data augmentation functions
     def importWeather(self):
@@ -594,6 +831,9 @@ class ActivityImporter:
         The units and codes are explained here https://dev.meteostat.net/formats.html#time-format
         """
         
+        # Import here so batch imports without weather don't pay the import time
+        from meteostat import Point, Hourly
+        
         # This function works only for running session and not Treadmill
         if 'start_position_lat_deg' in self.sessionMetrics.keys() and 'start_position_long_deg' in self.sessionMetrics.keys():
             try:
@@ -639,6 +879,27 @@ class ActivityImporter:
             self.weatherMetrics['WindSpeed_kph'] = np.nan
             self.weatherMetrics['WindGustSpeed_kph'] = np.nan
             self.weatherMetrics['Condition'] = ""
+    
+    def correctElevation(self, elevationCorrector):
+        """
+        Adds the altitude_dem channel sampled from the DEM of an ElevationCorrector
+        at every position of the track. Then computes the total ascent and descent
+        from it with hysteresis, which are much more consistent between runs of
+        the same route than the barometric ones.
+        """
+        df = self.data
+        if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns):
+            df['altitude_dem'] = elevationCorrector.sampleElevation(df['position_lat_deg'].values, df['position_long_deg'].values)
+        else:
+            df['altitude_dem'] = np.nan # Treadmill
+        # Grade adjusted channels now use the DEM altitude
+        self.data = Utils.addDerivedChannels(df)
+        
+        (totalAscent, totalDescent) = elevationCorrector.getAscentDescent(df['altitude_dem'].values)
+        self.elevationMetrics = dict()
+        self.elevationMetrics['TotalAscent_DEM'] = totalAscent
+        self.elevationMetrics['TotalDescent_DEM'] = totalDescent
+        self.ObjInfo['hasDEMAltitude'] = True
             
     #%% Static methods
     @staticmethod
@@ -733,40 +994,27 @@ class ActivityImporter:
         # Convert the pace array to a speed array then get length of each section
         # This length must be increased to the next second so we get full seconds
         # that is the sampling frequency of the watches.
-        speedArray = Utils.paceToSpeed(paceArray)
-        timeArray = distanceArray / speedArray
+        speedArray = np.asarray(Utils.paceToSpeed(paceArray), dtype=float)
+        timeArray = np.asarray(distanceArray) / speedArray
         timeArrayInt = np.ceil(timeArray)
         Nsections = len(distanceArray)
         
-        # Create arrays of time, speed, and distance
-        startingTime = 0.0
-        startingDistance = 0.0
-        totalTimeArray = np.array([]) # This empty pre-allocation is bad practice
-        totalSpeedArray = np.array([])
-        totalDistanceArray = np.array([])
-        totalPaceArray = np.array([], dtype='datetime64')
-        for iSection in np.arange(Nsections):
-            # Creates the arrays in the referential of the section alone
-            # The time must be dealt depending on whether this is the first section or not
-            # If first section, we include 0s for 0m.
-            # Else we start at 1s that has been traveled at speed.
-            if iSection == 0:
-                thisTimeArray = np.arange(0, timeArrayInt[iSection]+1)
-            else:
-                thisTimeArray = np.arange(1, timeArrayInt[iSection]+1)
-            thisSpeedArray = np.ones(thisTimeArray.size) * speedArray[iSection]
-            thisPaceArray = np.repeat(paceArray[iSection], thisTimeArray.size)
-            thisDistanceArray = thisTimeArray * speedArray[iSection]
-            
-            # Then convert them to global referential and assemble them
-            totalTimeArray = np.concatenate((totalTimeArray, thisTimeArray + startingTime))
-            totalSpeedArray = np.concatenate((totalSpeedArray, thisSpeedArray))
-            totalDistanceArray = np.concatenate((totalDistanceArray, thisDistanceArray + startingDistance))
-            totalPaceArray = np.concatenate((totalPaceArray, thisPaceArray))
-            
-            # Update starting time and distance
-            startingTime = thisTimeArray[-1]
-            startingDistance = thisDistanceArray[-1]
+        # Create arrays of time, speed, and distance for all sections at once
+        # The first section includes 0s for 0m. Other sections start at 1s that has been traveled at speed.
+        pointsPerSection = timeArrayInt.astype(int)
+        pointsPerSection[0] += 1
+        sectionIdx = np.repeat(np.arange(Nsections), pointsPerSection)
+        # Time in the referential of each section
+        sectionFirstPoint = np.cumsum(pointsPerSection) - pointsPerSection
+        sectionTime = np.arange(pointsPerSection.sum()) - sectionFirstPoint[sectionIdx] + (sectionIdx > 0)
+        # Each section starts at the end time and distance of the previous ones
+        sectionStartTime = np.concatenate(([0.0], np.cumsum(timeArrayInt)[:-1]))
+        sectionStartDistance = np.concatenate(([0.0], np.cumsum(timeArrayInt * speedArray)[:-1]))
+        # Then convert them to global referential
+        totalSpeedArray = speedArray[sectionIdx].astype(float)
+        totalTimeArray = (sectionTime + sectionStartTime[sectionIdx]).astype(float)
+        totalDistanceArray = sectionTime * totalSpeedArray + sectionStartDistance[sectionIdx]
+        totalPaceArray = np.asarray(paceArray)[sectionIdx]
             
         # Creates the dataFrame
         pacingDF = pd.DataFrame(data={'speed': totalSpeedArray, 'heart_rate': totalSpeedArray*np.nan,
@@ -11,16 +11,45 @@ Created on Fri Jul 14 22:32:35 2023
 #%% Import necessary libraries
 # Own libraries
 import Utilities.Functions as Utils
-# Graphing libraries
-import plotly.graph_objects as go
-import plotly.io as pio
-#pio.renderers.default = 'svg'
-pio.renderers.default= 'browser' # Set to render plots in a browser
-import matplotlib.pylab as pl
+from Utilities.ActivityComparator import ActivityComparator
+from Utilities.RollupStore import RollupStore
 # Data libraries
 import pandas as pd
 import numpy as np
 import datetime
+import functools
+
+#%% Graphing libraries
+# Plotly and matplotlib are slow to import so they are only loaded when the
+# first plot is created. Importing this module has no side effect on plotly.
+@functools.lru_cache(maxsize=None)
+def importGraphingLibraries():
+    """
+    Imports the graphing libraries on first call and sets plotly to render in a browser.
+    Returns the plotly graph_objects module and the matplotlib colormaps module.
+    """
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    #pio.renderers.default = 'svg'
+    pio.renderers.default= 'browser' # Set to render plots in a browser
+    import matplotlib.cm as cm
+    return (go, cm)
+
+def getMonthlyTotals(metricsDF, columnNames, rollupStore=None):
+    """
+    Returns the monthly totals of columns of metricsDF indexed by "%Y-%m".
+    They come from rollupStore if it was refreshed with the same activities and
+    columns, else from a temporary RollupStore of metricsDF, for instance when
+    metricsDF is filtered to a year or a route.
+    """
+    missingColumns = [columnName for columnName in columnNames if not columnName in metricsDF.columns]
+    if missingColumns:
+        raise ValueError(f"Columns {missingColumns} are not in the metrics, check the zones and their prefix")
+    if rollupStore is None or not rollupStore.isRefreshedWith(metricsDF, columnNames):
+        rollupStore = RollupStore()
+        rollupStore.refresh(metricsDF)
+    dfMonths = rollupStore.getRollup('month')
+    return dfMonths[columnNames].set_axis(dfMonths['Period_Start'].dt.strftime("%Y-%m"))
 
 #%% Define the ActivityPlotter class
 class ActivityPlotter:
@@ -29,7 +58,7 @@ class ActivityPlotter:
     """
     
     @staticmethod
-    def effortComparePlot(dfList, namesList, graphTitle="", baselineIdx=0):
+    def effortComparePlot(dfList, namesList, graphTitle="", baselineIdx=0, useWebGL=False, pointsPerTrace=2000):
         """
         Standard plot to compare two best efforts on a single standard plot.
         Shows pace, time difference, heart rate and elevation.
@@ -38,59 +67,54 @@ class ActivityPlotter:
         namesList contains their respective names for legends.
         graphTitle is an optional title for the graph.
         baselineIdx is the index of the baseline activity for time delta.
+        useWebGL renders the traces with Scattergl and downsamples each of them
+        to pointsPerTrace points with the LTTB algorithm. Recommended for long
+        efforts like marathons where the 1m grid gives too many points.
         """
         
-        # Make sure distanceEffort is available
-        for thisDF in dfList:
-            if not('distanceEffort' in thisDF.columns):
-                thisDF['distanceEffort'] = thisDF['distance'] - thisDF['distance'].iloc[0]
-            if not('timeEffort' in thisDF.columns):
-                thisDF['timeEffort'] = thisDF['time'] - thisDF['time'].iloc[0]
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
         
-        # Interpolates all dataFrames into the distance of the first one
-        # For the first one, it is just a copy. But others need to be recreated
-        # because they potentially have a different size
+        # Interpolates all dataFrames onto a common 1m distance grid up to the shortest one
+        # All activities are interpolated at once into arrays of shape (Nact, Ndistance)
         Nact = len(dfList)
-        dfInterp = []
-        endDistArray = [thisDF['distanceEffort'].iloc[-1] for thisDF in dfList] # Get list of distances
-        endDist = min(endDistArray)
-        xDistanceArray = np.arange(0, endDist, 1.0)
-        if xDistanceArray[-1] < endDist:
-            xDistanceArray = np.append(xDistanceArray, endDist)
-        for idx in np.arange(Nact):
-            interp_Time = np.interp(xDistanceArray, dfList[idx]["distanceEffort"], dfList[idx]["timeEffort"])
-            interp_Speed = np.interp(xDistanceArray, dfList[idx]["distanceEffort"], dfList[idx]["speed"])
-            interp_HeartRate = np.interp(xDistanceArray, dfList[idx]["distanceEffort"], dfList[idx]["heart_rate"])
-            dfInterp.append( pd.DataFrame(data = {'distance': xDistanceArray, \
-                                                  'time': interp_Time,
-                                                  'speed': interp_Speed,
-                                                  'speed_kph': interp_Speed*3.6,
-                                                  'pace': Utils.speedToPace(interp_Speed),
-                                                  'heart_rate': interp_HeartRate
-                                                } ))
+        comparator = ActivityComparator(dfList, namesList, distanceStep=1.0)
+        xDistanceArray = comparator.distance
+        interpTime = comparator.time
+        interpSpeed = comparator.speed
+        interpHeartRate = comparator.heartRate
         
         # Calculate Tdiff
-        for idx in np.arange(Nact):
-            dfInterp[idx]['timeDelta'] = dfInterp[idx]['time'] - dfInterp[baselineIdx]['time']
-        # Add column with name before merging into single dataFrame        
-        for idx in np.arange(Nact):
-            dfInterp[idx]['activityName'] = namesList[idx]
+        interpTimeDelta = comparator.getTimeDelta(baselineIdx)
         
         # Get list of times then add them to names of activities
-        endTimeList = [Utils.format_timedelta(datetime.timedelta(seconds= round(df['time'].iloc[-1]))) for df in dfInterp]
-        endTimeDeltaList = [" (" + Utils.format_timedelta(datetime.timedelta(seconds= round(df['timeDelta'].iloc[-1]))) + ")" for df in dfInterp]
+        endTimeList = [Utils.format_timedelta(datetime.timedelta(seconds= round(endTime))) for endTime in interpTime[:, -1]]
+        endTimeDeltaList = [" (" + Utils.format_timedelta(datetime.timedelta(seconds= round(endTimeDelta))) + ")" for endTimeDelta in interpTimeDelta[:, -1]]
         endTimeDeltaList[baselineIdx] = " (baseline)"
         namesListWithTime = [thisName + " - " + thisTimeStr + thisTimeDeltaStr for thisName, thisTimeStr, thisTimeDeltaStr in zip(namesList, endTimeList, endTimeDeltaList)]
+        
+        # Choose the points of each trace. All points for the standard rendering.
+        # For WebGL, each trace is downsampled with LTTB which keeps peaks and shape.
+        if useWebGL:
+            ScatterType = go.Scattergl
+            idxTimeDelta = Utils.largestTriangleThreeBuckets(xDistanceArray, interpTimeDelta, pointsPerTrace)
+            idxSpeed = Utils.largestTriangleThreeBuckets(xDistanceArray, interpSpeed, pointsPerTrace)
+            idxHeartRate = Utils.largestTriangleThreeBuckets(xDistanceArray, interpHeartRate, pointsPerTrace)
+        else:
+            ScatterType = go.Scatter
+            idxTimeDelta = np.tile(np.arange(len(xDistanceArray)), (Nact, 1))
+            idxSpeed = idxTimeDelta
+            idxHeartRate = idxTimeDelta
                         
         # Manual test
         tracesList = []
-        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in pl.cm.jet(np.linspace(0.0, 1.0, Nact))]
+        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in cm.jet(np.linspace(0.0, 1.0, Nact))]
         # Time delta
         for idx in np.arange(Nact):
             tracesList.append(
-                    go.Scatter(
-                        x= dfInterp[idx]['distance'],
-                        y= dfInterp[idx]['timeDelta'],
+                    ScatterType(
+                        x= xDistanceArray[idxTimeDelta[idx]],
+                        y= interpTimeDelta[idx, idxTimeDelta[idx]],
                         name= namesListWithTime[idx],
                         marker= dict(color= myColors[idx]),
                         legendgroup= namesList[idx],
@@ -100,9 +124,9 @@ class ActivityPlotter:
         # Pace
         for idx in np.arange(Nact):
             tracesList.append(
-                    go.Scatter(
-                        x= dfInterp[idx]['distance'],
-                        y= dfInterp[idx]['pace'],
+                    ScatterType(
+                        x= xDistanceArray[idxSpeed[idx]],
+                        y= Utils.speedToPace(interpSpeed[idx, idxSpeed[idx]]),
                         name= namesListWithTime[idx],
                         marker= dict(color= myColors[idx]),
                         legendgroup= namesList[idx],
@@ -110,12 +134,12 @@ class ActivityPlotter:
                         yaxis="y2"
                     )
                 )
-        # Pace
+        # Heart Rate
         for idx in np.arange(Nact):
             tracesList.append(
-                    go.Scatter(
-                        x= dfInterp[idx]['distance'],
-                        y= dfInterp[idx]['heart_rate'],
+                    ScatterType(
+                        x= xDistanceArray[idxHeartRate[idx]],
+                        y= interpHeartRate[idx, idxHeartRate[idx]],
                         name= namesListWithTime[idx],
                         marker= dict(color= myColors[idx]),
                         legendgroup= namesList[idx],
@@ -167,6 +191,9 @@ class ActivityPlotter:
         Takes a GarminDataImporter with imported data as input.
         """
         
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        
         # First obtain date range from the metrics
         dateRange = pd.date_range(start= gdi.activityMetricsDF["Metric_StartTime"].min(), end= gdi.activityMetricsDF["Metric_StartTime"].max(), freq = "90D")
         # Add one period to make sure we have the latest activities as well
@@ -174,7 +201,7 @@ class ActivityPlotter:
         
         # Create the colors
         NdateRanges = len(dateRange)
-        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in pl.cm.coolwarm(np.linspace(0.0, 1.0, NdateRanges))]
+        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in cm.coolwarm(np.linspace(0.0, 1.0, NdateRanges))]
         
         # Get data for each range then create a plot with the valid points
         tracesList = []
@@ -239,6 +266,9 @@ class ActivityPlotter:
         Takes a GarminDataImporter with imported data as input.
         """
         
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        
         # First obtain date range from the metrics
         dateRange = pd.date_range(start= gdi.activityMetricsDF["Metric_StartTime"].min(), end= gdi.activityMetricsDF["Metric_StartTime"].max(), freq = "90D")
         # Add one period to make sure we have the latest activities as well
@@ -246,7 +276,7 @@ class ActivityPlotter:
         
         # Create the colors
         NdateRanges = len(dateRange)
-        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in pl.cm.coolwarm(np.linspace(0.0, 1.0, NdateRanges))]
+        myColors = ["rgba({cr:.0f},{cg:.0f},{cb:.0f},{ca:.0f})".format(cr=c[0]*255,cg=c[1]*255,cb=c[2]*255,ca=c[3]*255) for c in cm.coolwarm(np.linspace(0.0, 1.0, NdateRanges))]
         
         # Get data for each range then create a plot with the valid points
         tracesList = []
@@ -304,18 +334,23 @@ class ActivityPlotter:
         fig.show()
         
     @staticmethod
-    def plotDistributionHRzones(metricsDF, HRzonesDict, prefixInMetric):
+    def plotDistributionHRzones(metricsDF, HRzonesDict, prefixInMetric, rollupStore=None):
         """
         Plots a distribution of the time spent in each HR zone for each month.
         It takes as argument the DataFrame of metrics, the dictionary defining
         the HR zones, as well as their prefix in the metrics column names.
+        rollupStore is an optional RollupStore, used if refreshed with the same
+        activities as metricsDF (see getMonthlyTotals).
         """
         
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        
         # Create list of column names for HR zones
         HRzoneNames = list(HRzonesDict.keys())
         HRcolumnNames = [prefixInMetric + zoneName for zoneName in HRzoneNames]
         # Get total per zone for each year-month
-        sumTimePerMonth = metricsDF.groupby(metricsDF['Metric_StartTime'].dt.strftime("%Y-%m"))[HRcolumnNames].sum()
+        sumTimePerMonth = getMonthlyTotals(metricsDF, HRcolumnNames, rollupStore)
         # Create Sum of time in each zone to get ratios
         sumTimePerMonth['Total'] = sumTimePerMonth[HRcolumnNames].sum(axis=1)
         
@@ -357,18 +392,23 @@ class ActivityPlotter:
         fig.show()
         
     @staticmethod
-    def plotDistributionPaceZones(metricsDF, PaceZonesDict, prefixInMetric):
+    def plotDistributionPaceZones(metricsDF, PaceZonesDict, prefixInMetric, rollupStore=None):
         """
         Plots a distribution of the time spent in each Pace zone for each month.
         It takes as argument the DataFrame of metrics, the dictionary defining
         the Pace zones, as well as their prefix in the metrics column names.
+        rollupStore is an optional RollupStore, used if refreshed with the same
+        activities as metricsDF (see getMonthlyTotals).
         """
         
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        
         # Create list of column names for HR zones
         PaceZoneNames = list(PaceZonesDict.keys())
         PaceColumnNames = [prefixInMetric + zoneName for zoneName in PaceZoneNames]
         # Get total per zone for each year-month
-        sumTimePerMonth = metricsDF.groupby(metricsDF['Metric_StartTime'].dt.strftime("%Y-%m"))[PaceColumnNames].sum()
+        sumTimePerMonth = getMonthlyTotals(metricsDF, PaceColumnNames, rollupStore)
         # Create Sum of time in each zone to get ratios
         sumTimePerMonth['Total'] = sumTimePerMonth[PaceColumnNames].sum(axis=1)
         
@@ -407,4 +447,99 @@ class ActivityPlotter:
         fig = go.Figure(data= tracesList, layout= layout)
         fig.update_layout(title= "Distribution of time spent in each Pace zone", font_size=20, barmode='stack', xaxis_tickangle=-45)
         fig.update_xaxes(title_text= "Month Year")
-        fig.show()
\ No newline at end of file
+        fig.show()
+        
+    @staticmethod
+    def heatmapPlot(heatmapTiles, latMin=None, latMax=None, lonMin=None, lonMax=None, zoom=None, maxPixels=2048, colorMapName='hot', graphTitle="Heatmap of all activities"):
+        """
+        Plots the heatmap of all activities from a HeatmapTiles object as a single
+        image layer over a map, instead of millions of points.
+        The bounds default to all the activities in the heatmap and the zoom
+        defaults to the highest zoom fitting in an image of maxPixels.
+        Counts are shown on a log scale and empty pixels are transparent.
+        """
+        
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        import matplotlib
+        import matplotlib.image
+        import base64
+        import io
+        
+        # Get the image of counts for the bounds
+        if latMin is None:
+            (latMin, latMax, lonMin, lonMax) = heatmapTiles.getBounds()
+        if zoom is None:
+            zoom = heatmapTiles.getZoomForBounds(latMin, latMax, lonMin, lonMax, maxPixels)
+        (image, (imageLatMin, imageLatMax, imageLonMin, imageLonMax)) = heatmapTiles.renderImage(latMin, latMax, lonMin, lonMax, zoom)
+        
+        # Log scale colors with transparency for pixels without any point
+        intensity = np.log1p(image) / max(np.log1p(image.max()), 1.0)
+        rgbaImage = matplotlib.colormaps[colorMapName](0.25 + 0.75*intensity)
+        rgbaImage[:, :, 3] = np.where(image > 0, 0.4 + 0.6*intensity, 0.0)
+        pngBuffer = io.BytesIO()
+        matplotlib.image.imsave(pngBuffer, rgbaImage, format='png')
+        imageSource = "data:image/png;base64," + base64.b64encode(pngBuffer.getvalue()).decode()
+        
+        # Image layer with its four corners from top left, clockwise
+        layout = go.Layout(
+            map=dict(
+                style= "carto-darkmatter",
+                center= dict(lat= (imageLatMin + imageLatMax)/2, lon= (imageLonMin + imageLonMax)/2),
+                zoom= max(zoom - 1 - np.log2(image.shape[1] / 512), 0) if image.shape[1] > 0 else zoom - 1,
+                layers=[dict(
+                    sourcetype= "image",
+                    source= imageSource,
+                    coordinates= [[imageLonMin, imageLatMax], [imageLonMax, imageLatMax],
+                                  [imageLonMax, imageLatMin], [imageLonMin, imageLatMin]]
+                    )]
+                )
+            )
+        
+        # Finally create the figure with an empty trace to show the map
+        fig = go.Figure(data= [go.Scattermap(lat= [], lon= [], mode= "markers")], layout= layout)
+        fig.update_layout(title= graphTitle, font_size=20, margin= dict(l=0, r=0, b=0))
+        fig.show()
+        
+    @staticmethod
+    def trainingLoadPlot(dailyDF, graphTitle="Training load"):
+        """
+        Plots the fitness (CTL), fatigue (ATL) and form (TSB) from the daily
+        DataFrame of a TrainingLoad, with the daily load as bars.
+        """
+        
+        # Get the graphing libraries
+        (go, cm) = importGraphingLibraries()
+        
+        # Lines for CTL and ATL, bars for the daily load and the form
+        tracesList = [
+            go.Bar(x= dailyDF.index, y= dailyDF['Load'], name= "Daily Load", marker_color= "lightgray", yaxis= "y"),
+            go.Scatter(x= dailyDF.index, y= dailyDF['CTL'], name= "Fitness (CTL)", line= dict(color= "royalblue", width= 3), yaxis= "y"),
+            go.Scatter(x= dailyDF.index, y= dailyDF['ATL'], name= "Fatigue (ATL)", line= dict(color= "deeppink", width= 2), yaxis= "y"),
+            go.Bar(x= dailyDF.index, y= dailyDF['TSB'], name= "Form (TSB)",
+                   marker_color= np.where(dailyDF['TSB'] >= 0, "seagreen", "orange"), yaxis= "y2")
+            ]
+        # Create the Layout
+        layout = go.Layout(
+            legend=dict(
+                orientation="h",
+                yanchor= "bottom",
+                y= 1.02,
+                xanchor= "right",
+                x= 1,
+                font_size= 13
+            ),
+            yaxis=dict(
+                domain=[0.35, 1.00],
+                title= "Load"
+            ),
+            yaxis2=dict(
+                domain=[0.00, 0.30],
+                title= "Form"
+            )
+        )
+        # Finally create the figure
+        fig = go.Figure(data= tracesList, layout= layout)
+        fig.update_layout(title= graphTitle, font_size=20, bargap=0)
+        fig.update_xaxes(title_text= "Date")
+        fig.show()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+ChannelSketches class
+Class to store the distribution of the main channels (pace, heart rate, cadence
+and grade) of each activity as a compact histogram with fixed bins, so
+percentiles over any period or selection of activities are computed without
+loading the time series again.
+
+Histograms with the same bins are merged by adding them, so the percentiles of
+a month or of all easy runs of a quarter only need a sum of a few hundred values
+per activity, whatever the number of samples. Samples are weighted by time
+(trapezoidal weights) so the percentiles are the ones of the time spent, and
+they are exact to the width of a bin.
+
+Created on Tue Oct 27 10:21:47 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+import pickle
+
+
+#%% Define the ChannelSketches class
+class ChannelSketches:
+    """
+    This class holds one histogram per activity and channel, in a matrix per
+    channel with one row per activity.
+    """
+
+    # Bins of each channel: (lower bound, upper bound, bin width). Values outside are put in the first or last bin
+    defaultChannelBins = {'heart_rate': (30.0, 230.0, 1.0), # bpm
+                          'cadence_spm': (0.0, 250.0, 1.0), # steps per minute
+                          'pace': (120.0, 900.0, 1.0), # seconds per km, from 2:00/km to 15:00/km
+                          'grade': (-0.5, 0.5, 0.005)} # ratio, 0.1 is 10%
+
+    def __init__(self, channelBins=None):
+        """
+        Constructor.
+        channelBins is a dictionnary with the (lower bound, upper bound, bin width)
+        of each channel, defaultChannelBins by default.
+        """
+        self.channelBins = dict(ChannelSketches.defaultChannelBins) if channelBins is None else channelBins
+        self.binEdges = {channelName: np.arange(low, high + binWidth/2, binWidth) for channelName, (low, high, binWidth) in self.channelBins.items()}
+
+        self.processedFiles = set()
+        self.filePaths = []
+        self.histograms = {channelName: np.zeros((0, len(binEdges) - 1), dtype=np.float32) for channelName, binEdges in self.binEdges.items()}
+
+    #%% Sketches of the activities
+    @staticmethod
+    def getChannelValues(df, channelName):
+        """
+        Returns the values of a channel of an activity, or None if not available.
+        The pace is in seconds per km, calculated from the speed.
+        """
+        if channelName == 'pace':
+            if not 'speed' in df.columns:
+                return None
+            with np.errstate(divide='ignore'):
+                return 1000.0 / df['speed'].values
+        if not channelName in df.columns:
+            return None
+        return df[channelName].values.astype(float)
+
+    def computeSketches(self, df):
+        """
+        Returns the histogram of each channel of an activity, with the time in
+        seconds spent in each bin. Channels not available have empty histograms.
+        """
+        weights = Utils.trapezoidWeights(df['time'].values)
+        sketches = dict()
+        for channelName, binEdges in self.binEdges.items():
+            values = ChannelSketches.getChannelValues(df, channelName)
+            if values is None:
+                sketches[channelName] = np.zeros(len(binEdges) - 1)
+                continue
+            isValid = ~np.isnan(values)
+            idxBins = np.clip(np.searchsorted(binEdges, values[isValid], side='right') - 1, 0, len(binEdges) - 2)
+            sketches[channelName] = np.bincount(idxBins, weights=weights[isValid], minlength=len(binEdges) - 1)
+        return sketches
+
+    def updateFromImporter(self, dataImporter):
+        """
+        Adds the sketches of the activities of a data importer that are not
+        processed yet. Returns the number of activities added.
+        """
+        newSketches = {channelName: [] for channelName in self.binEdges.keys()}
+        newFiles = []
+        for activity in dataImporter.activityImporters:
+            filePath = activity.fileInfo['filePath']
+            if filePath in self.processedFiles:
+                continue
+            for channelName, sketch in self.computeSketches(activity.data).items():
+                newSketches[channelName].append(sketch)
+            newFiles.append(filePath)
+
+        if newFiles:
+            for channelName in self.binEdges.keys():
+                self.histograms[channelName] = np.vstack([self.histograms[channelName]] + newSketches[channelName]).astype(np.float32)
+            self.filePaths.extend(newFiles)
+            self.processedFiles.update(newFiles)
+        return len(newFiles)
+
+    #%% Percentiles
+    def getPercentiles(self, channelName, percentiles, metricsDF=None, groupBy=None):
+        """
+        Returns the percentiles (0 to 100) of a channel over the activities of
+        metricsDF, all activities by default, matched on File_Path.
+        Without groupBy, returns an array with the percentiles of all the activities
+        merged. With groupBy, values aligned with metricsDF like
+        metricsDF['Metric_StartTime'].dt.to_period('M'), returns a DataFrame with
+        one row per group and one column per percentile (P50, P95, etc.).
+        Percentiles of the pace are returned as pace (datetime) like the other paces.
+        """
+        percentiles = np.atleast_1d(np.asarray(percentiles, dtype=float))
+        if metricsDF is None:
+            histograms = self.histograms[channelName].astype(float)
+        else:
+            idxRows = pd.Index(self.filePaths).get_indexer(metricsDF['File_Path'])
+            histograms = np.where((idxRows >= 0)[:, np.newaxis], self.histograms[channelName][idxRows], 0.0)
+
+        if groupBy is None:
+            mergedHistograms = histograms.sum(axis=0)[np.newaxis, :]
+        else:
+            groupedDF = pd.DataFrame(histograms).groupby(np.asarray(groupBy)).sum()
+            mergedHistograms = groupedDF.values
+        values = ChannelSketches.histogramPercentiles(self.binEdges[channelName], mergedHistograms, percentiles)
+        if channelName == 'pace':
+            values = pd.to_datetime(values.ravel(), unit='s').values.reshape(values.shape)
+
+        if groupBy is None:
+            return values[0]
+        return pd.DataFrame(values, index=groupedDF.index, columns=['P' + f"{percentile:g}" for percentile in percentiles])
+
+    @staticmethod
+    def histogramPercentiles(binEdges, histograms, percentiles):
+        """
+        Percentiles of several histograms (one per row) at once, with a linear
+        interpolation in each bin. The normalised cumulative sums of all rows are
+        put one after the other with an offset of 2 so a single searchsorted finds
+        the bin of all percentiles. Empty histograms give NaN.
+        """
+        Nrows = histograms.shape[0]
+        totals = histograms.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cumulatedFractions = np.concatenate((np.zeros((Nrows, 1)), np.cumsum(histograms, axis=1)), axis=1) / totals[:, np.newaxis]
+        offsets = 2.0 * np.arange(Nrows)
+        cumulatedAll = (np.nan_to_num(cumulatedFractions) + offsets[:, np.newaxis]).ravel()
+        edgesAll = np.tile(binEdges, Nrows)
+        queries = (percentiles[np.newaxis, :] / 100.0 + offsets[:, np.newaxis]).ravel()
+        values = Utils.interpolateAtSortedPositions(cumulatedAll, edgesAll, queries).reshape(Nrows, len(percentiles))
+        values[totals <= 0.0, :] = np.nan
+        return values
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the sketches into a pickle file.
+        """
+        with open(filePath, 'wb') as saveFile:
+            pickle.dump(self.__dict__, saveFile)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads sketches saved with the save method.
+        """
+        sketches = ChannelSketches()
+        with open(filePath, 'rb') as saveFile:
+            sketches.__dict__.update(pickle.load(saveFile))
+        return sketches
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+CriticalSpeedModel class
+Class to fit the critical speed model on the best efforts of all activities over
+rolling date windows, and to predict race times to compare with the predictions
+of Garmin (df_RacePred of the GarminDataImporter).
+
+The critical speed model says the distance covered at maximum effort for a
+duration t is d = CS * t + D', with CS the critical speed (close to the speed
+at lactate threshold) and D' the distance that can be covered above it.
+https://en.wikipedia.org/wiki/Critical_speed
+
+For each day, the best distance for each duration of the time best efforts
+(bestEffortData['Time_Distances']) over the window before that day is taken,
+then the model is fitted by least squares. All days are fitted at once.
+
+Created on Sun Oct 25 09:37:26 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+
+
+#%% Define the CriticalSpeedModel class
+class CriticalSpeedModel:
+    """
+    This class fits the critical speed model for every day of the history and
+    predicts race times with the model and with the Riegel formula
+    (T2 = T1 * (D2 / D1)^1.06) from the best efforts of the window.
+    """
+
+    # Race distances with the same names as the predictions of Garmin
+    raceNames = ['5K', '10K', 'Half', 'Marathon']
+    raceDistances = np.array([5.0e3, 10.0e3, Utils.halfMarathonDistance, Utils.fullMarathonDistance])
+
+    def __init__(self, windowDays=90, minDuration=120.0, maxDuration=1200.0, riegelMinDuration=300.0, riegelExponent=1.06, minEfforts=3):
+        """
+        Constructor.
+        windowDays is the number of days of best efforts used for each fit.
+        minDuration and maxDuration are the durations in seconds of the best efforts
+        used in the fit: the model is only valid for efforts from about 2 to 20 minutes.
+        riegelMinDuration is the shortest effort used for the Riegel predictions,
+        shorter efforts give too optimistic predictions for long races.
+        minEfforts is the minimum number of durations with a best effort to fit the model.
+        """
+        self.windowDays = windowDays
+        self.minDuration = minDuration
+        self.maxDuration = maxDuration
+        self.riegelMinDuration = riegelMinDuration
+        self.riegelExponent = riegelExponent
+        self.minEfforts = minEfforts
+
+        self.predictionsDF = CriticalSpeedModel.getEmptyPredictions()
+
+    #%% Best efforts
+    @staticmethod
+    def getBestEffortMatrix(dataImporter, gradeAdjusted=False):
+        """
+        Returns the best effort matrix of all activities with best efforts:
+        (startTimes, timesValues, distancesMatrix) with the start time of each
+        activity, the durations in seconds and the best distance of each activity
+        (rows) for each duration (columns), 0 when the activity is too short.
+        """
+        (startTimes, distancesList, timesValues) = ([], [], None)
+        for idxActivity, activity in enumerate(dataImporter.activityImporters):
+            if not activity.ObjInfo['hasBestEfforts'] or (gradeAdjusted and not activity.ObjInfo['hasGradeAdjustedEfforts']):
+                continue
+            bestEffortData = activity.bestEffortDataGAP if gradeAdjusted else activity.bestEffortData
+            timesValues = np.asarray(bestEffortData['Time_Times'], dtype=float)
+            distancesList.append(bestEffortData['Time_Distances'])
+            startTimes.append(dataImporter.activityMetricsDF.loc[idxActivity, 'Metric_StartTime'])
+        if timesValues is None:
+            return (pd.Series([], dtype='datetime64[ns]'), np.zeros(0), np.zeros((0, 0)))
+        return (pd.Series(startTimes), timesValues, np.vstack(distancesList).astype(float))
+
+    @staticmethod
+    def getWindowBestDistances(startTimes, distancesMatrix, windowDays, startDate=None, endDate=None):
+        """
+        Returns a DataFrame with one row per day and one column per duration with
+        the best distance over the windowDays days up to that day included.
+        """
+        startTimes = pd.to_datetime(startTimes)
+        if startTimes.dt.tz is not None:
+            startTimes = startTimes.dt.tz_convert(None)
+        activityDays = startTimes.dt.normalize().values
+        dailyBest = pd.DataFrame(distancesMatrix).groupby(activityDays).max()
+
+        firstDay = pd.Timestamp(startDate).normalize() if startDate is not None else dailyBest.index.min()
+        lastDay = pd.Timestamp(endDate).normalize() if endDate is not None else dailyBest.index.max()
+        allDays = pd.date_range(min(firstDay, dailyBest.index.min()), lastDay, freq='D')
+        windowBest = dailyBest.reindex(allDays).rolling(windowDays, min_periods=1).max()
+        return windowBest.loc[windowBest.index >= firstDay]
+
+    #%% Fits
+    @staticmethod
+    def fitCriticalSpeed(timesValues, distancesMatrix):
+        """
+        Fits d = CS * t + D' by least squares for each row of the distances matrix
+        at once, ignoring the NaN. Returns (CS, Dprime, Nefforts) arrays, NaN for
+        rows with less than two efforts.
+        """
+        isValid = ~np.isnan(distancesMatrix)
+        t = np.where(isValid, timesValues[np.newaxis, :], 0.0)
+        d = np.where(isValid, distancesMatrix, 0.0)
+        Nefforts = isValid.sum(axis=1)
+        (sumT, sumD, sumTT, sumTD) = (t.sum(axis=1), d.sum(axis=1), (t*t).sum(axis=1), (t*d).sum(axis=1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            CS = (Nefforts * sumTD - sumT * sumD) / (Nefforts * sumTT - sumT**2)
+            Dprime = (sumD - CS * sumT) / Nefforts
+        CS[Nefforts < 2] = np.nan
+        Dprime[Nefforts < 2] = np.nan
+        return (CS, Dprime, Nefforts)
+
+    def fit(self, startTimes, timesValues, distancesMatrix, startDate=None, endDate=None):
+        """
+        Fits the model for every day from the best effort matrix and predicts the
+        race times. Returns a DataFrame indexed by day with CS_Speed (m/s), CS_Pace,
+        Dprime (m), CS_Nefforts and for each race raceTime<Race>_CS and
+        raceTime<Race>_Riegel in seconds.
+        """
+        if len(startTimes) == 0:
+            self.predictionsDF = CriticalSpeedModel.getEmptyPredictions()
+            return self.predictionsDF
+        distancesMatrix = np.where(distancesMatrix > 0.0, distancesMatrix, np.nan) # Best efforts longer than the activity are 0
+        windowBest = CriticalSpeedModel.getWindowBestDistances(startTimes, distancesMatrix, self.windowDays, startDate, endDate)
+        windowDistances = windowBest.values
+
+        # Critical speed on the efforts from minDuration to maxDuration
+        isInFit = (self.minDuration <= timesValues) & (timesValues <= self.maxDuration)
+        (CS, Dprime, Nefforts) = CriticalSpeedModel.fitCriticalSpeed(timesValues[isInFit], windowDistances[:, isInFit])
+        isFitted = (Nefforts >= self.minEfforts) & (CS > 0.0)
+        CS[~isFitted] = np.nan
+        Dprime[~isFitted] = np.nan
+
+        predictionsDF = pd.DataFrame(index=windowBest.index)
+        predictionsDF.index.name = 'Date'
+        predictionsDF['CS_Speed'] = CS
+        predictionsDF['CS_Pace'] = Utils.speedToPace(CS)
+        predictionsDF['Dprime'] = Dprime
+        predictionsDF['CS_Nefforts'] = Nefforts
+
+        # Riegel: best prediction among the efforts of the window, for all days and races at once
+        isInRiegel = timesValues >= self.riegelMinDuration
+        with np.errstate(invalid='ignore'):
+            riegelTimes = timesValues[np.newaxis, isInRiegel, np.newaxis] * \
+                          (CriticalSpeedModel.raceDistances[np.newaxis, np.newaxis, :] / windowDistances[:, isInRiegel, np.newaxis])**self.riegelExponent
+        riegelTimes = np.where(np.isnan(riegelTimes), np.inf, riegelTimes).min(axis=1)
+        riegelTimes[np.isinf(riegelTimes)] = np.nan
+
+        for iRace, raceName in enumerate(CriticalSpeedModel.raceNames):
+            predictionsDF['raceTime' + raceName + '_CS'] = (CriticalSpeedModel.raceDistances[iRace] - Dprime) / CS
+            predictionsDF['raceTime' + raceName + '_Riegel'] = riegelTimes[:, iRace]
+
+        self.predictionsDF = predictionsDF
+        return predictionsDF
+
+    @staticmethod
+    def getEmptyPredictions():
+        """
+        Returns the predictions DataFrame without any day, before a fit or when
+        there are no best efforts. compareWithRacePredictions then gives NaN.
+        """
+        columnNames = ['CS_Speed', 'CS_Pace', 'Dprime', 'CS_Nefforts']
+        for raceName in CriticalSpeedModel.raceNames:
+            columnNames += ['raceTime' + raceName + '_CS', 'raceTime' + raceName + '_Riegel']
+        predictionsDF = pd.DataFrame(columns=columnNames, index=pd.DatetimeIndex([], name='Date'), dtype=float)
+        predictionsDF['CS_Pace'] = predictionsDF['CS_Pace'].astype('datetime64[ns]')
+        return predictionsDF
+
+    def fitFromImporter(self, dataImporter, startDate=None, endDate=None, gradeAdjusted=False):
+        """
+        Fits the model for every day of the activities of a data importer.
+        """
+        (startTimes, timesValues, distancesMatrix) = CriticalSpeedModel.getBestEffortMatrix(dataImporter, gradeAdjusted)
+        return self.fit(startTimes, timesValues, distancesMatrix, startDate, endDate)
+
+    #%% Comparison with Garmin
+    def compareWithRacePredictions(self, df_RacePred):
+        """
+        Aligns the predictions to the race predictions of Garmin (df_RacePred of the
+        GarminDataImporter) with the last fit before each Garmin prediction.
+        Returns df_RacePred with the prediction columns added.
+        """
+        dfGarmin = df_RacePred.reset_index()
+        timestamps = pd.to_datetime(dfGarmin['timestamp'])
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(None)
+        dfGarmin['Date'] = timestamps.astype('datetime64[ns]')
+        dfPredictions = self.predictionsDF.reset_index()
+        dfPredictions['Date'] = dfPredictions['Date'].astype('datetime64[ns]')
+        dfMerged = pd.merge_asof(dfGarmin.sort_values('Date'), dfPredictions, on='Date', direction='backward')
+        return dfMerged.set_index('timestamp')
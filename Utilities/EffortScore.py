@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+EffortScoreEngine class
+Class to compute effort scores (TRIMP, relative effort, etc.) of all activities
+from their heart rate, without importing the FIT files again when a formula or
+the HR zones change.
+
+Each activity is stored once as a histogram of the time spent at each heart rate
+(1 bpm bins by default). The histograms of all activities form a matrix so each
+formula is calculated for all activities at once. The time in each bin uses the
+same trapezoidal integration as processTimeinHRzones of the ActivityImporter.
+
+Created on Sat Oct 24 10:12:51 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+import pickle
+
+
+#%% Define the EffortScoreEngine class
+class EffortScoreEngine:
+    """
+    This class holds the heart rate histograms of all activities and the effort
+    formulas. A formula is a function taking the heart rate of each bin (B,), the
+    time histograms in seconds (N, B) and the user DataFrame (N rows with the
+    RestingHeartRate, MaxHeartRate and Gender columns) and returning N scores.
+    """
+
+    def __init__(self, binWidth=1.0, maxHeartRate=250.0, defaultRestingHeartRate=60.0, defaultMaxHeartRate=190.0):
+        """
+        Constructor.
+        binWidth is the width of the heart rate bins in bpm and maxHeartRate the
+        upper bound of the last bin (higher values are put in the last bin).
+        The default heart rates are used for the activities without user profile.
+        """
+        self.binWidth = binWidth
+        self.heartRates = np.arange(0.0, maxHeartRate, binWidth) # Lower bound of each bin
+        self.defaultRestingHeartRate = defaultRestingHeartRate
+        self.defaultMaxHeartRate = defaultMaxHeartRate
+
+        self.processedFiles = set()
+        self.filePaths = []
+        self.timeHistograms = np.zeros((0, len(self.heartRates)))
+        self.userDF = pd.DataFrame(columns=['RestingHeartRate', 'MaxHeartRate', 'Gender'])
+
+        self.formulas = dict()
+        self.registerFormula('TRIMP_Banister', EffortScoreEngine.banisterTRIMP)
+        self.registerFormula('TRIMP_Edwards', EffortScoreEngine.edwardsTRIMP)
+
+    #%% Histograms
+    def computeHistogram(self, timeArray, heartRate):
+        """
+        Returns the time in seconds spent in each heart rate bin of an activity.
+        Samples without heart rate are ignored, like in processTimeinHRzones.
+        """
+        heartRate = np.asarray(heartRate, dtype=float)
+        weights = Utils.trapezoidWeights(timeArray)
+        isValid = ~np.isnan(heartRate)
+        idxBins = np.clip(np.floor(heartRate[isValid] / self.binWidth).astype(int), 0, len(self.heartRates) - 1)
+        return np.bincount(idxBins, weights=weights[isValid], minlength=len(self.heartRates))
+
+    def addActivities(self, filePaths, histograms, restingHeartRates, maxHeartRates, genders):
+        """
+        Adds the histograms of several activities at once, with their user profile.
+        Missing heart rates of the profile are replaced by the default ones.
+        """
+        if len(filePaths) == 0:
+            return
+        self.filePaths.extend(filePaths)
+        self.processedFiles.update(filePaths)
+        self.timeHistograms = np.vstack((self.timeHistograms, np.vstack(histograms)))
+        dfNewUsers = pd.DataFrame(data={'RestingHeartRate': pd.to_numeric(restingHeartRates, errors='coerce'),
+                                        'MaxHeartRate': pd.to_numeric(maxHeartRates, errors='coerce'),
+                                        'Gender': genders})
+        dfNewUsers['RestingHeartRate'] = dfNewUsers['RestingHeartRate'].fillna(self.defaultRestingHeartRate)
+        dfNewUsers['MaxHeartRate'] = dfNewUsers['MaxHeartRate'].fillna(self.defaultMaxHeartRate)
+        self.userDF = pd.concat([self.userDF, dfNewUsers], ignore_index=True) if len(self.userDF) > 0 else dfNewUsers
+
+    def updateFromImporter(self, dataImporter):
+        """
+        Adds the activities of a data importer (GarminDataImporter or
+        WatchOffloadDataImporter) that are not in the engine yet. The user profile
+        comes from the User_ columns of activityMetricsDF.
+        Returns the number of activities added.
+        """
+        metricsDF = dataImporter.activityMetricsDF
+        (filePaths, histograms, idxActivities) = ([], [], [])
+        for idxActivity, activity in enumerate(dataImporter.activityImporters):
+            filePath = activity.fileInfo['filePath']
+            if filePath in self.processedFiles:
+                continue
+            df = activity.data
+            if 'heart_rate' in df.columns:
+                histograms.append(self.computeHistogram(df['time'].values, df['heart_rate'].values))
+            else:
+                histograms.append(np.zeros(len(self.heartRates)))
+            filePaths.append(filePath)
+            idxActivities.append(idxActivity)
+
+        dfUsers = metricsDF.reindex(index=idxActivities, columns=['User_RestingHeartRate', 'User_MaxHeartRate', 'User_Gender'])
+        self.addActivities(filePaths, histograms, dfUsers['User_RestingHeartRate'].values,
+                           dfUsers['User_MaxHeartRate'].values, dfUsers['User_Gender'].values)
+        return len(filePaths)
+
+    def getTimeInZones(self, HRzones):
+        """
+        Returns a DataFrame of the time in seconds spent in each zone by all
+        activities. HRzones is a dictionnary like for processTimeinHRzones, the
+        bounds of each zone are included.
+        """
+        zoneMatrix = np.column_stack([(zoneBnds[0] <= self.heartRates) & (self.heartRates <= zoneBnds[1]) for zoneBnds in HRzones.values()])
+        return pd.DataFrame(self.timeHistograms @ zoneMatrix, index=self.filePaths, columns=list(HRzones.keys()))
+
+    #%% Formulas
+    def registerFormula(self, formulaName, formula):
+        """
+        Adds a formula, or replaces the one with the same name. Scores are
+        exported in the column Effort_ + formulaName.
+        """
+        self.formulas[formulaName] = formula
+
+    def registerZoneWeightedFormula(self, formulaName, HRzones, weightsPerMinute):
+        """
+        Adds a formula summing the minutes in each HR zone times a weight, like the
+        relative effort of Strava. HRzones is a dictionnary like for
+        processTimeinHRzones and weightsPerMinute the list of weights of the zones.
+        """
+        zoneMatrix = np.column_stack([(zoneBnds[0] <= self.heartRates) & (self.heartRates <= zoneBnds[1]) for zoneBnds in HRzones.values()])
+        binWeights = zoneMatrix @ np.asarray(weightsPerMinute, dtype=float) / 60.0
+        self.registerFormula(formulaName, lambda heartRates, timeHistograms, userDF: timeHistograms @ binWeights)
+
+    @staticmethod
+    def banisterTRIMP(heartRates, timeHistograms, userDF):
+        """
+        Banister TRIMP: minutes times the heart rate reserve ratio times an
+        exponential weighting depending on the gender.
+        https://fellrnr.com/wiki/TRIMP
+        """
+        restingHeartRate = userDF['RestingHeartRate'].values.astype(float)[:, np.newaxis]
+        maxHeartRate = userDF['MaxHeartRate'].values.astype(float)[:, np.newaxis]
+        heartRateRatio = np.clip((heartRates[np.newaxis, :] - restingHeartRate) / (maxHeartRate - restingHeartRate), 0.0, 1.0)
+        isFemale = (userDF['Gender'].values == 'female')[:, np.newaxis]
+        weighting = np.where(isFemale, 0.86 * np.exp(1.67 * heartRateRatio), 0.64 * np.exp(1.92 * heartRateRatio))
+        return np.sum(timeHistograms / 60.0 * heartRateRatio * weighting, axis=1)
+
+    @staticmethod
+    def edwardsTRIMP(heartRates, timeHistograms, userDF):
+        """
+        Edwards TRIMP: minutes in five zones of 10% of the maximum heart rate from
+        50%, weighted from 1 to 5. Time below 50% does not count.
+        """
+        maxHeartRate = userDF['MaxHeartRate'].values.astype(float)[:, np.newaxis]
+        zoneWeights = np.clip(np.floor((heartRates[np.newaxis, :] / maxHeartRate - 0.5) / 0.1) + 1.0, 0.0, 5.0)
+        return np.sum(timeHistograms / 60.0 * zoneWeights, axis=1)
+
+    #%% Scores
+    def computeScores(self, formulaNames=None):
+        """
+        Computes the scores of all activities for the given formulas, all by default.
+        Returns a DataFrame with the file path as index and a column Effort_ + name
+        for each formula. Activities without heart rate have a score of 0.
+        """
+        if formulaNames is None:
+            formulaNames = list(self.formulas.keys())
+        scoresDF = pd.DataFrame(index=pd.Index(self.filePaths, name='File_Path'))
+        for formulaName in formulaNames:
+            scoresDF['Effort_' + formulaName] = self.formulas[formulaName](self.heartRates, self.timeHistograms, self.userDF)
+        return scoresDF
+
+    def addScoresToMetrics(self, metricsDF, formulaNames=None):
+        """
+        Adds the Effort_ columns to a metrics DataFrame, matched on File_Path.
+        Activities not in the engine get NaN. Returns the DataFrame.
+        """
+        scoresDF = self.computeScores(formulaNames)
+        for columnName in scoresDF.columns:
+            metricsDF[columnName] = metricsDF['File_Path'].map(scoresDF[columnName]).values
+        return metricsDF
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the histograms and user profiles into a pickle file. The formulas
+        are not saved as they can be functions defined in a script, the default
+        ones are registered again when loading.
+        """
+        saveDict = {key: value for key, value in self.__dict__.items() if key != 'formulas'}
+        with open(filePath, 'wb') as saveFile:
+            pickle.dump(saveDict, saveFile)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads an engine saved with the save method.
+        """
+        engine = EffortScoreEngine()
+        with open(filePath, 'rb') as saveFile:
+            engine.__dict__.update(pickle.load(saveFile))
+        return engine
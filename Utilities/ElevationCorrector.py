@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+ElevationCorrector class
+Class to correct the altitude of activities with a Digital Elevation Model (DEM)
+stored locally. The barometric and GPS altitudes are noisy so the total ascent
+varies a lot between runs of the same loop, whereas the DEM gives the same
+altitude at the same place.
+
+The DEM is a folder of SRTM .hgt tiles (for instance from
+https://dwtkns.com/srtm30m/ or https://viewfinderpanoramas.org/dem3.html).
+Each tile covers 1x1 degree and is named after its south west corner, like
+N51W001.hgt. Tiles are memory mapped so only the parts under the tracks are read.
+
+Created on Thu Oct 22 16:18:09 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import os
+
+
+#%% Define the ElevationCorrector class
+class ElevationCorrector:
+    """
+    This class samples the DEM at any positions with a bilinear interpolation.
+    All positions are processed at once, tile by tile.
+    """
+
+    voidValue = -32768 # Value of the missing data in SRTM tiles
+
+    def __init__(self, demFolder, hysteresisThreshold=5.0):
+        """
+        Constructor.
+        demFolder is the folder containing the .hgt tiles.
+        hysteresisThreshold is the altitude change in meters ignored when
+        computing the total ascent and descent (see Utils.hysteresisAscentDescent).
+        """
+        self.demFolder = demFolder
+        self.hysteresisThreshold = hysteresisThreshold
+        self.tiles = dict() # Memory mapped tiles, None if the tile is not in the folder
+
+    #%% Tiles
+    @staticmethod
+    def getTileName(latFloor, lonFloor):
+        """
+        Returns the name of the tile whose south west corner is at the given integer degrees.
+        """
+        return ('N' if latFloor >= 0 else 'S') + f"{abs(latFloor):02d}" + ('E' if lonFloor >= 0 else 'W') + f"{abs(lonFloor):03d}" + '.hgt'
+
+    def getTile(self, latFloor, lonFloor):
+        """
+        Returns the memory mapped tile as an array of big endian int16, or None if not available.
+        SRTM tiles are square: 1201 samples for 3 arc-seconds and 3601 for 1 arc-second.
+        """
+        tileKey = (latFloor, lonFloor)
+        if not tileKey in self.tiles:
+            tilePath = os.path.join(self.demFolder, ElevationCorrector.getTileName(latFloor, lonFloor))
+            if os.path.isfile(tilePath):
+                Nsamples = int(round(np.sqrt(os.path.getsize(tilePath) / 2)))
+                self.tiles[tileKey] = np.memmap(tilePath, dtype='>i2', mode='r', shape=(Nsamples, Nsamples))
+            else:
+                self.tiles[tileKey] = None
+        return self.tiles[tileKey]
+
+    #%% Sampling
+    def sampleElevation(self, latDeg, lonDeg):
+        """
+        Returns the elevation in meters of the DEM at the positions in degrees.
+        Positions outside the available tiles, without position or next to a
+        missing value of the DEM are NaN.
+        """
+        latDeg = np.asarray(latDeg, dtype=float)
+        lonDeg = np.asarray(lonDeg, dtype=float)
+        elevation = np.ones(len(latDeg)) * np.nan
+        isValid = ~np.isnan(latDeg) & ~np.isnan(lonDeg)
+        latFloor = np.floor(latDeg[isValid]).astype(int)
+        lonFloor = np.floor(lonDeg[isValid]).astype(int)
+        idxValid = np.flatnonzero(isValid)
+
+        # Loop on the tiles, only one or two for most activities
+        tileCodes = (latFloor + 90) * 360 + (lonFloor + 180)
+        for tileCode in np.unique(tileCodes):
+            isInTile = tileCodes == tileCode
+            idxPoints = idxValid[isInTile]
+            thisLatFloor = int(latFloor[isInTile][0])
+            thisLonFloor = int(lonFloor[isInTile][0])
+            tile = self.getTile(thisLatFloor, thisLonFloor)
+            if tile is None:
+                continue
+
+            # Position in the grid, first row is the north edge and first column the west edge
+            Nsamples = tile.shape[0]
+            row = (thisLatFloor + 1 - latDeg[idxPoints]) * (Nsamples - 1)
+            column = (lonDeg[idxPoints] - thisLonFloor) * (Nsamples - 1)
+            row0 = np.clip(np.floor(row).astype(int), 0, Nsamples - 2)
+            column0 = np.clip(np.floor(column).astype(int), 0, Nsamples - 2)
+            rowFraction = row - row0
+            columnFraction = column - column0
+
+            # Only the four neighbouring samples of each point are read from the file
+            corners = np.stack((tile[row0, column0], tile[row0, column0 + 1],
+                                tile[row0 + 1, column0], tile[row0 + 1, column0 + 1])).astype(float)
+            corners[corners == ElevationCorrector.voidValue] = np.nan
+            elevation[idxPoints] = (corners[0] * (1 - columnFraction) + corners[1] * columnFraction) * (1 - rowFraction) + \
+                                   (corners[2] * (1 - columnFraction) + corners[3] * columnFraction) * rowFraction
+        return elevation
+
+    def getAscentDescent(self, altitude):
+        """
+        Returns the total ascent and descent of an altitude signal with the hysteresis
+        threshold of the corrector. NaN if the altitude is not available at all.
+        """
+        if np.all(np.isnan(altitude)):
+            return (np.nan, np.nan)
+        return Utils.hysteresisAscentDescent(altitude, self.hysteresisThreshold)
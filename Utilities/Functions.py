@@ -11,11 +11,19 @@ Created on Sat Jun 17 16:11:42 2023
 import pandas as pd
 import numpy as np
 import datetime
+import warnings
 
 #%% Useful constants
 halfMarathonDistance = 21.0975e3  # in meters
 fullMarathonDistance = 42.195e3   # in meters
 mileDistance = 1.60934e3 # in meters 
+earthRadius = 6.371e6 # Mean radius in meters
+
+# Columns of the activity data that are derived from other channels.
+# They are not stored with the compact storage profile but computed on access.
+derivedDataChannels = ['cadence_spm', 'position_lat_deg', 'position_long_deg', 'speed_kph', 'pace',
+                       'grade', 'speed_gap', 'distance_gap', 'pace_gap']
+gradeWindowDistance = 30.0 # Distance in meters over which the grade is calculated
 
 #%% File Functions
 def getDataPath():
@@ -60,6 +68,105 @@ def removeNumberKeysFromDict(thisDict):
         thisDict.pop(name, None)
     return thisDict
 
+def addDerivedChannels(df):
+    """
+    Adds the channels derived from the raw record channels to an activity DataFrame:
+    cadence in steps per minute, position in degrees, speed in kph and pace,
+    grade and grade adjusted speed, distance and pace.
+    Only the channels whose source columns are available are added.
+    """
+    # Get Cadence in Steps Per Minute
+    # https://forums.garmin.com/developer/fit-sdk/f/discussion/288454/fractional-cadence-values
+    if ('cadence' in df.columns) and ('fractional_cadence' in df.columns):
+        # Raw cadence is the "RPM" of the legs, which must be multiplied by 2
+        # to get the number of steps. Fractional_cadence allows odd numbers
+        df['cadence_spm'] = convertRPMtoCadence(df['cadence'], df['fractional_cadence'])
+    
+    # Get position in degrees instead of semicircles
+    # https://forums.garmin.com/developer/fit-sdk/f/discussion/280125/record-the-latitude-and-longitude-format-of-the-message
+    if ('position_lat' in df.columns) and ('position_long' in df.columns):
+        (df['position_lat_deg'], df['position_long_deg']) = SemiToDeg(df['position_lat'], df['position_long'])
+    
+    # Get pace in min/km and speed in kph
+    if 'speed' in df.columns:
+        df['speed_kph']  = df['speed'] * 3.6
+        df['pace'] = speedToPace(df['speed'])
+    
+    # Get grade and grade adjusted pace (GAP)
+    # The DEM altitude is used when available because it is less noisy
+    if ('speed' in df.columns) and ('distance' in df.columns) and ('time' in df.columns):
+        if ('altitude_dem' in df.columns) and df['altitude_dem'].notna().any():
+            altitudeArray = df['altitude_dem'].values
+        elif 'altitude' in df.columns:
+            altitudeArray = df['altitude'].values
+        else:
+            altitudeArray = np.ones(len(df)) * np.nan # Grade of 0
+        df['grade'] = computeGrade(df['distance'].values, altitudeArray)
+        df['speed_gap'] = df['speed'] * minettiCostOfRunning(df['grade'].values) / minettiCostOfRunning(0.0)
+        speedGAP = df['speed_gap'].fillna(0.0).values
+        df['distance_gap'] = np.concatenate(([0.0], np.cumsum(np.diff(df['time'].values) * (speedGAP[1:] + speedGAP[:-1]) / 2.0)))
+        df['pace_gap'] = speedToPace(df['speed_gap'])
+    return df
+
+def compactDataFrame(df):
+    """
+    Converts an activity DataFrame to the compact storage profile:
+        - derived channels (see derivedDataChannels) are dropped
+        - timestamp is dropped and time is stored as int32 elapsed seconds
+        - heart_rate and cadence are stored as uint8
+        - semicircle positions are stored as int32
+        - other float channels are stored as float32, except the cumulative distance
+          which keeps float64 so best efforts are not affected by rounding
+    Integer channels with missing values use the pandas nullable types.
+    Returns the compact DataFrame and the start timestamp required to rebuild the timestamps.
+    """
+    
+    # Drop everything that can be recomputed
+    dfCompact = df.drop(columns=[col for col in derivedDataChannels + ['timestamp'] if col in df.columns])
+    startTimestamp = df['timestamp'].iloc[0]
+    
+    # Elapsed time as integer seconds when the records are on full seconds
+    if np.all(np.mod(dfCompact['time'], 1.0) == 0.0):
+        dfCompact['time'] = dfCompact['time'].astype('int32')
+    # Small integer channels
+    integerChannels = [('heart_rate', 'uint8', 'UInt8'), ('cadence', 'uint8', 'UInt8'),
+                       ('position_lat', 'int32', 'Int32'), ('position_long', 'int32', 'Int32')]
+    for col, dtype, nullableDtype in integerChannels:
+        if col in dfCompact.columns:
+            if dfCompact[col].isna().any():
+                dfCompact[col] = dfCompact[col].round(0).astype(nullableDtype)
+            else:
+                dfCompact[col] = dfCompact[col].round(0).astype(dtype)
+    # Remaining float channels in single precision
+    for col in dfCompact.columns:
+        if col != 'distance' and dfCompact[col].dtype == 'float64':
+            dfCompact[col] = dfCompact[col].astype('float32')
+    
+    return (dfCompact, startTimestamp)
+
+def expandCompactDataFrame(dfCompact, startTimestamp):
+    """
+    Rebuilds the full activity DataFrame from its compact storage profile.
+    All numeric channels are converted back to float64 and the timestamp and
+    derived channels are recomputed.
+    """
+    
+    # Back to float64 so all calculations behave as with the full DataFrame
+    df = dfCompact.astype({col: 'float64' for col in dfCompact.columns if pd.api.types.is_numeric_dtype(dfCompact[col])})
+    df.insert(0, 'timestamp', startTimestamp + pd.to_timedelta(df['time'], unit='s'))
+    return addDerivedChannels(df)
+
+def rangesToIndices(idxStarts, idxEnds):
+    """
+    Concatenates the indices of several ranges [idxStart, idxEnd) without a loop.
+    Equivalent to np.concatenate([np.arange(s, e) for s, e in zip(idxStarts, idxEnds)]).
+    """
+    idxStarts = np.asarray(idxStarts, dtype=np.int64)
+    lengths = np.maximum(np.asarray(idxEnds, dtype=np.int64) - idxStarts, 0)
+    # Offset of each range repeated over its length, plus the position in the concatenation
+    rangeOffsets = np.repeat(idxStarts - (np.cumsum(lengths) - lengths), lengths)
+    return rangeOffsets + np.arange(lengths.sum())
+
 def getAge(birthDate):
     """
     Gets the age of a user based on their birth date. The calculation is slightly
@@ -92,17 +199,150 @@ def SemiToDeg(posLat, posLong):
     
     return (posLat_deg, posLong_deg)
 
+def haversineDistance(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in meters between points given in degrees.
+    Inputs can be arrays, which are broadcast together.
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dLat = lat2 - lat1
+    dLon = np.radians(lon2) - np.radians(lon1)
+    a = np.sin(dLat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dLon/2.0)**2
+    return 2.0 * earthRadius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def latLonToLocalMeters(latDeg, lonDeg, latOrigin, lonOrigin):
+    """
+    Projects positions in degrees onto a local plane in meters around an origin
+    (equirectangular projection). x is towards the East and y towards the North.
+    Accurate for distances of a few kilometers.
+    """
+    x = np.radians(np.asarray(lonDeg) - lonOrigin) * earthRadius * np.cos(np.radians(latOrigin))
+    y = np.radians(np.asarray(latDeg) - latOrigin) * earthRadius
+    return (x, y)
+
+def pointToSegmentDistance(x, y, xStart, yStart, xEnd, yEnd):
+    """
+    Distance from points to segments in a plane. All inputs are broadcast together
+    so many points can be measured against their own segment at once.
+    """
+    dx = xEnd - xStart
+    dy = yEnd - yStart
+    segmentLength2 = dx**2 + dy**2
+    # Projection of the point on the segment, clipped to its ends
+    with np.errstate(invalid='ignore', divide='ignore'): # Segments of zero length
+        fraction = np.clip(((x - xStart) * dx + (y - yStart) * dy) / segmentLength2, 0.0, 1.0)
+    fraction = np.where(segmentLength2 > 0.0, fraction, 0.0)
+    return np.hypot(x - xStart - fraction * dx, y - yStart - fraction * dy)
+
+def douglasPeucker(x, y, tolerance):
+    """
+    Simplifies a polyline with the Douglas-Peucker algorithm and returns the
+    sorted indices of the points to keep. Every removed point is within
+    tolerance of the segment of the simplified polyline that replaces it.
+    The recursion is done one level at a time: all intervals of a level are
+    split at once, so the number of iterations is the depth of the recursion.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    N = len(x)
+    if N <= 2:
+        return np.arange(N)
+
+    isKept = np.zeros(N, dtype=bool)
+    isKept[[0, -1]] = True
+    # Intervals between kept points that still have points inside
+    idxStarts = np.array([0])
+    idxEnds = np.array([N-1])
+    while len(idxStarts) > 0:
+        # Distance of the inner points of all intervals to their chord
+        Ninner = idxEnds - idxStarts - 1
+        idxPoints = rangesToIndices(idxStarts + 1, idxEnds)
+        idxInterval = np.repeat(np.arange(len(idxStarts)), Ninner)
+        distances = pointToSegmentDistance(x[idxPoints], y[idxPoints],
+                                           x[idxStarts[idxInterval]], y[idxStarts[idxInterval]],
+                                           x[idxEnds[idxInterval]], y[idxEnds[idxInterval]])
+        # Farthest point of each interval (first one for ties)
+        maxDistances = np.maximum.reduceat(distances, np.cumsum(Ninner) - Ninner)
+        idxFarthest = np.flatnonzero(distances == maxDistances[idxInterval])
+        idxFarthest = idxFarthest[np.unique(idxInterval[idxFarthest], return_index=True)[1]]
+        # Split the intervals out of tolerance at their farthest point
+        isSplit = maxDistances > tolerance
+        idxSplit = idxPoints[idxFarthest[isSplit]]
+        isKept[idxSplit] = True
+        idxStarts = np.concatenate((idxStarts[isSplit], idxSplit))
+        idxEnds = np.concatenate((idxSplit, idxEnds[isSplit]))
+        hasInner = idxEnds - idxStarts > 1
+        idxStarts = idxStarts[hasInner]
+        idxEnds = idxEnds[hasInner]
+
+    return np.flatnonzero(isKept)
+
+def polylineMaxDeviation(x, y, idxKept):
+    """
+    Maximum distance between the points of a polyline and the segments of its
+    simplification given by the indices of the kept points. Used to check the
+    error bound of a simplification.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Segment of the simplified polyline replacing each point
+    idxSegment = np.clip(np.searchsorted(idxKept, np.arange(len(x)), side='right') - 1, 0, max(len(idxKept) - 2, 0))
+    idxStart = idxKept[idxSegment]
+    idxEnd = idxKept[np.minimum(idxSegment + 1, len(idxKept) - 1)]
+    return pointToSegmentDistance(x, y, x[idxStart], y[idxStart], x[idxEnd], y[idxEnd]).max()
+
+def reconstructDistanceFromGPS(timeArray, latDeg, lonDeg, speedArray=None, maxSpeed=10.0, smoothingWindow=5):
+    """
+    Cumulative distance in meters from the GPS positions, for activities where
+    the distance channel is wrong.
+        - Spikes (a single position far from both neighbours, faster than maxSpeed
+          m/s to reach and to leave) and missing positions are interpolated in time
+        - Positions are smoothed with a centred moving average of smoothingWindow
+          samples so the GPS jitter doesn't add distance
+        - Remaining steps faster than maxSpeed (jumps) are replaced by the
+          integrated speed over that step if speedArray is given, else ignored
+    """
+    timeArray = np.asarray(timeArray, dtype=float)
+    latDeg = np.asarray(latDeg, dtype=float)
+    lonDeg = np.asarray(lonDeg, dtype=float)
+    timeDelta = np.diff(timeArray)
+
+    # Remove the spikes of single positions
+    isValid = ~np.isnan(latDeg) & ~np.isnan(lonDeg)
+    idxValid = np.flatnonzero(isValid)
+    if len(idxValid) < 2:
+        return np.zeros(len(timeArray))
+    validStepSpeed = haversineDistance(latDeg[idxValid[:-1]], lonDeg[idxValid[:-1]], latDeg[idxValid[1:]], lonDeg[idxValid[1:]]) / \
+                        np.maximum(np.diff(timeArray[idxValid]), 1.0e-3)
+    isTooFast = validStepSpeed > maxSpeed
+    isSpike = np.concatenate(([False], isTooFast[:-1] & isTooFast[1:], [False]))
+    idxValid = idxValid[~isSpike]
+    if len(idxValid) < 2:
+        return np.zeros(len(timeArray))
+
+    # Interpolate the missing positions then smooth
+    latDeg = movingAverage(np.interp(timeArray, timeArray[idxValid], latDeg[idxValid]), smoothingWindow)
+    lonDeg = movingAverage(np.interp(timeArray, timeArray[idxValid], lonDeg[idxValid]), smoothingWindow)
+    stepDistance = haversineDistance(latDeg[:-1], lonDeg[:-1], latDeg[1:], lonDeg[1:])
+
+    # Replace the jumps
+    isJump = stepDistance > maxSpeed * timeDelta
+    if speedArray is not None:
+        speedArray = np.nan_to_num(np.asarray(speedArray, dtype=float))
+        stepDistance[isJump] = (timeDelta * (speedArray[1:] + speedArray[:-1]) / 2.0)[isJump]
+    else:
+        stepDistance[isJump] = 0.0
+    return np.concatenate(([0.0], np.cumsum(stepDistance)))
+
 def speedToPace(speedMS):
     """
     Transforms a speed in m/s to a pace in min/km
-    Speed input must be a Pandas Series so we can use apply
+    Speed input can be a Pandas Series, an array or a single number
     """
     # The max ensures we don't divide by 0 and don't go slower than 60min/km
-    # Check for Type because we need different formulas for series and single numbers
-    if isinstance(speedMS, pd.Series):
-        return speedMS.apply(lambda speed: pd.to_datetime(1000/max(speed, 1/3.6), unit='s'))
-    else:
-        return pd.to_datetime(1000/np.maximum(speedMS, 1/3.6), unit='s')
+    # np.maximum keeps NaN so missing speeds give NaT
+    return pd.to_datetime(1000/np.maximum(speedMS, 1/3.6), unit='s')
 
 def paceToSpeed(paceMinSec):
     """
@@ -127,6 +367,107 @@ def convertRPMtoCadence(cadence_RPM, fractional_cadence):
     cadence_spm = (cadence_RPM + fractional_cadence) * 2.0
     return cadence_spm
 
+def movingAverage(data, window):
+    """
+    Centred moving average of window samples computed with a cumulative sum.
+    The window is truncated at both ends so the output has the same length.
+    """
+    data = np.asarray(data, dtype=float)
+    N = len(data)
+    if window <= 1 or N == 0:
+        return data.copy()
+    cumulatedData = np.concatenate(([0.0], np.cumsum(data)))
+    idxLow = np.maximum(np.arange(N) - window // 2, 0)
+    idxHigh = np.minimum(np.arange(N) - window // 2 + window, N)
+    return (cumulatedData[idxHigh] - cumulatedData[idxLow]) / (idxHigh - idxLow)
+
+def rollingMedianAndMAD(data, window):
+    """
+    Centred rolling median and median absolute deviation (MAD) over window samples.
+    All windows are built at once as a strided view of the data, padded with
+    NaN at both ends so the output has the same length. Missing values are ignored.
+    """
+    data = np.asarray(data, dtype=float)
+    halfWindow = window // 2
+    paddedData = np.concatenate((np.ones(halfWindow) * np.nan, data, np.ones(window - 1 - halfWindow) * np.nan))
+    windows = np.lib.stride_tricks.sliding_window_view(paddedData, window)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning) # Windows with only missing values
+        median = np.nanmedian(windows, axis=1)
+        mad = np.nanmedian(np.abs(windows - median[:, np.newaxis]), axis=1)
+    return (median, mad)
+
+def fillMaskedSamples(timeArray, data, isMasked):
+    """
+    Replaces the masked samples of a signal by the linear interpolation in time
+    of the other samples. Returns NaN everywhere if all samples are masked.
+    """
+    data = np.asarray(data, dtype=float)
+    isKept = ~isMasked & ~np.isnan(data)
+    if not np.any(isKept):
+        return np.ones(len(data)) * np.nan
+    return np.where(isMasked, np.interp(timeArray, timeArray[isKept], data[isKept]), data)
+
+def trapezoidWeights(timeArray):
+    """
+    Weight of each sample in a trapezoidal integration over time: half of the
+    intervals before and after it. The sum of weights * values is equal to
+    np.trapz(x=timeArray, y=values), so histograms built with these weights give
+    the same times as the zones integrated with np.trapz.
+    """
+    timeArray = np.asarray(timeArray, dtype=float)
+    if len(timeArray) < 2:
+        return np.zeros(len(timeArray))
+    intervals = np.diff(timeArray)
+    return (np.concatenate(([0.0], intervals)) + np.concatenate((intervals, [0.0]))) / 2.0
+
+def detectSpikes(data, window, nSigma=4.0, minDeviation=0.0):
+    """
+    Detects the spikes of a signal: samples further than nSigma robust standard
+    deviations (1.4826 MAD) from the rolling median of window samples, and further
+    than minDeviation so flat signals don't flag every small change.
+    Returns a boolean array. Missing values are not spikes.
+    """
+    data = np.asarray(data, dtype=float)
+    (median, mad) = rollingMedianAndMAD(data, window)
+    with np.errstate(invalid='ignore'):
+        return np.abs(data - median) > np.maximum(nSigma * 1.4826 * mad, minDeviation)
+
+#%% Grade functions
+def computeGrade(distanceArray, altitudeArray, windowDistance=gradeWindowDistance):
+    """
+    Grade (slope as a ratio, 0.1 is 10%) along an activity. The altitude is
+    interpolated windowDistance/2 before and after each point on the distance
+    axis, which both smooths the altitude and takes its gradient without a loop.
+    Missing altitudes are ignored. Returns 0 everywhere if there is no altitude.
+    """
+    distanceArray = np.asarray(distanceArray, dtype=float)
+    altitudeArray = np.asarray(altitudeArray, dtype=float)
+    isValid = ~np.isnan(distanceArray) & ~np.isnan(altitudeArray)
+    if np.sum(isValid) < 2:
+        return np.zeros(len(distanceArray))
+    validDistance = distanceArray[isValid]
+    validAltitude = altitudeArray[isValid]
+    
+    # Window clipped to the start and end of the activity
+    distanceLow = np.maximum(distanceArray - windowDistance/2.0, validDistance[0])
+    distanceHigh = np.minimum(distanceArray + windowDistance/2.0, validDistance[-1])
+    windowLength = distanceHigh - distanceLow
+    altitudeDelta = np.interp(distanceHigh, validDistance, validAltitude) - np.interp(distanceLow, validDistance, validAltitude)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grade = np.where(windowLength > 0.0, altitudeDelta / windowLength, 0.0)
+    return np.nan_to_num(grade)
+
+def minettiCostOfRunning(grade):
+    """
+    Energy cost of running in J/kg/m for a grade, from Minetti et al. (2002)
+    https://doi.org/10.1152/japplphysiol.01177.2001
+    The polynomial is only valid between -45% and 45% so grades are clipped.
+    The grade adjusted speed is the speed times the ratio of this cost to the cost on the flat.
+    """
+    grade = np.clip(grade, -0.45, 0.45)
+    return 155.4*grade**5 - 30.4*grade**4 - 43.3*grade**3 + 46.3*grade**2 + 19.5*grade + 3.6
+
 #%% Math function
 def gaussianKernel(u):
     """
@@ -134,17 +475,362 @@ def gaussianKernel(u):
     """
     return 1/np.sqrt(2*np.pi) * np.exp(-1/2*np.power(u, 2))
 
-def kernelRegressionSmoothing(xData, yData, xSmooth, bandWidth):
+def kernelRegressionSmoothing(xData, yData, xSmooth, bandWidth, method='exact', tolerance=1.0e-3, blockSize=None):
     """ 
-    Kernel Regression Smoothing based on the Gaussian kernel.    
-    """
-    ySmooth = np.nan * xSmooth
-    for i in np.arange(len(xSmooth)):
-        x = xSmooth[i]
-        fracBottom = np.sum(gaussianKernel( (x - xData)/bandWidth ))
-        fracTop = np.sum( np.multiply(gaussianKernel( (x - xData)/bandWidth ), yData) )
-        ySmooth[i] = fracTop / fracBottom
-    return ySmooth
+    Kernel Regression Smoothing based on the Gaussian kernel.
+    Pairs of data with a NaN are ignored.
+    
+    Two methods are available:
+        - 'exact' evaluates the kernel between every smoothed point and every distinct
+          data value. It is done by blocks of xSmooth points (blockSize, by default so
+          that a block has about 4 million kernel values) to limit memory.
+        - 'binned' linearly bins the data on a regular grid then convolves it with
+          the kernel using an FFT. The cost no longer depends on the number of
+          smoothed points so it can be used on millions of samples.
+          tolerance is the target relative error of that approximation. It sets the
+          grid spacing (bandWidth*sqrt(tolerance)) and the truncation of the kernel.
+    """
+    xData = np.asarray(xData, dtype=float)
+    yData = np.asarray(yData, dtype=float)
+    xSmooth = np.asarray(xSmooth, dtype=float)
+    isValid = ~np.isnan(xData) & ~np.isnan(yData)
+    xData = xData[isValid]
+    yData = yData[isValid]
+    
+    if method == 'exact':
+        # Repeated x values (like integer heart rates) share the same kernel value
+        # so they are merged first, which does not change the result
+        (xUnique, idxUnique) = np.unique(xData, return_inverse=True)
+        countsUnique = np.bincount(idxUnique, minlength=len(xUnique)).astype(float)
+        sumsUnique = np.bincount(idxUnique, yData, minlength=len(xUnique))
+        
+        ySmooth = np.nan * xSmooth
+        if blockSize is None:
+            blockSize = max(1, int(2**22 / max(len(xUnique), 1)))
+        for iStart in np.arange(0, len(xSmooth), blockSize):
+            xBlock = xSmooth[iStart:(iStart+blockSize)]
+            kernelValues = gaussianKernel( (xBlock[:, np.newaxis] - xUnique[np.newaxis, :])/bandWidth )
+            fracBottom = kernelValues @ countsUnique
+            fracTop = kernelValues @ sumsUnique
+            ySmooth[iStart:(iStart+blockSize)] = fracTop / fracBottom
+        return ySmooth
+    
+    elif method == 'binned':
+        # Regular grid covering the data and the smoothed points
+        gridStep = bandWidth * np.sqrt(tolerance)
+        gridStart = min(xData.min(), xSmooth.min())
+        Ngrid = int(np.ceil( (max(xData.max(), xSmooth.max()) - gridStart) / gridStep )) + 2
+        
+        # Linear binning, each point is shared between its two neighbouring nodes
+        position = (xData - gridStart) / gridStep
+        idxLow = np.floor(position).astype(int)
+        weightHigh = position - idxLow
+        countsGrid = np.bincount(idxLow, 1.0 - weightHigh, minlength=Ngrid) + np.bincount(idxLow + 1, weightHigh, minlength=Ngrid)
+        sumsGrid = np.bincount(idxLow, (1.0 - weightHigh)*yData, minlength=Ngrid) + np.bincount(idxLow + 1, weightHigh*yData, minlength=Ngrid)
+        countsGrid = countsGrid[:Ngrid]
+        sumsGrid = sumsGrid[:Ngrid]
+        
+        # Kernel truncated where it is below the tolerance
+        Nhalf = int(np.ceil( bandWidth * np.sqrt(-2.0*np.log(tolerance)) / gridStep ))
+        kernelGrid = gaussianKernel( np.arange(-Nhalf, Nhalf+1) * gridStep / bandWidth )
+        
+        # Convolution with FFT, padded to avoid the circular wrap around
+        Nfft = int(2**np.ceil(np.log2(Ngrid + 2*Nhalf + 1)))
+        kernelFFT = np.fft.rfft(kernelGrid, Nfft)
+        fracBottom = np.fft.irfft(np.fft.rfft(countsGrid, Nfft) * kernelFFT, Nfft)[Nhalf:(Nhalf+Ngrid)]
+        fracTop = np.fft.irfft(np.fft.rfft(sumsGrid, Nfft) * kernelFFT, Nfft)[Nhalf:(Nhalf+Ngrid)]
+        
+        # Far from any data the FFT round-off dominates so there is no estimate
+        hasData = fracBottom > tolerance * fracBottom.max()
+        yGrid = np.full(Ngrid, np.nan)
+        yGrid[hasData] = fracTop[hasData] / fracBottom[hasData]
+        return np.interp(xSmooth, gridStart + np.arange(Ngrid) * gridStep, yGrid)
+    
+    else:
+        raise ValueError(f"Unknown kernel regression method {method}")
+
+def interpolateOnCommonGrid(xList, yLists, xGrid):
+    """
+    Interpolates several series onto the same grid with a single np.interp call per channel.
+    xList is a list of increasing x arrays, one per series.
+    yLists is a list of channels, each channel being a list of y arrays (one per series).
+    Returns a list with, for each channel, an array of shape (Nseries, len(xGrid)).
+    
+    Each series is padded with its end values just outside the range of all the
+    data, then shifted by a multiple of that range. The concatenation of all
+    series is then increasing and values outside a series are held constant
+    like np.interp does for a single series.
+    """
+    Nseries = len(xList)
+    xGrid = np.asarray(xGrid, dtype=float)
+    lowBound = min(xGrid.min(), min(np.min(x) for x in xList)) - 1.0
+    highBound = max(xGrid.max(), max(np.max(x) for x in xList)) + 1.0
+    span = highBound - lowBound + 1.0
+    
+    # Concatenated x with padding and offsets
+    xAll = np.concatenate([np.concatenate(([lowBound], np.asarray(x, dtype=float), [highBound])) + iSeries*span
+                           for iSeries, x in enumerate(xList)])
+    xGridAll = (xGrid[np.newaxis, :] + (np.arange(Nseries)*span)[:, np.newaxis]).ravel()
+    
+    interpList = []
+    for yList in yLists:
+        yAll = np.concatenate([np.concatenate(([y[0]], y, [y[-1]])) for y in (np.asarray(y, dtype=float) for y in yList)])
+        interpList.append(np.interp(xGridAll, xAll, yAll).reshape(Nseries, len(xGrid)))
+    return interpList
+
+def interpolateAtSortedPositions(xSorted, ySorted, xQuery):
+    """
+    Linear interpolation of y at xQuery, with xSorted non-decreasing (plateaus allowed).
+    Each query uses the first sample reaching it, found with np.searchsorted,
+    and the sample before, so a plateau gives the time it was first reached.
+    """
+    idxAfter = np.clip(np.searchsorted(xSorted, xQuery, side='left'), 1, len(xSorted) - 1)
+    idxBefore = idxAfter - 1
+    xStep = xSorted[idxAfter] - xSorted[idxBefore]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(xStep > 0, (xQuery - xSorted[idxBefore]) / xStep, 0.0)
+    return ySorted[idxBefore] + fraction * (ySorted[idxAfter] - ySorted[idxBefore])
+
+def virtualSplits(activityIds, timeArray, distanceArray, splitDistance, heartRate=None, cadence=None, altitude=None):
+    """
+    Computes splits every splitDistance meters (1km, 1 mile, etc.) for several
+    activities at once, without loop on the activities.
+    The inputs are the concatenated samples of all activities, sorted by activity
+    then time. Distances and times of each activity are shifted so the concatenation
+    is increasing with a gap of splitDistance between activities. The time and the
+    cumulative integrals of the channels are then interpolated at all split
+    boundaries with a single np.searchsorted.
+    Returns (splitsDF, halvesDF): one row per split with the Activity_Id, and one
+    row per activity with the times of the first and second half of the distance.
+    """
+    activityIds = np.asarray(activityIds)
+    timeArray = np.asarray(timeArray, dtype=float)
+    distanceArray = np.asarray(distanceArray, dtype=float)
+    isFirst = np.concatenate(([True], activityIds[1:] != activityIds[:-1]))
+    idxFirst = np.flatnonzero(isFirst)
+    idxLast = np.append(idxFirst[1:] - 1, len(activityIds) - 1)
+    sampleCounts = idxLast - idxFirst + 1
+    
+    # Each activity from 0, distance never decreasing, then shifted after the previous one
+    time0 = timeArray - np.repeat(timeArray[idxFirst], sampleCounts)
+    distance0 = distanceArray - np.repeat(distanceArray[idxFirst], sampleCounts)
+    distance0 = pd.Series(distance0).groupby(np.repeat(np.arange(len(idxFirst)), sampleCounts)).cummax().values
+    totalDistances = distance0[idxLast]
+    totalTimes = time0[idxLast]
+    distanceOffsets = np.concatenate(([0.0], np.cumsum(totalDistances + splitDistance)[:-1]))
+    timeOffsets = np.concatenate(([0.0], np.cumsum(totalTimes + 1.0)[:-1]))
+    distanceAll = distance0 + np.repeat(distanceOffsets, sampleCounts)
+    timeAll = time0 + np.repeat(timeOffsets, sampleCounts)
+    
+    # Cumulative integrals over time, a channel is averaged over the time it is available
+    timeSteps = np.diff(timeAll, prepend=timeAll[0])
+    def cumulativeIntegral(values):
+        values = np.asarray(values, dtype=float)
+        isValid = ~np.isnan(values)
+        valuesFilled = np.where(isValid, values, 0.0)
+        integral = np.cumsum(timeSteps * (valuesFilled + np.roll(valuesFilled, 1)) / 2.0 * (isValid & np.roll(isValid, 1)))
+        validTime = np.cumsum(timeSteps * (isValid & np.roll(isValid, 1)))
+        return (integral, validTime)
+    
+    # Split boundaries of all activities: 0, splitDistance, ..., total distance
+    Nsplits = np.ceil(totalDistances / splitDistance).astype(int)
+    idxSplitActivity = np.repeat(np.arange(len(idxFirst)), Nsplits)
+    splitNumbers = np.arange(len(idxSplitActivity)) - np.repeat(np.cumsum(Nsplits) - Nsplits, Nsplits) + 1
+    splitStarts = (splitNumbers - 1) * splitDistance
+    splitEnds = np.minimum(splitNumbers * splitDistance, totalDistances[idxSplitActivity])
+    startsAll = splitStarts + distanceOffsets[idxSplitActivity]
+    endsAll = splitEnds + distanceOffsets[idxSplitActivity]
+    def splitDifference(cumulatedValues):
+        return interpolateAtSortedPositions(distanceAll, cumulatedValues, endsAll) - interpolateAtSortedPositions(distanceAll, cumulatedValues, startsAll)
+    
+    splitsDF = pd.DataFrame(data={'Activity_Id': activityIds[idxFirst][idxSplitActivity],
+                                  'Split_Number': splitNumbers,
+                                  'start_distance': splitStarts,
+                                  'total_distance': splitEnds - splitStarts,
+                                  'total_elapsed_time': splitDifference(timeAll)})
+    splitsDF['avg_speed'] = splitsDF['total_distance'] / splitsDF['total_elapsed_time']
+    splitsDF['avg_pace'] = speedToPace(splitsDF['avg_speed'])
+    for (channelName, channelValues) in [('avg_heart_rate', heartRate), ('avg_cadence_spm', cadence)]:
+        if channelValues is not None:
+            (integral, validTime) = cumulativeIntegral(channelValues)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                splitsDF[channelName] = splitDifference(integral) / splitDifference(validTime)
+    if altitude is not None:
+        altitude = np.asarray(altitude, dtype=float)
+        altitudeSteps = np.nan_to_num(np.diff(altitude, prepend=altitude[0])) * ~isFirst
+        splitsDF['total_ascent'] = splitDifference(np.cumsum(np.maximum(altitudeSteps, 0.0)))
+        splitsDF['total_descent'] = splitDifference(np.cumsum(np.maximum(-altitudeSteps, 0.0)))
+        splitsDF['altitude_change'] = splitDifference(np.cumsum(altitudeSteps))
+    
+    # Times of the two halves of each activity for the negative split
+    halfTimes = interpolateAtSortedPositions(distanceAll, timeAll, distanceOffsets + totalDistances / 2.0) - timeOffsets
+    halvesDF = pd.DataFrame(data={'FirstHalfTime': halfTimes, 'SecondHalfTime': totalTimes - halfTimes},
+                            index=pd.Index(activityIds[idxFirst], name='Activity_Id'))
+    halvesDF.loc[totalDistances <= 0.0, :] = np.nan
+    return (splitsDF, halvesDF)
+
+def aerobicDecoupling(activityIds, timeArray, speedArray, heartRateArray, warmupTime=600.0):
+    """
+    Computes the heart rate drift metrics of several activities at once from their
+    concatenated samples, sorted by activity then time. The warm up is ignored and
+    all means are weighted by time (trapezoidal weights within each activity),
+    computed with np.bincount on the activity of each sample.
+    Returns a DataFrame indexed by activity id with:
+        - Duration: time with speed and heart rate after the warm up
+        - AvgSpeed, AvgHR and SpeedCV, the coefficient of variation of the speed
+        - EF_FirstHalf and EF_SecondHalf: efficiency factor, speed in m/min over
+          heart rate, of the first and second half of the time after the warm up
+        - AerobicDecoupling: decrease of the efficiency factor in %
+        - CardiacDrift: slope of the heart rate over time in bpm per hour
+    """
+    activityIds = np.asarray(activityIds)
+    timeArray = np.asarray(timeArray, dtype=float)
+    speedArray = np.asarray(speedArray, dtype=float)
+    heartRateArray = np.asarray(heartRateArray, dtype=float)
+    isFirst = np.concatenate(([True], activityIds[1:] != activityIds[:-1]))
+    idxGroups = np.cumsum(isFirst) - 1 # Samples are sorted by activity
+    uniqueIds = activityIds[isFirst]
+    Ngroups = len(uniqueIds)
+    
+    # Elapsed time in each activity and trapezoidal weights without the intervals between activities
+    startTimes = timeArray[isFirst][np.cumsum(isFirst) - 1]
+    elapsedTime = timeArray - startTimes
+    intervals = np.diff(timeArray) * ~isFirst[1:]
+    weights = (np.concatenate(([0.0], intervals)) + np.concatenate((intervals, [0.0]))) / 2.0
+    weights = weights * (~np.isnan(speedArray) & ~np.isnan(heartRateArray) & (elapsedTime >= warmupTime))
+    speedArray = np.nan_to_num(speedArray)
+    heartRateArray = np.nan_to_num(heartRateArray)
+    
+    def weightedMeans(sampleWeights, values):
+        sumWeights = np.bincount(idxGroups, weights=sampleWeights, minlength=Ngroups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.bincount(idxGroups, weights=sampleWeights * values, minlength=Ngroups) / sumWeights
+    
+    resultsDF = pd.DataFrame(index=pd.Index(uniqueIds, name='Activity_Id'))
+    resultsDF['Duration'] = np.bincount(idxGroups, weights=weights, minlength=Ngroups)
+    resultsDF['AvgSpeed'] = weightedMeans(weights, speedArray)
+    resultsDF['AvgHR'] = weightedMeans(weights, heartRateArray)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resultsDF['SpeedCV'] = np.sqrt(np.maximum(weightedMeans(weights, speedArray**2) - resultsDF['AvgSpeed'].values**2, 0.0)) / resultsDF['AvgSpeed'].values
+    
+    # Efficiency factor of each half of the time after the warm up
+    endTimes = np.bincount(idxGroups, weights=elapsedTime * np.append(isFirst[1:], True), minlength=Ngroups)
+    isFirstHalf = elapsedTime < ((warmupTime + endTimes) / 2.0)[idxGroups]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resultsDF['EF_FirstHalf'] = weightedMeans(weights * isFirstHalf, speedArray) * 60.0 / weightedMeans(weights * isFirstHalf, heartRateArray)
+        resultsDF['EF_SecondHalf'] = weightedMeans(weights * ~isFirstHalf, speedArray) * 60.0 / weightedMeans(weights * ~isFirstHalf, heartRateArray)
+        resultsDF['AerobicDecoupling'] = (resultsDF['EF_FirstHalf'] - resultsDF['EF_SecondHalf']) / resultsDF['EF_FirstHalf'] * 100.0
+    
+        # Weighted linear regression of the heart rate over time
+        meanTime = weightedMeans(weights, elapsedTime)
+        timeCentred = elapsedTime - meanTime[idxGroups]
+        resultsDF['CardiacDrift'] = weightedMeans(weights, timeCentred * heartRateArray) / weightedMeans(weights, timeCentred**2) * 3600.0
+    return resultsDF
+
+def nanPercentileColumns(data, percentiles):
+    """
+    Percentiles of each column of a 2-D array ignoring NaN, with linear interpolation.
+    Same result as np.nanpercentile(data, percentiles, axis=0) but vectorized,
+    where numpy loops over the columns when there are NaN.
+    Returns an array of shape (Npercentiles, Ncolumns). All NaN columns give NaN.
+    """
+    percentiles = np.atleast_1d(np.asarray(percentiles, dtype=float))
+    # NaN are sorted at the end of each column
+    sortedData = np.sort(data, axis=0)
+    Nvalid = np.sum(~np.isnan(data), axis=0)
+    # Fractional position of each percentile in the valid part of each column
+    position = percentiles[:, np.newaxis] / 100.0 * np.maximum(Nvalid - 1, 0)[np.newaxis, :]
+    idxLow = np.floor(position).astype(int)
+    idxHigh = np.minimum(idxLow + 1, np.maximum(Nvalid - 1, 0))
+    weight = position - idxLow
+    valueLow = np.take_along_axis(sortedData, idxLow, axis=0)
+    valueHigh = np.take_along_axis(sortedData, idxHigh, axis=0)
+    result = valueLow + weight * (valueHigh - valueLow)
+    result[:, Nvalid == 0] = np.nan
+    return result
+
+def hysteresisAscentDescent(altitude, threshold=5.0):
+    """
+    Total ascent and descent of an altitude signal with a hysteresis of threshold
+    meters, so small oscillations are not counted. The altitude goes through a
+    play operator (backlash of width threshold) and the ascent and descent are
+    the positive and negative changes of its output.
+    Only the turning points of the altitude can change the output, so the loop
+    is on the turning points only. Missing values are ignored.
+    Returns (ascent, descent).
+    """
+    altitude = np.asarray(altitude, dtype=float)
+    altitude = altitude[~np.isnan(altitude)]
+    if len(altitude) < 2:
+        return (0.0, 0.0)
+
+    # Turning points: first and last values and where the direction changes
+    idxMoving = np.flatnonzero(np.diff(altitude) != 0.0)
+    directions = np.sign(np.diff(altitude)[idxMoving])
+    idxTurning = idxMoving[1:][directions[1:] != directions[:-1]]
+    turningAltitudes = np.concatenate(([altitude[0]], altitude[idxTurning], [altitude[-1]]))
+
+    halfWidth = threshold / 2.0
+    output = altitude[0]
+    ascent = 0.0
+    descent = 0.0
+    for thisAltitude in turningAltitudes:
+        newOutput = min(max(output, thisAltitude - halfWidth), thisAltitude + halfWidth)
+        if newOutput > output:
+            ascent += newOutput - output
+        else:
+            descent += output - newOutput
+        output = newOutput
+    return (ascent, descent)
+
+def largestTriangleThreeBuckets(x, y, nOut):
+    """
+    Shape preserving downsampling with the Largest Triangle Three Buckets algorithm.
+    See https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+    
+    x is the common x array of length N. y is either an array of length N or
+    a 2-D array (Ntraces, N) in which case all traces are downsampled at once.
+    Returns the indices of the points to keep, with the same number of dimensions as y.
+    """
+    x = np.asarray(x, dtype=float)
+    y2D = np.atleast_2d(np.asarray(y, dtype=float))
+    (Ntraces, N) = y2D.shape
+    if nOut >= N or nOut < 3:
+        idxKeep = np.tile(np.arange(N), (Ntraces, 1))
+        return idxKeep if np.ndim(y) == 2 else idxKeep[0]
+    
+    # Bucket edges, first and last points are always kept in their own bucket
+    bucketEdges = np.floor(np.arange(nOut-1) * (N-2) / (nOut-2)).astype(int) + 1
+    bucketEdges[-1] = N-1
+    idxKeep = np.zeros((Ntraces, nOut), dtype=int)
+    idxKeep[:, -1] = N-1
+    traceIdx = np.arange(Ntraces)
+    
+    # The selected point of each bucket depends on the one of the previous bucket
+    # so we loop on buckets but all traces are processed together
+    for iBucket in np.arange(nOut-2):
+        bucketStart = bucketEdges[iBucket]
+        bucketEnd = bucketEdges[iBucket+1]
+        # Average of the next bucket, or the last point for the final bucket
+        if iBucket < nOut-3:
+            nextStart = bucketEnd
+            nextEnd = bucketEdges[iBucket+2]
+            xAvg = x[nextStart:nextEnd].mean()
+            yNext = y2D[:, nextStart:nextEnd]
+            with np.errstate(invalid='ignore', divide='ignore'): # All NaN traces like the heart rate of a pacing
+                yAvg = np.nansum(yNext, axis=1) / np.sum(~np.isnan(yNext), axis=1)
+        else:
+            xAvg = x[N-1]
+            yAvg = y2D[:, N-1]
+        # Area of the triangles formed with the previously selected point and the next average
+        idxPrevious = idxKeep[:, iBucket]
+        xA = x[idxPrevious][:, np.newaxis]
+        yA = y2D[traceIdx, idxPrevious][:, np.newaxis]
+        area = np.abs( (xA - xAvg) * (y2D[:, bucketStart:bucketEnd] - yA) - (xA - x[np.newaxis, bucketStart:bucketEnd]) * (yAvg[:, np.newaxis] - yA) )
+        area[np.isnan(area)] = -1.0
+        idxKeep[:, iBucket+1] = bucketStart + np.argmax(area, axis=1)
+    
+    return idxKeep if np.ndim(y) == 2 else idxKeep[0]
 
 #%% Formatting functions
 def format_timedelta(td):
@@ -12,6 +12,10 @@ Created on Sat Jun 17 23:18:42 2023
 #%% Required modules
 # For own analysis and functions
 from Utilities.ActivityImporter import ActivityImporter
+from Utilities.SpatialIndex import SpatialIndex
+from Utilities.RouteClustering import RouteClusterer
+from Utilities.ChannelSketches import ChannelSketches
+from Utilities.RollupStore import RollupStore
 import Utilities.Functions as Utils
 # Standard libs
 import pandas as pd
@@ -23,8 +27,7 @@ import json
 from zipfile import ZipFile
 import os
 import shutil
-# Misc
-from tqdm import tqdm
+# tqdm is imported in the methods showing a progress bar to keep this module fast to import
 
 #%% StandardDataImporter class
 class StandardDataImporter:
@@ -33,6 +36,15 @@ class StandardDataImporter:
     then inherit from it and define their own methods.
     """
     
+    # Columns of the lapsDF and splitsDF tables, from the lap and split messages of the fit files
+    lapsColumns = ['start_time', 'timestamp', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+                   'avg_speed', 'max_speed', 'avg_pace', 'max_pace', 'avg_heart_rate', 'max_heart_rate',
+                   'avg_cadence_spm', 'max_cadence_spm', 'total_ascent', 'total_descent', 'total_calories',
+                   'start_position_lat_deg', 'start_position_long_deg', 'end_position_lat_deg', 'end_position_long_deg',
+                   'lap_trigger', 'intensity']
+    splitsColumns = ['split_type', 'start_time', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+                     'avg_speed', 'max_speed', 'total_ascent', 'total_descent', 'total_calories']
+    
     #%% Data Import Methods
     def importActivityFiles(self, listActFitFiles, activityImporterOptions):
         """
@@ -41,6 +53,7 @@ class StandardDataImporter:
         Then all files are read and filtered to only the running activities.
         Other fit files are deleted. Finally, a dataFrame with all metrics is generated.
         """
+        from tqdm import tqdm
         
         # Import the fit files with the ActivityImporter
         activityImporters = []
@@ -71,9 +84,270 @@ class StandardDataImporter:
         self.activityImporters = activityImporters
         self.activityFiles = activityFiles
         
+        # Index the GPS tracks so activities can be found by location
+        # The activity id in the index is the same as the index in activityMetricsDF
+        self.spatialIndex = SpatialIndex()
+        for activity in activityImporters:
+            self.addActivityToSpatialIndex(activity)
+        
+        # Group the activities that ran the same route
+        self.routeClusterer = RouteClusterer()
+        self.clusterRoutes()
+        
+        # Laps and splits of all activities in long-form tables
+        self.buildLapsAndSplitsTables()
+        self.computeVirtualSplits()
+        self.computeAerobicDecoupling()
+        
+        # Distribution of the main channels of each activity for fast percentiles
+        self.channelSketches = ChannelSketches()
+        self.channelSketches.updateFromImporter(self)
+        
+        # Weekly and monthly totals
+        self.rollupStore = RollupStore()
+        self.rollupStore.refresh(self.activityMetricsDF)
+        
         # Finally returns the list of files to be deleted because they are not activity files
         return (NONactivityFiles, NONrunningFiles)
     
+    def addActivityToSpatialIndex(self, activity):
+        """
+        Adds the GPS track of an imported activity to the spatial index.
+        Activities without position, like treadmill runs, are registered without any cell
+        so activity ids stay aligned with activityMetricsDF.
+        """
+        df = activity.data
+        if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns):
+            return self.spatialIndex.addActivity(activity.fileInfo['filePath'], df['position_lat_deg'].values, df['position_long_deg'].values)
+        else:
+            return self.spatialIndex.addActivity(activity.fileInfo['filePath'], np.array([]), np.array([]))
+    
+    def clusterRoutes(self, simplifyTolerance=10.0):
+        """
+        Assigns a route id to each activity and saves it in the Route_Id column
+        of activityMetricsDF. Activities are processed in chronological order so
+        the reference of each route is its first run. Activities already processed
+        by the routeClusterer keep their route, so only new activities are compared.
+        Activities without GPS have the route -1.
+        The signatures use the tracks simplified with simplifyTolerance meters.
+        """
+        routeIds = np.ones(len(self.activityImporters), dtype=int) * -1
+        for idxActivity in np.argsort(self.activityMetricsDF['Metric_StartTime'].values, kind='stable'):
+            activity = self.activityImporters[idxActivity]
+            filePath = activity.fileInfo['filePath']
+            if filePath in self.routeClusterer.activityRoutes:
+                routeIds[idxActivity] = self.routeClusterer.activityRoutes[filePath]
+                continue
+            df = activity.data
+            if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns):
+                dfTrack = activity.getSimplifiedTrack(simplifyTolerance)
+                routeIds[idxActivity] = self.routeClusterer.addActivity(filePath, dfTrack['position_lat_deg'].values, dfTrack['position_long_deg'].values)
+        self.activityMetricsDF['Route_Id'] = routeIds
+    
+    def buildLapsAndSplitsTables(self):
+        """
+        Builds lapsDF and splitsDF: one row per lap or split of all activities with
+        the Activity_Id (index in activityMetricsDF) and the Lap_Number or
+        Split_Number in the activity. Columns are typed (numbers, datetimes and
+        categories) so per lap analyses are simple groupby on these tables.
+        Columns not recorded by an activity are NaN.
+        """
+        lapsList = []
+        splitsList = []
+        for idxActivity, activity in enumerate(self.activityImporters):
+            dfLaps = activity.lapsMetricsDF.reindex(columns=StandardDataImporter.lapsColumns)
+            dfLaps.insert(0, 'Activity_Id', idxActivity)
+            dfLaps.insert(1, 'Lap_Number', np.arange(1, len(dfLaps) + 1))
+            lapsList.append(dfLaps)
+            if len(activity.splitsInfo) > 0:
+                dfSplits = activity.splitsInfo.reindex(columns=StandardDataImporter.splitsColumns)
+                dfSplits.insert(0, 'Activity_Id', idxActivity)
+                dfSplits.insert(1, 'Split_Number', np.arange(1, len(dfSplits) + 1))
+                splitsList.append(dfSplits)
+        
+        self.lapsDF = pd.concat(lapsList, ignore_index=True) if lapsList else pd.DataFrame(columns=['Activity_Id', 'Lap_Number'] + StandardDataImporter.lapsColumns)
+        self.splitsDF = pd.concat(splitsList, ignore_index=True) if splitsList else pd.DataFrame(columns=['Activity_Id', 'Split_Number'] + StandardDataImporter.splitsColumns)
+        for thisTable in [self.lapsDF, self.splitsDF]:
+            for columnName in thisTable.columns:
+                if columnName in ['lap_trigger', 'intensity', 'split_type']:
+                    thisTable[columnName] = thisTable[columnName].astype('category')
+                elif columnName in ['start_time', 'timestamp']:
+                    thisTable[columnName] = pd.to_datetime(thisTable[columnName], utc=True)
+                elif columnName in ['avg_pace', 'max_pace']:
+                    thisTable[columnName] = pd.to_datetime(thisTable[columnName])
+                else:
+                    thisTable[columnName] = pd.to_numeric(thisTable[columnName], errors='coerce')
+        self.splitsDF['avg_pace'] = Utils.speedToPace(self.splitsDF['avg_speed'])
+    
+    def computeVirtualSplits(self, splitDistance=1000.0):
+        """
+        Computes splits every splitDistance meters for all activities in one pass
+        (see Utils.virtualSplits) into virtualSplitsDF, with the same columns as
+        lapsDF so they are consistent whatever the lap settings of the watch.
+        Also adds the negative split metrics to activityMetricsDF: time of each half
+        of the distance, ratio of the second half over the first one (below 1 for a
+        negative split) and the coefficient of variation of the full splits speed.
+        """
+        # Concatenate the samples of all activities with a distance
+        (idsList, timeList, distanceList, heartRateList, cadenceList, altitudeList) = ([], [], [], [], [], [])
+        for idxActivity, activity in enumerate(self.activityImporters):
+            df = activity.data
+            if not 'distance' in df.columns:
+                continue
+            df = df.loc[df['distance'].notna()]
+            if len(df) < 2:
+                continue
+            idsList.append(np.full(len(df), idxActivity))
+            timeList.append(df['time'].values)
+            distanceList.append(df['distance'].values)
+            heartRateList.append(df['heart_rate'].values if 'heart_rate' in df.columns else np.ones(len(df)) * np.nan)
+            cadenceList.append(df['cadence_spm'].values if 'cadence_spm' in df.columns else np.ones(len(df)) * np.nan)
+            if ('altitude_dem' in df.columns) and df['altitude_dem'].notna().any():
+                altitudeList.append(df['altitude_dem'].values)
+            else:
+                altitudeList.append(df['altitude'].values if 'altitude' in df.columns else np.ones(len(df)) * np.nan)
+        
+        metricNames = ['Metric_FirstHalfTime', 'Metric_SecondHalfTime', 'Metric_HalfSplitRatio', 'Metric_IsNegativeSplit', 'Metric_SplitSpeedCV']
+        if not idsList:
+            self.virtualSplitsDF = pd.DataFrame()
+            for metricName in metricNames:
+                self.activityMetricsDF[metricName] = np.nan
+            return
+        (self.virtualSplitsDF, halvesDF) = Utils.virtualSplits(np.concatenate(idsList), np.concatenate(timeList), np.concatenate(distanceList),
+                                                               splitDistance, heartRate=np.concatenate(heartRateList),
+                                                               cadence=np.concatenate(cadenceList), altitude=np.concatenate(altitudeList))
+        
+        # Negative split metrics, the last split is only used if it is a full one
+        halvesDF['HalfSplitRatio'] = halvesDF['SecondHalfTime'] / halvesDF['FirstHalfTime']
+        halvesDF['IsNegativeSplit'] = halvesDF['HalfSplitRatio'] < 1.0
+        isFullSplit = self.virtualSplitsDF['total_distance'] >= splitDistance * (1.0 - 1.0e-9)
+        speedGroups = self.virtualSplitsDF.loc[isFullSplit].groupby('Activity_Id')['avg_speed']
+        halvesDF['SplitSpeedCV'] = speedGroups.std() / speedGroups.mean()
+        halvesDF = halvesDF.reindex(self.activityMetricsDF.index)
+        for metricName in metricNames:
+            self.activityMetricsDF[metricName] = halvesDF[metricName.replace('Metric_', '')].values
+    
+    def computeAerobicDecoupling(self, referencePace=np.datetime64('1970-01-01 00:05:00'), warmupTime=600.0, minDuration=1200.0, maxSpeedCV=0.15, gradeAdjusted=True):
+        """
+        Computes the heart rate drift metrics of all steady runs in one pass (see
+        Utils.aerobicDecoupling) and adds them to activityMetricsDF:
+        Metric_EF_FirstHalf, Metric_EF_SecondHalf, Metric_AerobicDecoupling (%),
+        Metric_CardiacDrift (bpm/h) and Metric_HRatPace, the heart rate at the
+        referencePace assuming the efficiency factor is constant.
+        A run is steady if it lasts minDuration seconds after the warm up with a
+        coefficient of variation of the speed below maxSpeedCV, other activities
+        get NaN. The grade adjusted speed is used when available with gradeAdjusted.
+        """
+        (idsList, timeList, speedList, heartRateList) = ([], [], [], [])
+        for idxActivity, activity in enumerate(self.activityImporters):
+            df = activity.data
+            speedName = 'speed_gap' if (gradeAdjusted and 'speed_gap' in df.columns) else 'speed'
+            if not (speedName in df.columns and 'heart_rate' in df.columns):
+                continue
+            idsList.append(np.full(len(df), idxActivity))
+            timeList.append(df['time'].values)
+            speedList.append(df[speedName].values)
+            heartRateList.append(df['heart_rate'].values)
+        
+        metricNames = ['Metric_SpeedCV', 'Metric_IsSteadyRun', 'Metric_EF_FirstHalf', 'Metric_EF_SecondHalf',
+                       'Metric_AerobicDecoupling', 'Metric_CardiacDrift', 'Metric_HRatPace']
+        if not idsList:
+            for metricName in metricNames:
+                self.activityMetricsDF[metricName] = np.nan
+            return
+        driftDF = Utils.aerobicDecoupling(np.concatenate(idsList), np.concatenate(timeList), np.concatenate(speedList),
+                                          np.concatenate(heartRateList), warmupTime)
+        driftDF['HRatPace'] = driftDF['AvgHR'] * Utils.paceToSpeed(referencePace) / driftDF['AvgSpeed']
+        driftDF['IsSteadyRun'] = (driftDF['Duration'] >= minDuration) & (driftDF['SpeedCV'] <= maxSpeedCV)
+        driftDF.loc[~driftDF['IsSteadyRun'], ['EF_FirstHalf', 'EF_SecondHalf', 'AerobicDecoupling', 'CardiacDrift', 'HRatPace']] = np.nan
+        driftDF = driftDF.reindex(self.activityMetricsDF.index)
+        for metricName in metricNames:
+            self.activityMetricsDF[metricName] = driftDF[metricName.replace('Metric_', '')].values
+    
+    def labelActivityLocations(self, gazetteerPath, **geocoderOptions):
+        """
+        Labels all activities with the closest place of a local gazetteer file
+        from their start position. Adds the columns Location_Name, Location_CountryCode
+        and Location_Distance_m to activityMetricsDF so studies can group by location.
+        See the ReverseGeocoder for the gazetteer format and options.
+        """
+        from Utilities.ReverseGeocoder import ReverseGeocoder
+        self.reverseGeocoder = ReverseGeocoder(gazetteerPath, **geocoderOptions)
+        self.reverseGeocoder.labelActivities(self.activityMetricsDF)
+    
+    def correctElevations(self, demFolder, hysteresisThreshold=5.0):
+        """
+        Corrects the altitude of all imported activities with the DEM tiles of
+        demFolder (see ElevationCorrector) in one batch. Adds the altitude_dem
+        channel to each activity and the Metric_TotalAscent_DEM and
+        Metric_TotalDescent_DEM columns to activityMetricsDF.
+        The grade adjusted channels then use the DEM grade, so the grade adjusted
+        best efforts, pace zones and metrics, the virtual splits, the aerobic
+        decoupling, the sketches and the rollups are computed again.
+        To do it at import instead, give an ElevationCorrector in activityImporterOptions.
+        """
+        from Utilities.ElevationCorrector import ElevationCorrector
+        elevationCorrector = ElevationCorrector(demFolder, hysteresisThreshold)
+        for activity in self.activityImporters:
+            activity.correctElevation(elevationCorrector)
+            if activity.ObjInfo['hasGradeAdjustedEfforts']:
+                activity.getBestEfforts(gradeAdjusted=True)
+            if activity.timeInPaceZonesGAP:
+                activity.processTimeinPaceZones(activity.customPaceZones, gradeAdjusted=True)
+        
+        # Update the exported metrics of all activities, then the outputs using the grade
+        dfUpdated = pd.DataFrame([activity.exportUsefulMetrics() for activity in self.activityImporters], index=self.activityMetricsDF.index)
+        for col in dfUpdated.columns:
+            self.activityMetricsDF[col] = dfUpdated[col].values
+        self.computeVirtualSplits()
+        self.computeAerobicDecoupling()
+        self.channelSketches = ChannelSketches()
+        self.channelSketches.updateFromImporter(self)
+        self.rollupStore.refresh(self.activityMetricsDF, fullRefresh=True)
+    
+    def applyZoneSchedule(self, zoneSchedule, fullRefresh=False):
+        """
+        Applies the HR and pace zones of a ZoneSchedule to the activities by their
+        start time. Only the new activities and those inside the periods changed
+        since the last call are computed again (see ZoneSchedule.updateFromImporter).
+        The rollups are refreshed as the zone columns changed.
+        Returns the indices of the updated activities.
+        """
+        idxUpdated = zoneSchedule.updateFromImporter(self, fullRefresh)
+        if idxUpdated:
+            self.rollupStore.refresh(self.activityMetricsDF, fullRefresh=True)
+        return idxUpdated
+
+    def reconstructInvalidDistances(self, **reconstructionOptions):
+        """
+        Reconstructs again the distance of the activities flagged with an invalid
+        distance, for instance with other options (see ActivityImporter.reconstructDistance).
+        Only these activities have their best efforts recomputed and their row
+        of activityMetricsDF updated. The virtual splits, aerobic decoupling,
+        sketches and rollups use the distance or speed so they are computed again.
+        Returns the indices of the affected activities.
+        """
+        idxAffected = [idx for idx, activity in enumerate(self.activityImporters) if not activity.ObjInfo['isDistanceValid']]
+        for idx in idxAffected:
+            activity = self.activityImporters[idx]
+            activity.reconstructDistance(**reconstructionOptions)
+            if activity.ObjInfo['hasBestEfforts']:
+                activity.getBestEfforts()
+            if activity.ObjInfo['hasGradeAdjustedEfforts']:
+                activity.getBestEfforts(gradeAdjusted=True)
+        
+        # Update the metrics of the affected activities only
+        if idxAffected:
+            dfUpdated = pd.DataFrame([self.activityImporters[idx].exportUsefulMetrics() for idx in idxAffected], index=idxAffected)
+            for col in dfUpdated.columns:
+                self.activityMetricsDF.loc[idxAffected, col] = dfUpdated[col].values
+            self.computeVirtualSplits()
+            self.computeAerobicDecoupling()
+            self.channelSketches = ChannelSketches()
+            self.channelSketches.updateFromImporter(self)
+            self.rollupStore.refresh(self.activityMetricsDF, fullRefresh=True)
+        return idxAffected
+    
     #%% Data Export Methods
     def getBestPacePerTimeEffortForPeriod(self, periodStart, periodEnd):
         """
@@ -155,6 +429,7 @@ class StandardDataImporter:
         
         Returns the list of renamed files in the destination folder.
         """
+        from tqdm import tqdm
         
         # Obtain the list of files in the source folder
         listActFitFiles = glob.glob(sourceFolder + "\\*.fit")
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+HeatmapTiles class
+Class to rasterize the GPS tracks of all activities into a web-mercator tile
+pyramid, like the tiles of online maps. Each tile is an array of tileSize x
+tileSize pixels counting the track points that fell in each pixel.
+
+Track points are accumulated at the maximum zoom with a single np.bincount per
+activity, then the tiles of lower zooms are obtained by summing 2x2 pixels of
+their four children. Tiles can be cached on disk (cacheFolder/z/x/y.npy) and are
+updated incrementally: only the new activities are rasterized and only the
+tiles they touched are recomputed and saved.
+
+Created on Wed Oct 21 09:26:52 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import numpy as np
+import json
+import os
+
+
+#%% Define the HeatmapTiles class
+class HeatmapTiles:
+    """
+    This class holds the tile pyramid of the heatmap of all activities.
+    Tiles are identified by (zoom, x, y) with the same convention as online maps:
+    x goes from west to east and y from north to south.
+    """
+
+    maxLatitude = 85.0511287798 # Limit of the web-mercator projection
+
+    def __init__(self, cacheFolder=None, maxZoom=16, minZoom=8, tileSize=256):
+        """
+        Constructor.
+        cacheFolder is the folder where tiles are saved. If it already contains a
+        heatmap, its settings and list of processed activities are loaded and
+        tiles are read from disk when needed.
+        maxZoom is the zoom where points are accumulated. At zoom 16 a pixel is about 2.4m at the equator.
+        minZoom is the lowest zoom of the pyramid.
+        """
+        self.cacheFolder = cacheFolder
+        self.maxZoom = maxZoom
+        self.minZoom = minZoom
+        self.tileSize = tileSize
+
+        self.tiles = dict()         # Tiles loaded in memory
+        self.tileKeys = set()       # All existing tiles, in memory or on disk
+        self.dirtyTiles = set()     # Tiles modified since the last save
+        self.processedFiles = set() # Activities already rasterized
+
+        if (cacheFolder is not None) and os.path.isfile(self.getIndexPath()):
+            with open(self.getIndexPath(), 'r') as indexFile:
+                heatmapIndex = json.load(indexFile)
+            self.maxZoom = heatmapIndex['maxZoom']
+            self.minZoom = heatmapIndex['minZoom']
+            self.tileSize = heatmapIndex['tileSize']
+            self.processedFiles = set(heatmapIndex['processedFiles'])
+            self.tileKeys = set(tuple(tileKey) for tileKey in heatmapIndex['tileKeys'])
+
+    #%% Projection functions
+    @staticmethod
+    def latLonToPixels(latDeg, lonDeg, zoom, tileSize=256):
+        """
+        Projects positions in degrees to the global web-mercator pixel coordinates at a zoom.
+        """
+        latRad = np.radians(np.clip(latDeg, -HeatmapTiles.maxLatitude, HeatmapTiles.maxLatitude))
+        worldSize = tileSize * 2.0**zoom
+        xPixel = (np.asarray(lonDeg) + 180.0) / 360.0 * worldSize
+        yPixel = (1.0 - np.arcsinh(np.tan(latRad)) / np.pi) / 2.0 * worldSize
+        return (xPixel, yPixel)
+
+    @staticmethod
+    def pixelsToLatLon(xPixel, yPixel, zoom, tileSize=256):
+        """
+        Converts global web-mercator pixel coordinates at a zoom back to degrees.
+        """
+        worldSize = tileSize * 2.0**zoom
+        lonDeg = np.asarray(xPixel) / worldSize * 360.0 - 180.0
+        latDeg = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(yPixel) / worldSize))))
+        return (latDeg, lonDeg)
+
+    #%% Tile access
+    def getTile(self, zoom, x, y):
+        """
+        Returns the tile as an array of counts, loaded from disk if needed.
+        Returns None if no activity went through this tile.
+        """
+        tileKey = (zoom, x, y)
+        if tileKey in self.tiles:
+            return self.tiles[tileKey]
+        if (tileKey in self.tileKeys) and (self.cacheFolder is not None):
+            self.tiles[tileKey] = np.load(self.getTilePath(zoom, x, y))
+            return self.tiles[tileKey]
+        return None
+
+    def getTilePath(self, zoom, x, y):
+        """
+        Returns the path of a tile in the cache folder.
+        """
+        return os.path.join(self.cacheFolder, str(zoom), str(x), str(y) + '.npy')
+
+    def getIndexPath(self):
+        """
+        Returns the path of the index of the cache folder.
+        """
+        return os.path.join(self.cacheFolder, 'heatmapIndex.json')
+
+    #%% Rasterization
+    def addActivity(self, activityKey, latDeg, lonDeg):
+        """
+        Accumulates the track of an activity into the tiles of the maximum zoom.
+        activityKey identifies the activity (for instance its file path) so it is
+        only added once. The lower zooms are updated by updatePyramid.
+        """
+        if activityKey in self.processedFiles:
+            return
+        self.processedFiles.add(activityKey)
+
+        latDeg = np.asarray(latDeg, dtype=float)
+        lonDeg = np.asarray(lonDeg, dtype=float)
+        isValid = ~np.isnan(latDeg) & ~np.isnan(lonDeg)
+        if not np.any(isValid):
+            return
+
+        # Global pixels then tile and pixel within the tile
+        (xPixel, yPixel) = HeatmapTiles.latLonToPixels(latDeg[isValid], lonDeg[isValid], self.maxZoom, self.tileSize)
+        Nmax = 2**self.maxZoom * self.tileSize - 1
+        xPixel = np.clip(xPixel.astype(np.int64), 0, Nmax)
+        yPixel = np.clip(yPixel.astype(np.int64), 0, Nmax)
+        (uniqueTiles, tileIdx) = np.unique((xPixel // self.tileSize) * 2**self.maxZoom + yPixel // self.tileSize, return_inverse=True)
+
+        # A single bincount accumulates all pixels of all tiles touched by the activity
+        pixelIdx = (yPixel % self.tileSize) * self.tileSize + xPixel % self.tileSize
+        Ntiles = len(uniqueTiles)
+        counts = np.bincount(tileIdx * self.tileSize**2 + pixelIdx, minlength=Ntiles * self.tileSize**2)
+        counts = counts.reshape(Ntiles, self.tileSize, self.tileSize).astype(np.uint32)
+
+        for idxTile, tileCode in enumerate(uniqueTiles):
+            tileKey = (self.maxZoom, int(tileCode // 2**self.maxZoom), int(tileCode % 2**self.maxZoom))
+            tile = self.getTile(*tileKey)
+            self.tiles[tileKey] = counts[idxTile] if tile is None else tile + counts[idxTile]
+            self.tileKeys.add(tileKey)
+            self.dirtyTiles.add(tileKey)
+
+    def updatePyramid(self):
+        """
+        Recomputes the tiles of the lower zooms that depend on modified tiles.
+        Each parent tile is the sum of 2x2 pixels of its four children.
+        """
+        for zoom in np.arange(self.maxZoom - 1, self.minZoom - 1, -1):
+            parentKeys = set((zoom, x // 2, y // 2) for (childZoom, x, y) in self.dirtyTiles if childZoom == zoom + 1)
+            for (_, xParent, yParent) in parentKeys:
+                childrenMosaic = np.zeros((2 * self.tileSize, 2 * self.tileSize), dtype=np.uint32)
+                for dx in (0, 1):
+                    for dy in (0, 1):
+                        childTile = self.getTile(zoom + 1, 2 * xParent + dx, 2 * yParent + dy)
+                        if childTile is not None:
+                            childrenMosaic[dy*self.tileSize:(dy+1)*self.tileSize, dx*self.tileSize:(dx+1)*self.tileSize] = childTile
+                parentKey = (int(zoom), xParent, yParent)
+                self.tiles[parentKey] = childrenMosaic.reshape(self.tileSize, 2, self.tileSize, 2).sum(axis=(1, 3), dtype=np.uint32)
+                self.tileKeys.add(parentKey)
+                self.dirtyTiles.add(parentKey)
+
+    def updateFromImporter(self, dataImporter):
+        """
+        Adds the activities of a data importer (GarminDataImporter or
+        WatchOffloadDataImporter) that are not in the heatmap yet, then updates
+        the pyramid and saves the modified tiles if there is a cache folder.
+        Returns the number of activities added.
+        """
+        Nadded = 0
+        for activity in dataImporter.activityImporters:
+            filePath = activity.fileInfo['filePath']
+            if filePath in self.processedFiles:
+                continue
+            df = activity.data
+            if ('position_lat_deg' in df.columns) and ('position_long_deg' in df.columns):
+                self.addActivity(filePath, df['position_lat_deg'].values, df['position_long_deg'].values)
+            else:
+                self.processedFiles.add(filePath)
+            Nadded += 1
+
+        if self.cacheFolder is not None:
+            self.save()
+        else:
+            self.updatePyramid()
+            self.dirtyTiles = set() # Nothing to save, the next update only rebuilds the tiles of the new activities
+        return Nadded
+
+    #%% Save
+    def save(self):
+        """
+        Updates the pyramid then saves the modified tiles and the index in the cache folder.
+        """
+        self.updatePyramid()
+        for (zoom, x, y) in self.dirtyTiles:
+            os.makedirs(os.path.join(self.cacheFolder, str(zoom), str(x)), exist_ok=True)
+            np.save(self.getTilePath(zoom, x, y), self.tiles[(zoom, x, y)])
+        self.dirtyTiles = set()
+
+        heatmapIndex = dict(maxZoom= self.maxZoom, minZoom= self.minZoom, tileSize= self.tileSize,
+                            processedFiles= sorted(self.processedFiles),
+                            tileKeys= sorted(self.tileKeys))
+        with open(self.getIndexPath(), 'w') as indexFile:
+            json.dump(heatmapIndex, indexFile)
+
+    #%% Rendering
+    def getBounds(self):
+        """
+        Returns the bounds (latMin, latMax, lonMin, lonMax) of all tiles of the maximum zoom.
+        """
+        tileArray = np.array([(x, y) for (zoom, x, y) in self.tileKeys if zoom == self.maxZoom])
+        (latMax, lonMin) = HeatmapTiles.pixelsToLatLon(tileArray[:, 0].min() * self.tileSize, tileArray[:, 1].min() * self.tileSize, self.maxZoom, self.tileSize)
+        (latMin, lonMax) = HeatmapTiles.pixelsToLatLon((tileArray[:, 0].max() + 1) * self.tileSize, (tileArray[:, 1].max() + 1) * self.tileSize, self.maxZoom, self.tileSize)
+        return (float(latMin), float(latMax), float(lonMin), float(lonMax))
+
+    def getZoomForBounds(self, latMin, latMax, lonMin, lonMax, maxPixels=2048):
+        """
+        Returns the highest zoom of the pyramid at which the bounds fit in an
+        image of maxPixels in width and height.
+        """
+        for zoom in np.arange(self.maxZoom, self.minZoom - 1, -1):
+            (xMin, yMax) = HeatmapTiles.latLonToPixels(latMin, lonMin, zoom, self.tileSize)
+            (xMax, yMin) = HeatmapTiles.latLonToPixels(latMax, lonMax, zoom, self.tileSize)
+            if max(xMax - xMin, yMax - yMin) <= maxPixels:
+                return int(zoom)
+        return self.minZoom
+
+    def renderImage(self, latMin, latMax, lonMin, lonMax, zoom):
+        """
+        Assembles the tiles of a zoom covering the bounds into a single image of counts.
+        Returns the image and the exact bounds of its edges (latMin, latMax, lonMin, lonMax).
+        The image is in web-mercator so its first row is the north.
+        """
+        (xMin, yMax) = HeatmapTiles.latLonToPixels(latMin, lonMin, zoom, self.tileSize)
+        (xMax, yMin) = HeatmapTiles.latLonToPixels(latMax, lonMax, zoom, self.tileSize)
+        (xMin, yMin) = (int(np.floor(xMin)), int(np.floor(yMin)))
+        (xMax, yMax) = (int(np.ceil(xMax)), int(np.ceil(yMax)))
+
+        # Mosaic of the tiles then crop to the pixels of the bounds
+        (tileXmin, tileYmin) = (xMin // self.tileSize, yMin // self.tileSize)
+        (tileXmax, tileYmax) = ((xMax - 1) // self.tileSize, (yMax - 1) // self.tileSize)
+        mosaic = np.zeros(((tileYmax - tileYmin + 1) * self.tileSize, (tileXmax - tileXmin + 1) * self.tileSize), dtype=np.uint32)
+        for x in np.arange(tileXmin, tileXmax + 1):
+            for y in np.arange(tileYmin, tileYmax + 1):
+                tile = self.getTile(zoom, int(x), int(y))
+                if tile is not None:
+                    mosaic[(y-tileYmin)*self.tileSize:(y-tileYmin+1)*self.tileSize, (x-tileXmin)*self.tileSize:(x-tileXmin+1)*self.tileSize] = tile
+        image = mosaic[yMin - tileYmin*self.tileSize:yMax - tileYmin*self.tileSize, xMin - tileXmin*self.tileSize:xMax - tileXmin*self.tileSize]
+
+        (imageLatMax, imageLonMin) = HeatmapTiles.pixelsToLatLon(xMin, yMin, zoom, self.tileSize)
+        (imageLatMin, imageLonMax) = HeatmapTiles.pixelsToLatLon(xMax, yMax, zoom, self.tileSize)
+        return (image, (float(imageLatMin), float(imageLatMax), float(imageLonMin), float(imageLonMax)))
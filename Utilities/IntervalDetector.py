@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+IntervalDetector class
+Class to find the work and recovery repetitions of interval sessions (6x800m,
+10x1min, etc.) from the speed of the activity, without relying on the laps
+which depend on the button presses.
+
+The speed is resampled at 1 Hz and segmented into parts of constant speed with
+a binary segmentation: each segment is split where the squared error of a
+piecewise constant speed decreases the most, until the decrease is not larger
+than the noise. With cumulative sums, all split candidates of all segments of a
+level are evaluated at once so the segmentation is O(N log N).
+Segments are then classified as work or recovery by their speed and adjacent
+segments of the same type are merged into repetitions.
+
+Created on Mon Oct 26 10:05:18 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+
+
+#%% Define the IntervalDetector class
+class IntervalDetector:
+    """
+    This class segments activities into work and recovery repetitions and
+    returns one table per activity, or for all activities of a data importer.
+    """
+
+    def __init__(self, channel='speed', minSegmentDuration=20.0, penaltyFactor=20.0, minSpeedRatio=1.2, recoveryWindow=60.0, smoothingWindow=5):
+        """
+        Constructor.
+        channel is the channel segmented: speed, or heart_rate for activities without speed.
+        minSegmentDuration is the shortest segment in seconds.
+        penaltyFactor multiplies the noise variance times log(N) to get the minimum
+        decrease of squared error to split a segment: larger values give fewer segments.
+        minSpeedRatio is the minimum ratio between the work and recovery speeds for
+        the activity to be considered as intervals. Steady runs have no repetitions.
+        recoveryWindow is the time in seconds after each work repetition to compute
+        the heart rate drop.
+        smoothingWindow is the moving average in seconds applied before segmentation.
+        """
+        self.channel = channel
+        self.minSegmentDuration = minSegmentDuration
+        self.penaltyFactor = penaltyFactor
+        self.minSpeedRatio = minSpeedRatio
+        self.recoveryWindow = recoveryWindow
+        self.smoothingWindow = smoothingWindow
+
+    #%% Segmentation
+    @staticmethod
+    def binarySegmentation(data, minLength, penalty):
+        """
+        Splits data into segments of constant mean. All the segments of a level are
+        split at once: the decrease of squared error of splitting at each sample is
+        computed from cumulative sums, then each segment is split at its maximum if
+        it is larger than the penalty.
+        Returns the sorted indices of the segment boundaries, with 0 and len(data).
+        """
+        N = len(data)
+        cumulatedData = np.concatenate(([0.0], np.cumsum(data)))
+        boundaries = [0, N]
+        segmentsToSplit = np.array([[0, N]]) if N >= 2 * minLength else np.zeros((0, 2), dtype=int)
+        while len(segmentsToSplit) > 0:
+            # Split candidates of all segments, at least minLength from both ends
+            candidateCounts = np.maximum(segmentsToSplit[:, 1] - segmentsToSplit[:, 0] - 2 * minLength + 1, 0)
+            idxSegments = np.repeat(np.arange(len(segmentsToSplit)), candidateCounts)
+            if len(idxSegments) == 0:
+                break
+            idxStart = segmentsToSplit[idxSegments, 0]
+            idxEnd = segmentsToSplit[idxSegments, 1]
+            offsets = np.arange(len(idxSegments)) - np.repeat(np.cumsum(candidateCounts) - candidateCounts, candidateCounts)
+            idxSplit = idxStart + minLength + offsets
+
+            # Decrease of squared error: S1^2/n1 + S2^2/n2 - S^2/n
+            sumLeft = cumulatedData[idxSplit] - cumulatedData[idxStart]
+            sumRight = cumulatedData[idxEnd] - cumulatedData[idxSplit]
+            gain = sumLeft**2 / (idxSplit - idxStart) + sumRight**2 / (idxEnd - idxSplit) - (sumLeft + sumRight)**2 / (idxEnd - idxStart)
+
+            # Best split of each segment: sort by segment then gain, the last of each segment is the maximum
+            order = np.lexsort((gain, idxSegments))
+            isLastOfSegment = np.append(idxSegments[order][1:] != idxSegments[order][:-1], True)
+            idxBest = order[isLastOfSegment]
+            isSplit = gain[idxBest] > penalty
+            newBoundaries = idxSplit[idxBest][isSplit]
+            boundaries.extend(newBoundaries.tolist())
+
+            # Children segments for the next level
+            splitSegments = segmentsToSplit[idxSegments[idxBest][isSplit]]
+            segmentsToSplit = np.vstack((np.column_stack((splitSegments[:, 0], newBoundaries)),
+                                         np.column_stack((newBoundaries, splitSegments[:, 1]))))
+            segmentsToSplit = segmentsToSplit[segmentsToSplit[:, 1] - segmentsToSplit[:, 0] >= 2 * minLength]
+        return np.sort(np.array(boundaries))
+
+    @staticmethod
+    def classifySegments(segmentMeans, segmentDurations, Niterations=20):
+        """
+        Classifies segments into two groups by their mean (1D k-means weighted by
+        the duration). Returns a boolean array, True for the fast group, and the
+        weighted means of the slow and fast groups.
+        """
+        threshold = np.average(segmentMeans, weights=segmentDurations)
+        for _ in range(Niterations):
+            isFast = segmentMeans > threshold
+            if np.all(isFast) or not np.any(isFast):
+                break
+            slowMean = np.average(segmentMeans[~isFast], weights=segmentDurations[~isFast])
+            fastMean = np.average(segmentMeans[isFast], weights=segmentDurations[isFast])
+            threshold = (slowMean + fastMean) / 2.0
+        isFast = segmentMeans > threshold
+        if np.all(isFast) or not np.any(isFast):
+            return (isFast, np.nan, np.nan)
+        return (isFast, np.average(segmentMeans[~isFast], weights=segmentDurations[~isFast]),
+                np.average(segmentMeans[isFast], weights=segmentDurations[isFast]))
+
+    #%% Repetitions
+    def detect(self, activity):
+        """
+        Finds the repetitions of an activity. Returns a DataFrame with one row per
+        repetition: Rep_Type ('WarmUp', 'Work', 'Recovery' or 'CoolDown'), Rep_Number,
+        StartTime and Duration in seconds, Distance, AvgSpeed, AvgPace, AvgHR, MaxHR
+        and, for the work repetitions, RecoveryHRDrop: the heart rate at the end of
+        the repetition minus the heart rate recoveryWindow seconds later.
+        The DataFrame is empty if the activity is not an interval session.
+        """
+        df = self.getOneHertzData(activity)
+        if df is None:
+            return pd.DataFrame()
+
+        # Segments of constant value
+        data = Utils.movingAverage(df[self.channel].values, self.smoothingWindow)
+        noiseVariance = (1.4826 * np.median(np.abs(np.diff(df[self.channel].values)))) ** 2 / 2.0
+        penalty = self.penaltyFactor * max(noiseVariance, 1.0e-6) * np.log(len(data))
+        boundaries = IntervalDetector.binarySegmentation(data, int(self.minSegmentDuration), penalty)
+        cumulatedData = np.concatenate(([0.0], np.cumsum(data)))
+        segmentMeans = (cumulatedData[boundaries[1:]] - cumulatedData[boundaries[:-1]]) / np.diff(boundaries)
+
+        # Work or recovery, then merge the adjacent segments of the same type
+        (isWork, recoveryMean, workMean) = IntervalDetector.classifySegments(segmentMeans, np.diff(boundaries).astype(float))
+        if np.isnan(workMean) or workMean < self.minSpeedRatio * max(recoveryMean, 1.0e-6):
+            return pd.DataFrame()
+        isTypeChange = np.concatenate(([True], isWork[1:] != isWork[:-1]))
+        repBoundaries = np.append(boundaries[:-1][isTypeChange], boundaries[-1])
+        repIsWork = isWork[isTypeChange]
+
+        return self.getRepetitionsTable(df, repBoundaries, repIsWork)
+
+    def getOneHertzData(self, activity):
+        """
+        Returns the time, distance, speed and heart rate of an activity resampled at
+        1 Hz, or None if the channel to segment is not available.
+        """
+        dfActivity = activity.data
+        if not self.channel in dfActivity.columns or dfActivity[self.channel].notna().sum() < 4 * self.minSegmentDuration:
+            return None
+        timeArray = dfActivity['time'].values
+        timeGrid = np.arange(timeArray[0], timeArray[-1] + 1.0, 1.0)
+        df = pd.DataFrame(data={'time': timeGrid})
+        for channelName in ['distance', 'speed', 'heart_rate']:
+            if channelName in dfActivity.columns and dfActivity[channelName].notna().any():
+                isValid = dfActivity[channelName].notna().values
+                df[channelName] = np.interp(timeGrid, timeArray[isValid], dfActivity[channelName].values[isValid])
+            else:
+                df[channelName] = np.nan
+        return df
+
+    def getRepetitionsTable(self, df, repBoundaries, repIsWork):
+        """
+        Computes the metrics of each repetition from the 1 Hz data and the indices of
+        the boundaries of the repetitions.
+        """
+        idxStart = repBoundaries[:-1]
+        idxEnd = repBoundaries[1:]
+        idxLast = idxEnd - 1
+        timeArray = df['time'].values
+        heartRate = df['heart_rate'].values
+        cumulatedHR = np.concatenate(([0.0], np.cumsum(heartRate)))
+
+        # Slow parts before the first and after the last work repetitions are the warm up and cool down
+        repTypes = np.where(repIsWork, 'Work', 'Recovery').astype(object)
+        if not repIsWork[0]:
+            repTypes[0] = 'WarmUp'
+        if not repIsWork[-1]:
+            repTypes[-1] = 'CoolDown'
+        repsDF = pd.DataFrame(data={'Rep_Type': repTypes})
+        repsDF['Rep_Number'] = repsDF.groupby('Rep_Type').cumcount() + 1
+        repsDF['StartTime'] = timeArray[idxStart]
+        repsDF['Duration'] = timeArray[idxLast] - timeArray[idxStart] + 1.0
+        repsDF['Distance'] = df['distance'].values[idxLast] - df['distance'].values[idxStart] + df['speed'].values[idxLast]
+        repsDF['AvgSpeed'] = repsDF['Distance'] / repsDF['Duration']
+        repsDF['AvgPace'] = Utils.speedToPace(repsDF['AvgSpeed'])
+        repsDF['AvgHR'] = (cumulatedHR[idxEnd] - cumulatedHR[idxStart]) / (idxEnd - idxStart)
+        repsDF['MaxHR'] = np.maximum.reduceat(heartRate, idxStart) if len(idxStart) > 0 else []
+
+        # Heart rate drop after each work repetition, within the activity
+        idxRecovery = np.minimum(idxLast + int(self.recoveryWindow), len(heartRate) - 1)
+        repsDF['RecoveryHRDrop'] = np.where(repIsWork & (idxRecovery > idxLast), heartRate[idxLast] - heartRate[idxRecovery], np.nan)
+        return repsDF
+
+    def detectFromImporter(self, dataImporter):
+        """
+        Finds the repetitions of all activities of a data importer (GarminDataImporter
+        or WatchOffloadDataImporter). Returns a single DataFrame with the Activity_Id
+        (index in activityMetricsDF) and Metric_StartTime of each repetition, so the
+        repetitions can be compared between sessions.
+        """
+        repsList = []
+        for idxActivity, activity in enumerate(dataImporter.activityImporters):
+            repsDF = self.detect(activity)
+            if len(repsDF) == 0:
+                continue
+            repsDF.insert(0, 'Activity_Id', idxActivity)
+            repsDF.insert(1, 'Metric_StartTime', dataImporter.activityMetricsDF.loc[idxActivity, 'Metric_StartTime'])
+            repsList.append(repsDF)
+        if not repsList:
+            return pd.DataFrame()
+        return pd.concat(repsList, ignore_index=True)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+ReverseGeocoder class
+Class to label positions with the name of the closest place (town, park, etc.)
+from a gazetteer file stored locally, without any network service.
+
+The gazetteer can be a GeoNames file (for instance cities500.txt or a country
+file from https://download.geonames.org/export/dump/) or a csv file with the
+columns name, latitude and longitude. Places are put in a KD-tree on the unit
+sphere once, then all positions are queried in a single call.
+
+Created on Thu Oct 22 10:41:15 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+# scipy is imported when the KD-tree is built, only needed by this class
+
+
+#%% Define the ReverseGeocoder class
+class ReverseGeocoder:
+    """
+    This class finds the closest place of a gazetteer for many positions at once.
+    Positions are converted to points on the unit sphere so the distance in the
+    KD-tree (chord) is directly converted to the great circle distance.
+    """
+
+    # Columns of the GeoNames files (tab separated, without header)
+    geoNamesColumns = ['geonameid', 'name', 'asciiname', 'alternatenames', 'latitude', 'longitude',
+                       'feature_class', 'feature_code', 'country_code', 'cc2', 'admin1_code', 'admin2_code',
+                       'admin3_code', 'admin4_code', 'population', 'elevation', 'dem', 'timezone', 'modification_date']
+
+    def __init__(self, gazetteerPath, featureClasses=('P', 'L'), maxDistance=5000.0):
+        """
+        Constructor. Loads the gazetteer and builds the KD-tree.
+        gazetteerPath is a GeoNames .txt file or a csv file with name, latitude and longitude columns.
+        featureClasses filters the GeoNames places: P for cities and villages, L for parks and areas.
+        maxDistance is the distance in meters above which a position gets no place name.
+        """
+        from scipy.spatial import cKDTree
+
+        self.maxDistance = maxDistance
+        self.placesDF = ReverseGeocoder.loadGazetteer(gazetteerPath, featureClasses)
+        self.tree = cKDTree(ReverseGeocoder.latLonToUnitVectors(self.placesDF['latitude'].values, self.placesDF['longitude'].values))
+
+    #%% Gazetteer
+    @staticmethod
+    def loadGazetteer(gazetteerPath, featureClasses=('P', 'L')):
+        """
+        Loads a gazetteer into a DataFrame with the columns name, latitude, longitude and country_code.
+        """
+        if gazetteerPath.lower().endswith('.txt'):
+            placesDF = pd.read_csv(gazetteerPath, sep='\t', header=None, names=ReverseGeocoder.geoNamesColumns,
+                                   usecols=['name', 'latitude', 'longitude', 'feature_class', 'country_code'],
+                                   dtype={'name': str, 'feature_class': str, 'country_code': str},
+                                   quoting=3, keep_default_na=False, na_values=[''])
+            if featureClasses:
+                placesDF = placesDF.loc[placesDF['feature_class'].isin(featureClasses)]
+        else:
+            placesDF = pd.read_csv(gazetteerPath)
+            if not 'country_code' in placesDF.columns:
+                placesDF['country_code'] = ""
+        return placesDF[['name', 'latitude', 'longitude', 'country_code']].dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+
+    @staticmethod
+    def latLonToUnitVectors(latDeg, lonDeg):
+        """
+        Converts positions in degrees to points (x, y, z) on the unit sphere as an array (N, 3).
+        """
+        latRad = np.radians(np.asarray(latDeg, dtype=float))
+        lonRad = np.radians(np.asarray(lonDeg, dtype=float))
+        return np.column_stack((np.cos(latRad) * np.cos(lonRad), np.cos(latRad) * np.sin(lonRad), np.sin(latRad)))
+
+    #%% Queries
+    def queryPlaces(self, latDeg, lonDeg):
+        """
+        Finds the closest place of all positions at once.
+        Returns a DataFrame with the name, country code and distance in meters of
+        the closest place. Positions without a place within maxDistance, or
+        without a position (NaN), have no name and a NaN distance.
+        """
+        latDeg = np.atleast_1d(np.asarray(latDeg, dtype=float))
+        lonDeg = np.atleast_1d(np.asarray(lonDeg, dtype=float))
+        isValid = ~np.isnan(latDeg) & ~np.isnan(lonDeg)
+
+        # Chord on the unit sphere to great circle distance
+        maxChord = 2.0 * np.sin(min(self.maxDistance / Utils.earthRadius, np.pi) / 2.0)
+        (chords, idxPlaces) = self.tree.query(ReverseGeocoder.latLonToUnitVectors(latDeg[isValid], lonDeg[isValid]),
+                                              k=1, distance_upper_bound=maxChord * (1.0 + 1.0e-9))
+        isFound = np.isfinite(chords) # Not found gives an infinite distance
+        idxValid = np.flatnonzero(isValid)[isFound]
+        idxPlaces = idxPlaces[isFound]
+
+        names = np.full(len(latDeg), None, dtype=object)
+        countryCodes = np.full(len(latDeg), None, dtype=object)
+        distances = np.ones(len(latDeg)) * np.nan
+        names[idxValid] = self.placesDF['name'].values[idxPlaces]
+        countryCodes[idxValid] = self.placesDF['country_code'].values[idxPlaces]
+        distances[idxValid] = 2.0 * Utils.earthRadius * np.arcsin(np.minimum(chords[isFound] / 2.0, 1.0))
+        return pd.DataFrame(data={'name': names, 'country_code': countryCodes, 'distance': distances})
+
+    def labelActivities(self, metricsDF, latColumn='Metric_StartPosition_Lat', lonColumn='Metric_StartPosition_Long'):
+        """
+        Labels all activities of a metrics DataFrame in one query from their start position.
+        Adds the columns Location_Name, Location_CountryCode and Location_Distance_m
+        (distance to the place) and returns the DataFrame.
+        """
+        dfPlaces = self.queryPlaces(metricsDF[latColumn].values, metricsDF[lonColumn].values)
+        metricsDF['Location_Name'] = dfPlaces['name'].values
+        metricsDF['Location_CountryCode'] = dfPlaces['country_code'].values
+        metricsDF['Location_Distance_m'] = dfPlaces['distance'].values
+        return metricsDF
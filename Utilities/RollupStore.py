@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+RollupStore class
+Class to keep the weekly and monthly totals of the metrics table (distance,
+time, time in zones, effort scores, elevation) so dashboards and plots don't
+group all activities again each time.
+
+Periods are integer keys: the number of weeks (starting on Monday) or months
+since 1970. When activities are added, only the periods containing them are
+computed again from the metrics table.
+
+Created on Wed Oct 28 09:48:13 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import numpy as np
+import pandas as pd
+import pickle
+
+
+#%% Define the RollupStore class
+class RollupStore:
+    """
+    This class holds one table per period type ('week' and 'month') with one row
+    per period and the sum of the metrics of its activities.
+    """
+
+    # Metrics summed in each period, and prefixes of the groups of columns summed too
+    sumColumns = ['Metric_TotalDistance', 'Metric_TotalTimerTime', 'Metric_TotalElapsedTime', 'Metric_TotalCalories',
+                  'Metric_TotalAscent', 'Metric_TotalDescent', 'Metric_TotalAscent_DEM', 'Metric_TotalDescent_DEM']
+    sumPrefixes = ['HR_Time_', 'HR_Custom_Time_', 'PaceZone_Time_', 'PaceZoneGAP_Time_', 'Effort_']
+    periodTypes = ['week', 'month']
+
+    def __init__(self):
+        """
+        Constructor of an empty store, filled with refresh.
+        """
+        self.processedFiles = set()
+        self.rollups = {periodType: pd.DataFrame() for periodType in RollupStore.periodTypes}
+
+    #%% Periods
+    @staticmethod
+    def getPeriodKeys(startTimes, periodType):
+        """
+        Returns the integer key of the period of each start time (UTC): weeks
+        starting on Monday or months since January 1970.
+        """
+        startTimes = pd.to_datetime(pd.Series(startTimes))
+        if startTimes.dt.tz is not None:
+            startTimes = startTimes.dt.tz_convert(None)
+        if periodType == 'week':
+            daysSinceEpoch = (startTimes.values.astype('datetime64[D]') - np.datetime64('1970-01-01', 'D')).astype(int)
+            return (daysSinceEpoch + 3) // 7 # 1970-01-01 is a Thursday
+        elif periodType == 'month':
+            return (startTimes.dt.year.values - 1970) * 12 + startTimes.dt.month.values - 1
+        raise ValueError(f"{periodType} is not a period type of the RollupStore")
+
+    @staticmethod
+    def getPeriodStarts(periodKeys, periodType):
+        """
+        Returns the first day of each period key.
+        """
+        periodKeys = np.asarray(periodKeys, dtype=int)
+        if periodType == 'week':
+            return pd.to_datetime(np.datetime64('1970-01-01', 'D') + (periodKeys * 7 - 3).astype('timedelta64[D]'))
+        elif periodType == 'month':
+            return pd.to_datetime(np.datetime64('1970-01', 'M') + periodKeys.astype('timedelta64[M]'))
+        raise ValueError(f"{periodType} is not a period type of the RollupStore")
+
+    #%% Refresh
+    def getSummedColumns(self, metricsDF):
+        """
+        Returns the columns of the metrics table summed in the rollups.
+        """
+        return [columnName for columnName in metricsDF.columns
+                if columnName in RollupStore.sumColumns or any(columnName.startswith(prefix) for prefix in RollupStore.sumPrefixes)]
+
+    def refresh(self, metricsDF, fullRefresh=False):
+        """
+        Updates the rollups with the activities of metricsDF not processed yet:
+        only the periods containing new activities are computed again from metricsDF.
+        fullRefresh computes all periods again, for instance after some columns
+        of metricsDF were changed. It is forced when metricsDF has summed columns
+        not in the rollups yet, like Effort_ columns added after the import.
+        Returns the number of new activities.
+        """
+        summedColumns = self.getSummedColumns(metricsDF)
+        storedColumns = self.rollups[RollupStore.periodTypes[0]].columns
+        fullRefresh = fullRefresh or any(columnName not in storedColumns for columnName in summedColumns)
+        isNew = ~metricsDF['File_Path'].isin(self.processedFiles) | fullRefresh
+        if not isNew.any():
+            return 0
+
+        for periodType in RollupStore.periodTypes:
+            periodKeys = RollupStore.getPeriodKeys(metricsDF['Metric_StartTime'], periodType)
+            touchedPeriods = np.unique(periodKeys[isNew.values])
+            isInTouched = np.isin(periodKeys, touchedPeriods)
+
+            # Totals of the touched periods from all their activities
+            dfTouched = metricsDF.loc[isInTouched, summedColumns].apply(pd.to_numeric, errors='coerce')
+            periodGroups = dfTouched.groupby(periodKeys[isInTouched])
+            dfPeriods = periodGroups.sum(min_count=1)
+            dfPeriods.insert(0, 'Nactivities', periodGroups.size())
+            dfPeriods.insert(0, 'Period_Start', RollupStore.getPeriodStarts(dfPeriods.index, periodType))
+            dfPeriods.index.name = 'Period'
+
+            # Replace the touched periods in the stored rollup
+            dfRollup = self.rollups[periodType]
+            if len(dfRollup) > 0 and not fullRefresh:
+                dfRollup = pd.concat([dfRollup.loc[~dfRollup.index.isin(touchedPeriods)], dfPeriods])
+            else:
+                dfRollup = dfPeriods
+            self.rollups[periodType] = dfRollup.sort_index()
+
+        self.processedFiles.update(metricsDF.loc[isNew, 'File_Path'])
+        return int(isNew.sum())
+
+    def isRefreshedWith(self, metricsDF, columnNames=[]):
+        """
+        Returns True if the rollups contain exactly the activities of metricsDF
+        and the given columns, so they can be used instead of grouping metricsDF.
+        """
+        storedColumns = self.rollups[RollupStore.periodTypes[0]].columns
+        return (self.processedFiles == set(metricsDF['File_Path'])) and all(columnName in storedColumns for columnName in columnNames)
+
+    def getRollup(self, periodType='month', fillEmptyPeriods=False):
+        """
+        Returns the rollup table of a period type. With fillEmptyPeriods, the
+        periods without activities are added with zeros.
+        """
+        dfRollup = self.rollups[periodType]
+        if fillEmptyPeriods and len(dfRollup) > 0:
+            allPeriods = np.arange(dfRollup.index.min(), dfRollup.index.max() + 1)
+            dfRollup = dfRollup.reindex(allPeriods)
+            dfRollup['Period_Start'] = RollupStore.getPeriodStarts(allPeriods, periodType)
+            dfRollup = dfRollup.fillna({columnName: 0 for columnName in dfRollup.columns if columnName != 'Period_Start'})
+            dfRollup.index.name = 'Period'
+        return dfRollup
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the rollups into a pickle file.
+        """
+        with open(filePath, 'wb') as saveFile:
+            pickle.dump(self.__dict__, saveFile)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads a store saved with the save method.
+        """
+        rollupStore = RollupStore()
+        with open(filePath, 'rb') as saveFile:
+            rollupStore.__dict__.update(pickle.load(saveFile))
+        return rollupStore
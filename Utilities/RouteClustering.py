@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+RouteClusterer class
+Class to group activities that ran the same route. Each activity is summarised
+by a compact route signature: its track resampled to a fixed number of points,
+the set of grid cells it went through and its length.
+Routes are found incrementally: each new activity is only compared with the
+routes starting in the neighbouring cells of its start, found through a
+dictionary of cells, and not with all other activities.
+
+Created on Tue Oct 20 15:31:44 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+
+
+#%% Define the RouteClusterer class
+class RouteClusterer:
+    """
+    This class assigns a route id to each activity. The first activity of a
+    route is its reference: later activities join the route if their signature
+    is close enough to that reference, else they create a new route.
+    """
+
+    def __init__(self, Npoints=32, cellSize=0.002, bucketSize=0.01, maxMeanDistance=200.0,
+                       minCellOverlap=0.5, maxLengthDifference=0.15):
+        """
+        Constructor.
+        Npoints is the number of points of the resampled track in the signature.
+        cellSize is the size in degrees of the cells of the signature (about 200m by default).
+        bucketSize is the size in degrees of the cells used to find routes by their start (about 1km).
+        An activity joins a route if:
+            - the mean distance between resampled points is below maxMeanDistance meters
+            - the ratio of common cells (Jaccard index) is above minCellOverlap
+            - the relative length difference is below maxLengthDifference
+        """
+        self.Npoints = Npoints
+        self.cellSize = cellSize
+        self.bucketSize = bucketSize
+        self.maxMeanDistance = maxMeanDistance
+        self.minCellOverlap = minCellOverlap
+        self.maxLengthDifference = maxLengthDifference
+
+        # Reference signature of each route
+        self.routeTracks = []
+        self.routeCells = []
+        self.routeLengths = []
+        self.routeNbActivities = []
+        # Routes per bucket of start position
+        self.routeBuckets = dict()
+        # Route of each activity already processed
+        self.activityRoutes = dict()
+
+    #%% Signature
+    def computeSignature(self, latDeg, lonDeg):
+        """
+        Computes the route signature of a track given in degrees.
+        Returns the track resampled to Npoints equally spaced in distance (Npoints, 2),
+        the sorted array of the cell keys it went through, and its length in meters.
+        Returns None if the track has no valid position.
+        """
+        latDeg = np.asarray(latDeg, dtype=float)
+        lonDeg = np.asarray(lonDeg, dtype=float)
+        isValid = ~np.isnan(latDeg) & ~np.isnan(lonDeg)
+        latDeg = latDeg[isValid]
+        lonDeg = lonDeg[isValid]
+        if len(latDeg) < 2:
+            return None
+
+        # Resample along the cumulated distance of the track
+        cumulatedDistance = np.concatenate(([0.0], np.cumsum(Utils.haversineDistance(latDeg[:-1], lonDeg[:-1], latDeg[1:], lonDeg[1:]))))
+        trackLength = cumulatedDistance[-1]
+        resampleDistance = np.linspace(0.0, trackLength, self.Npoints)
+        track = np.column_stack((np.interp(resampleDistance, cumulatedDistance, latDeg),
+                                 np.interp(resampleDistance, cumulatedDistance, lonDeg)))
+
+        # Set of cells, from points every half cell along the track so that
+        # simplified tracks with long straight segments don't skip cells
+        cellDistance = np.append(np.arange(0.0, trackLength, np.radians(self.cellSize) * Utils.earthRadius / 2.0), trackLength)
+        rows = np.floor((np.interp(cellDistance, cumulatedDistance, latDeg) + 90.0) / self.cellSize).astype(np.int64)
+        columns = np.floor((np.interp(cellDistance, cumulatedDistance, lonDeg) + 180.0) / self.cellSize).astype(np.int64)
+        cells = np.unique(rows * int(np.ceil(360.0 / self.cellSize)) + columns)
+
+        return (track, cells, trackLength)
+
+    def getBucket(self, latDeg, lonDeg):
+        """
+        Returns the bucket (row, column) of a start position.
+        """
+        return (int(np.floor((latDeg + 90.0) / self.bucketSize)), int(np.floor((lonDeg + 180.0) / self.bucketSize)))
+
+    #%% Clustering
+    def addActivity(self, activityKey, latDeg, lonDeg):
+        """
+        Assigns a route to an activity given its track in degrees and returns the route id.
+        activityKey identifies the activity (for instance its file path). An activity
+        already processed keeps its route. Activities without position get the route -1.
+        """
+        if activityKey in self.activityRoutes:
+            return self.activityRoutes[activityKey]
+
+        signature = self.computeSignature(latDeg, lonDeg)
+        if signature is None:
+            self.activityRoutes[activityKey] = -1
+            return -1
+        (track, cells, trackLength) = signature
+
+        # Candidate routes starting in the 3x3 neighbouring buckets
+        (bucketRow, bucketColumn) = self.getBucket(track[0, 0], track[0, 1])
+        candidateRoutes = [routeId for dRow in (-1, 0, 1) for dColumn in (-1, 0, 1)
+                           for routeId in self.routeBuckets.get((bucketRow + dRow, bucketColumn + dColumn), [])]
+
+        routeId = -1
+        if candidateRoutes:
+            # Mean distance between resampled points for all candidates at once
+            candidateTracks = np.stack([self.routeTracks[candidateId] for candidateId in candidateRoutes])
+            meanDistances = Utils.haversineDistance(candidateTracks[:, :, 0], candidateTracks[:, :, 1],
+                                                    track[np.newaxis, :, 0], track[np.newaxis, :, 1]).mean(axis=1)
+            candidateLengths = np.array([self.routeLengths[candidateId] for candidateId in candidateRoutes])
+            isMatching = (meanDistances <= self.maxMeanDistance) & \
+                         (np.abs(candidateLengths - trackLength) <= self.maxLengthDifference * candidateLengths)
+            # Check the cells overlap from the closest candidate
+            for idxCandidate in np.argsort(meanDistances):
+                if not isMatching[idxCandidate]:
+                    continue
+                candidateCells = self.routeCells[candidateRoutes[idxCandidate]]
+                NcommonCells = len(np.intersect1d(cells, candidateCells, assume_unique=True))
+                if NcommonCells / (len(cells) + len(candidateCells) - NcommonCells) >= self.minCellOverlap:
+                    routeId = candidateRoutes[idxCandidate]
+                    break
+
+        if routeId == -1:
+            # New route with this activity as reference
+            routeId = len(self.routeTracks)
+            self.routeTracks.append(track)
+            self.routeCells.append(cells)
+            self.routeLengths.append(trackLength)
+            self.routeNbActivities.append(0)
+            self.routeBuckets.setdefault((bucketRow, bucketColumn), []).append(routeId)
+
+        self.routeNbActivities[routeId] += 1
+        self.activityRoutes[activityKey] = routeId
+        return routeId
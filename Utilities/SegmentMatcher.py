@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+SegmentMatcher class
+Class to define segments of a route (Strava style) and find the efforts of all
+activities on these segments. A segment is a polyline with a start gate and an
+end gate perpendicular to the route. An effort starts when the track crosses
+the start gate and ends when it crosses the end gate.
+
+Candidate activities come from the spatial index of the data importer and the
+gate crossings are found by vectorized interpolation along each track.
+
+Created on Tue Oct 20 08:47:05 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+
+
+#%% Define the SegmentMatcher class
+class SegmentMatcher:
+    """
+    This class holds user defined segments and the table of efforts of all
+    activities on them. The table is updated incrementally: only activities
+    that have not been matched with a segment yet are processed.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Segments are added with addSegment.
+        """
+        self.segments = dict()
+        self.processedFiles = dict() # Files already matched for each segment
+        self.effortsDF = pd.DataFrame(columns=['Segment_Name', 'Activity_Id', 'File_Path', 'Effort_StartTime',
+                                               'Effort_ElapsedTime', 'Effort_Distance', 'Effort_Pace', 'Effort_AvgHR'])
+
+    #%% Segment definition
+    def addSegment(self, segmentName, latArray, lonArray, gateWidth=30.0, distanceTolerance=0.2):
+        """
+        Adds a segment given by its polyline in degrees, from start to end.
+        gateWidth is the width in meters of the start and end gates.
+        distanceTolerance is the relative difference allowed between the distance
+        of an effort and the length of the segment, to reject shortcuts and detours.
+        """
+        latArray = np.asarray(latArray, dtype=float)
+        lonArray = np.asarray(lonArray, dtype=float)
+        segmentLength = np.sum(Utils.haversineDistance(latArray[:-1], lonArray[:-1], latArray[1:], lonArray[1:]))
+
+        self.segments[segmentName] = dict(
+            latArray= latArray,
+            lonArray= lonArray,
+            length= segmentLength,
+            gateWidth= gateWidth,
+            distanceTolerance= distanceTolerance,
+            # The gates are perpendicular to the first and last parts of the polyline
+            startGate= SegmentMatcher.createGate(latArray[0], lonArray[0], latArray[1], lonArray[1]),
+            endGate= SegmentMatcher.createGate(latArray[-1], lonArray[-1], latArray[-2], lonArray[-2], reverse=True),
+            )
+        self.processedFiles[segmentName] = set()
+
+    @staticmethod
+    def createGate(latGate, lonGate, latNext, lonNext, reverse=False):
+        """
+        Creates a gate centred on a point and perpendicular to the direction towards
+        the next point. Returns the centre and the unit direction of travel in the
+        local plane of the gate. reverse flips the direction, for the end gate
+        where the next point is the previous point of the polyline.
+        """
+        (dx, dy) = Utils.latLonToLocalMeters(latNext, lonNext, latGate, lonGate)
+        direction = np.array([dx, dy]) / np.hypot(dx, dy)
+        if reverse:
+            direction = -direction
+        return dict(lat= latGate, lon= lonGate, direction= direction)
+
+    #%% Matching functions
+    @staticmethod
+    def findGateCrossings(gate, gateWidth, latDeg, lonDeg, timeArray, distanceArray):
+        """
+        Finds when a track crosses a gate in its direction of travel.
+        All consecutive pairs of samples are tested at once. Returns the arrays of
+        interpolated times and distances of the crossings.
+        """
+        (x, y) = Utils.latLonToLocalMeters(latDeg, lonDeg, gate['lat'], gate['lon'])
+        # Signed distance along the direction of travel and lateral offset to the gate centre
+        along = x * gate['direction'][0] + y * gate['direction'][1]
+        lateral = -x * gate['direction'][1] + y * gate['direction'][0]
+        # Crossing from behind to in front of the gate between two samples
+        idxCross = np.flatnonzero((along[:-1] < 0.0) & (along[1:] >= 0.0))
+        fraction = -along[idxCross] / (along[idxCross+1] - along[idxCross])
+        lateralCross = lateral[idxCross] + fraction * (lateral[idxCross+1] - lateral[idxCross])
+        isInGate = np.abs(lateralCross) <= gateWidth / 2.0
+        idxCross = idxCross[isInGate]
+        fraction = fraction[isInGate]
+        crossTimes = timeArray[idxCross] + fraction * (timeArray[idxCross+1] - timeArray[idxCross])
+        crossDistances = distanceArray[idxCross] + fraction * (distanceArray[idxCross+1] - distanceArray[idxCross])
+        return (crossTimes, crossDistances)
+
+    def matchActivity(self, segmentName, df):
+        """
+        Finds all the efforts on a segment in the data of an activity.
+        Returns a DataFrame with the start time in seconds since the start of the
+        activity, the elapsed time, the distance and the average heart rate of each effort.
+        """
+        segment = self.segments[segmentName]
+        latDeg = df['position_lat_deg'].values
+        lonDeg = df['position_long_deg'].values
+        timeArray = df['time'].values
+        distanceArray = df['distance'].values
+        (startTimes, startDistances) = SegmentMatcher.findGateCrossings(segment['startGate'], segment['gateWidth'], latDeg, lonDeg, timeArray, distanceArray)
+        (endTimes, endDistances) = SegmentMatcher.findGateCrossings(segment['endGate'], segment['gateWidth'], latDeg, lonDeg, timeArray, distanceArray)
+
+        # Each end crossing is paired with the last start crossing before it
+        # A start crossing is only used by the first end crossing after it
+        idxStart = np.searchsorted(startTimes, endTimes, side='left') - 1
+        isPaired = idxStart >= 0
+        isPaired[1:] &= idxStart[1:] != idxStart[:-1]
+        idxStart = idxStart[isPaired]
+        endTimes = endTimes[isPaired]
+        endDistances = endDistances[isPaired]
+        startTimes = startTimes[idxStart]
+        startDistances = startDistances[idxStart]
+
+        # Reject efforts that did not follow the segment
+        effortDistances = endDistances - startDistances
+        isValid = np.abs(effortDistances - segment['length']) <= segment['distanceTolerance'] * segment['length']
+
+        # Time weighted average heart rate from the cumulated integral of the heart rate
+        heartRate = df['heart_rate'].values
+        cumulatedHR = np.concatenate(([0.0], np.cumsum(np.diff(timeArray) * (heartRate[1:] + heartRate[:-1]) / 2.0)))
+        elapsedTimes = endTimes - startTimes
+        avgHR = (np.interp(endTimes, timeArray, cumulatedHR) - np.interp(startTimes, timeArray, cumulatedHR)) / elapsedTimes
+
+        return pd.DataFrame(data={'startTime': startTimes[isValid],
+                                  'elapsedTime': elapsedTimes[isValid],
+                                  'distance': effortDistances[isValid],
+                                  'avgHR': avgHR[isValid]})
+
+    def updateEfforts(self, dataImporter):
+        """
+        Matches the activities of a data importer (GarminDataImporter or
+        WatchOffloadDataImporter) with all segments. Only the activities that have
+        not been matched with a segment yet are processed, and only those that the
+        spatial index finds near both the start and the end of the segment are loaded.
+        Returns the updated table of efforts.
+        """
+        newEffortsList = []
+        for segmentName, segment in self.segments.items():
+            # Spatial prefilter: activities going near both gates
+            nearStart = dataImporter.spatialIndex.queryPointRadius(segment['latArray'][0], segment['lonArray'][0], segment['gateWidth'])
+            nearEnd = dataImporter.spatialIndex.queryPointRadius(segment['latArray'][-1], segment['lonArray'][-1], segment['gateWidth'])
+            candidateIds = np.intersect1d(nearStart['activityId'], nearEnd['activityId'])
+
+            for activityId in candidateIds:
+                activity = dataImporter.activityImporters[activityId]
+                filePath = activity.fileInfo['filePath']
+                if filePath in self.processedFiles[segmentName]:
+                    continue
+                df = activity.data
+                dfEfforts = self.matchActivity(segmentName, df)
+                if len(dfEfforts) > 0:
+                    newEffortsList.append(pd.DataFrame(data={
+                        'Segment_Name': segmentName,
+                        'Activity_Id': activityId,
+                        'File_Path': filePath,
+                        'Effort_StartTime': df['timestamp'].iloc[0] + pd.to_timedelta(dfEfforts['startTime'], unit='s'),
+                        'Effort_ElapsedTime': dfEfforts['elapsedTime'],
+                        'Effort_Distance': dfEfforts['distance'],
+                        'Effort_Pace': Utils.speedToPace(segment['length'] / dfEfforts['elapsedTime']),
+                        'Effort_AvgHR': dfEfforts['avgHR']
+                        }))
+
+            # All files of the importer are now processed for that segment, even those not near it
+            self.processedFiles[segmentName].update(dataImporter.spatialIndex.activityPaths)
+
+        if newEffortsList:
+            self.effortsDF = pd.concat([self.effortsDF] + newEffortsList, ignore_index=True) if len(self.effortsDF) > 0 \
+                                else pd.concat(newEffortsList, ignore_index=True)
+        return self.effortsDF
+
+    #%% Results
+    def getSegmentBestEfforts(self, segmentName, Nefforts=10):
+        """
+        Returns the Nefforts fastest efforts on a segment.
+        """
+        dfSegment = self.effortsDF.loc[self.effortsDF['Segment_Name'] == segmentName]
+        return dfSegment.sort_values('Effort_ElapsedTime').head(Nefforts)
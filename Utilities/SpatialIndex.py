@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+SpatialIndex class
+Grid index of the GPS tracks of all activities. Each grid cell is mapped to the
+activities that went through it and the range of samples spent in that cell.
+It answers bounding box and point-radius queries without loading the activities
+and can be saved to disk so only the matching activities need to be imported.
+
+Created on Mon Oct 19 14:02:17 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+
+
+#%% Define the SpatialIndex class
+class SpatialIndex:
+    """
+    This class indexes the GPS tracks on a regular latitude/longitude grid.
+    Cells are identified by an integer key (row * Ncolumns + column) so the cells
+    of one row of a bounding box are a contiguous range of keys.
+    Activities are identified by their position in activityPaths.
+    """
+
+    def __init__(self, cellSize=0.005):
+        """
+        Constructor. cellSize is the size of the grid cells in degrees.
+        The default of 0.005 degree is about 550m in latitude.
+        """
+        self.cellSize = cellSize
+        self.Nrows = int(np.ceil(180.0 / cellSize))
+        self.Ncolumns = int(np.ceil(360.0 / cellSize))
+        self.activityPaths = []
+
+        # One entry per run of consecutive samples in the same cell
+        # Stored as chunks appended per activity, merged and sorted when queried
+        self.entryChunks = []
+        self.cellKeys = np.array([], dtype=np.int64)
+        self.activityIds = np.array([], dtype=np.int32)
+        self.idxStarts = np.array([], dtype=np.int32)
+        self.idxEnds = np.array([], dtype=np.int32)
+
+    #%% Index building functions
+    def getCellRowsColumns(self, latDeg, lonDeg):
+        """
+        Returns the rows and columns of the cells containing the positions.
+        Latitude 90 and longitude 180 are in the last row and column so keys
+        don't overflow into the next row.
+        """
+        rows = np.clip(np.floor((np.asarray(latDeg) + 90.0) / self.cellSize).astype(np.int64), 0, self.Nrows - 1)
+        columns = np.clip(np.floor((np.asarray(lonDeg) + 180.0) / self.cellSize).astype(np.int64), 0, self.Ncolumns - 1)
+        return (rows, columns)
+
+    def getCellKeys(self, latDeg, lonDeg):
+        """
+        Returns the keys of the cells containing the positions.
+        """
+        (rows, columns) = self.getCellRowsColumns(latDeg, lonDeg)
+        return rows * self.Ncolumns + columns
+
+    def addActivity(self, filePath, latDeg, lonDeg):
+        """
+        Adds the track of an activity to the index and returns its activity id.
+        latDeg and lonDeg are the position channels of the activity in degrees.
+        Samples without position (NaN) are ignored. If the file is already in the
+        index, its previous entries are replaced.
+        """
+        if filePath in self.activityPaths:
+            activityId = self.activityPaths.index(filePath)
+            self.removeActivity(activityId)
+        else:
+            activityId = len(self.activityPaths)
+            self.activityPaths.append(filePath)
+
+        latDeg = np.asarray(latDeg, dtype=float)
+        lonDeg = np.asarray(lonDeg, dtype=float)
+        idxValid = np.flatnonzero(~np.isnan(latDeg) & ~np.isnan(lonDeg))
+        if len(idxValid) == 0:
+            return activityId
+
+        # Run-length encoding of the cells visited along the track
+        keys = self.getCellKeys(latDeg[idxValid], lonDeg[idxValid])
+        isRunStart = np.concatenate(([True], keys[1:] != keys[:-1]))
+        runStarts = np.flatnonzero(isRunStart)
+        runEnds = np.concatenate((runStarts[1:], [len(keys)])) - 1
+        self.entryChunks.append((keys[runStarts],
+                                 np.full(len(runStarts), activityId, dtype=np.int32),
+                                 idxValid[runStarts].astype(np.int32),
+                                 idxValid[runEnds].astype(np.int32)))
+        return activityId
+
+    def removeActivity(self, activityId):
+        """
+        Removes all entries of an activity. Its id is kept so other ids don't change.
+        """
+        self.consolidate()
+        isKept = self.activityIds != activityId
+        self.cellKeys = self.cellKeys[isKept]
+        self.activityIds = self.activityIds[isKept]
+        self.idxStarts = self.idxStarts[isKept]
+        self.idxEnds = self.idxEnds[isKept]
+
+    def consolidate(self):
+        """
+        Merges the entries added since the last query and sorts all entries by cell key.
+        """
+        if not self.entryChunks:
+            return
+        (keysList, idsList, startsList, endsList) = zip(*self.entryChunks)
+        cellKeys = np.concatenate((self.cellKeys,) + keysList)
+        idxSort = np.argsort(cellKeys, kind='stable')
+        self.cellKeys = cellKeys[idxSort]
+        self.activityIds = np.concatenate((self.activityIds,) + idsList)[idxSort]
+        self.idxStarts = np.concatenate((self.idxStarts,) + startsList)[idxSort]
+        self.idxEnds = np.concatenate((self.idxEnds,) + endsList)[idxSort]
+        self.entryChunks = []
+
+    #%% Query functions
+    def queryBoundingBox(self, latMin, latMax, lonMin, lonMax):
+        """
+        Finds all the activities that have samples in the cells overlapping the
+        bounding box. Returns a DataFrame with one row per run of samples in a cell:
+        activityId, File_Path, idxStart, idxEnd (inclusive indices of the samples
+        in the activity data) and the cell row and column.
+        """
+        self.consolidate()
+
+        # Each row of cells of the box is a contiguous range of keys
+        (rowMin, columnMin) = self.getCellRowsColumns(latMin, lonMin)
+        (rowMax, columnMax) = self.getCellRowsColumns(latMax, lonMax)
+        rows = np.arange(rowMin, rowMax+1)
+        idxFirst = np.searchsorted(self.cellKeys, rows * self.Ncolumns + columnMin, side='left')
+        idxLast = np.searchsorted(self.cellKeys, rows * self.Ncolumns + columnMax, side='right')
+        idxEntries = Utils.rangesToIndices(idxFirst, idxLast)
+
+        return self.entriesToDataFrame(idxEntries)
+
+    def queryPointRadius(self, latDeg, lonDeg, radius):
+        """
+        Finds all the activities that have samples in the cells within radius
+        meters of the point. The precision is the cell size: a cell is matched
+        if any part of it is within the radius.
+        Returns the same DataFrame as queryBoundingBox.
+        """
+        # Bounding box of the circle then keep only cells that intersect the circle
+        latDelta = np.degrees(radius / Utils.earthRadius)
+        lonDelta = latDelta / max(np.cos(np.radians(latDeg)), 1.0e-6)
+        dfEntries = self.queryBoundingBox(latDeg - latDelta, latDeg + latDelta, lonDeg - lonDelta, lonDeg + lonDelta)
+
+        # Closest point of each cell to the query point
+        cellLatMin = dfEntries['cellRow'].values * self.cellSize - 90.0
+        cellLonMin = dfEntries['cellColumn'].values * self.cellSize - 180.0
+        closestLat = np.clip(latDeg, cellLatMin, cellLatMin + self.cellSize)
+        closestLon = np.clip(lonDeg, cellLonMin, cellLonMin + self.cellSize)
+        isInRadius = Utils.haversineDistance(latDeg, lonDeg, closestLat, closestLon) <= radius
+        return dfEntries.loc[isInRadius].reset_index(drop=True)
+
+    def getMatchingFiles(self, dfEntries):
+        """
+        Returns the list of unique file paths of the entries returned by a query.
+        """
+        return [self.activityPaths[activityId] for activityId in np.unique(dfEntries['activityId'])]
+
+    def entriesToDataFrame(self, idxEntries):
+        """
+        Creates the DataFrame returned by the queries from the indices of the entries.
+        """
+        cellKeys = self.cellKeys[idxEntries]
+        activityIds = self.activityIds[idxEntries]
+        return pd.DataFrame(data={'activityId': activityIds,
+                                  'File_Path': np.array(self.activityPaths, dtype=object)[activityIds] if len(activityIds) > 0 else np.array([], dtype=object),
+                                  'idxStart': self.idxStarts[idxEntries],
+                                  'idxEnd': self.idxEnds[idxEntries],
+                                  'cellRow': cellKeys // self.Ncolumns,
+                                  'cellColumn': cellKeys % self.Ncolumns
+                                  })
+
+    #%% Activity loading
+    def importMatchingActivities(self, dfEntries, activityImporterOptions=dict()):
+        """
+        Imports only the activities found by a query with the ActivityImporter.
+        Returns a dictionary with the file path as key and the ActivityImporter as value.
+        """
+        from Utilities.ActivityImporter import ActivityImporter
+        return {thisPath: ActivityImporter(thisPath, **activityImporterOptions) for thisPath in self.getMatchingFiles(dfEntries)}
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the index into a compressed numpy file.
+        """
+        self.consolidate()
+        np.savez_compressed(filePath, cellSize=self.cellSize, activityPaths=np.array(self.activityPaths, dtype=str),
+                            cellKeys=self.cellKeys, activityIds=self.activityIds,
+                            idxStarts=self.idxStarts, idxEnds=self.idxEnds)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads an index saved with the save method.
+        """
+        with np.load(filePath) as savedIndex:
+            spatialIndex = SpatialIndex(float(savedIndex['cellSize']))
+            spatialIndex.activityPaths = savedIndex['activityPaths'].tolist()
+            spatialIndex.cellKeys = savedIndex['cellKeys']
+            spatialIndex.activityIds = savedIndex['activityIds']
+            spatialIndex.idxStarts = savedIndex['idxStarts']
+            spatialIndex.idxEnds = savedIndex['idxEnds']
+        return spatialIndex
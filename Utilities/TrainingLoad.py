@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+TrainingLoad class
+Class to compute the fitness and fatigue curves over the whole history from the
+metrics table of the data importers (activityMetricsDF), without reading the
+activities again.
+
+Each activity gets a training load, then the loads are summed per day and
+smoothed with exponentially weighted averages (Banister impulse-response model):
+    - ATL, Acute Training Load (fatigue), with a time constant of 7 days
+    - CTL, Chronic Training Load (fitness), with a time constant of 42 days
+    - TSB, Training Stress Balance (form), the CTL minus the ATL of the previous day
+
+Created on Fri Oct 23 09:52:40 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import Utilities.Functions as Utils
+import numpy as np
+import pandas as pd
+import pickle
+
+
+#%% Define the TrainingLoad class
+class TrainingLoad:
+    """
+    This class holds the daily training load series and updates it incrementally:
+    when activities are added, only the days from the first new activity are
+    recomputed, starting from the stored ATL and CTL of the day before.
+    """
+
+    def __init__(self, loadMethod='trimp', thresholdPace=None, loadColumn=None, atlDays=7, ctlDays=42):
+        """
+        Constructor.
+        loadMethod is how the load of each activity is calculated:
+            - 'trimp': Banister TRIMP from the average, resting and maximum heart rates
+            - 'pace': running stress from the intensity factor (average speed over the
+              threshold speed given by thresholdPace), like the rTSS
+            - 'column': the values of loadColumn of the metrics table, for instance
+              an effort score calculated elsewhere
+        atlDays and ctlDays are the time constants of the ATL and CTL in days.
+        """
+        if loadMethod == 'pace' and thresholdPace is None:
+            raise ValueError("thresholdPace is required with the 'pace' load method")
+        if loadMethod == 'column' and loadColumn is None:
+            raise ValueError("loadColumn is required with the 'column' load method")
+        self.loadMethod = loadMethod
+        self.thresholdPace = thresholdPace
+        self.loadColumn = loadColumn
+        self.atlDays = atlDays
+        self.ctlDays = ctlDays
+
+        self.processedFiles = set()
+        self.dailyDF = pd.DataFrame(columns=['Load', 'ATL', 'CTL', 'TSB'], index=pd.DatetimeIndex([], name='Date'), dtype=float)
+
+    #%% Load of each activity
+    def computeActivityLoads(self, metricsDF):
+        """
+        Returns the training load of each activity of a metrics table, calculated
+        for all activities at once.
+        """
+        durationMinutes = metricsDF['Metric_TotalTimerTime'].values / 60.0
+        if self.loadMethod == 'trimp':
+            # Banister TRIMP with the heart rate reserve ratio
+            # https://fellrnr.com/wiki/TRIMP
+            heartRateRatio = (metricsDF['Metric_AvgHeartRate'].values - metricsDF['User_RestingHeartRate'].values) / \
+                             (metricsDF['User_MaxHeartRate'].values - metricsDF['User_RestingHeartRate'].values)
+            heartRateRatio = np.clip(heartRateRatio, 0.0, 1.0)
+            isFemale = metricsDF['User_Gender'].values == 'female'
+            weighting = np.where(isFemale, 0.86 * np.exp(1.67 * heartRateRatio), 0.64 * np.exp(1.92 * heartRateRatio))
+            loads = durationMinutes * heartRateRatio * weighting
+        elif self.loadMethod == 'pace':
+            # Running stress of 100 for one hour at threshold pace
+            # The grade adjusted pace is used when available
+            if 'Metric_AvgPaceGAP' in metricsDF.columns:
+                averageSpeed = 1000.0 / ((metricsDF['Metric_AvgPaceGAP'].values - np.datetime64('1970-01-01 00:00:00')) / np.timedelta64(1, 's'))
+            else:
+                averageSpeed = metricsDF['Metric_AvgSpeed_ms'].values
+            intensityFactor = averageSpeed / Utils.paceToSpeed(self.thresholdPace)
+            loads = durationMinutes / 60.0 * intensityFactor**2 * 100.0
+        elif self.loadMethod == 'column':
+            loads = metricsDF[self.loadColumn].values
+        else:
+            raise ValueError(f"{self.loadMethod} is not a load method of the TrainingLoad")
+        return pd.Series(np.nan_to_num(loads.astype(float)), index=metricsDF.index)
+
+    @staticmethod
+    def getActivityDays(metricsDF):
+        """
+        Returns the day of each activity, without time zone.
+        """
+        startTimes = pd.to_datetime(metricsDF['Metric_StartTime'])
+        if startTimes.dt.tz is not None:
+            startTimes = startTimes.dt.tz_convert(None)
+        return startTimes.dt.normalize()
+
+    #%% Daily series
+    def update(self, metricsDF, endDate=None):
+        """
+        Adds the activities of the metrics table that were not processed yet and
+        updates the daily series. Only the days from the first new activity are
+        recomputed. endDate extends the series without activities, for instance
+        to today to see the fatigue going down. Returns the daily DataFrame.
+        """
+        isNew = ~metricsDF['File_Path'].isin(self.processedFiles)
+        dfNew = metricsDF.loc[isNew]
+        newDailyLoads = self.computeActivityLoads(dfNew).groupby(TrainingLoad.getActivityDays(dfNew)).sum()
+        self.processedFiles.update(dfNew['File_Path'])
+
+        # Days to add to the series
+        lastDays = [self.dailyDF.index.max()] if len(self.dailyDF) > 0 else []
+        if len(newDailyLoads) > 0:
+            lastDays.append(newDailyLoads.index.max())
+        if endDate is not None:
+            lastDays.append(pd.Timestamp(endDate).normalize())
+        firstDays = [self.dailyDF.index.min()] if len(self.dailyDF) > 0 else []
+        if len(newDailyLoads) > 0:
+            firstDays.append(newDailyLoads.index.min())
+        if not firstDays:
+            return self.dailyDF
+        firstDay = min(firstDays)
+        allDays = pd.date_range(firstDay, max(lastDays), freq='D')
+
+        # Sum the new loads with the loads already in the series
+        dailyLoads = self.dailyDF['Load'].reindex(allDays, fill_value=0.0)
+        dailyLoads = dailyLoads.add(newDailyLoads.reindex(allDays, fill_value=0.0), fill_value=0.0)
+
+        # First day to recompute: first new activity, or the end of the previous series
+        recomputeDays = [newDailyLoads.index.min()] if len(newDailyLoads) > 0 else []
+        if len(self.dailyDF) > 0:
+            recomputeDays.append(self.dailyDF.index.max() + pd.Timedelta(days=1))
+        recomputeStart = min(recomputeDays) if recomputeDays else allDays[-1] + pd.Timedelta(days=1)
+        dfKept = self.dailyDF.loc[self.dailyDF.index < recomputeStart].reindex(columns=['Load', 'ATL', 'CTL', 'TSB'])
+        dfKept['Load'] = dailyLoads.loc[dfKept.index]
+        loadsToCompute = dailyLoads.loc[dailyLoads.index >= recomputeStart]
+        if len(loadsToCompute) == 0:
+            self.dailyDF = dfKept
+            return self.dailyDF
+
+        # Exponentially weighted averages started from the state of the previous day
+        # The state is put before the loads so ewm without adjustment continues from it
+        (previousATL, previousCTL) = (dfKept['ATL'].iloc[-1], dfKept['CTL'].iloc[-1]) if len(dfKept) > 0 else (0.0, 0.0)
+        ATL = pd.concat([pd.Series([previousATL]), loadsToCompute]).ewm(alpha=1.0/self.atlDays, adjust=False).mean().iloc[1:]
+        CTL = pd.concat([pd.Series([previousCTL]), loadsToCompute]).ewm(alpha=1.0/self.ctlDays, adjust=False).mean().iloc[1:]
+        dfComputed = pd.DataFrame(data={'Load': loadsToCompute.values,
+                                        'ATL': ATL.values,
+                                        'CTL': CTL.values,
+                                        'TSB': np.concatenate(([previousCTL - previousATL], CTL.values[:-1] - ATL.values[:-1]))},
+                                  index=loadsToCompute.index)
+        self.dailyDF = pd.concat([dfKept, dfComputed]) if len(dfKept) > 0 else dfComputed
+        self.dailyDF.index.name = 'Date'
+        return self.dailyDF
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the training load and its state into a pickle file.
+        """
+        with open(filePath, 'wb') as saveFile:
+            pickle.dump(self.__dict__, saveFile)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads a training load saved with the save method.
+        """
+        trainingLoad = TrainingLoad()
+        with open(filePath, 'rb') as saveFile:
+            trainingLoad.__dict__.update(pickle.load(saveFile))
+        return trainingLoad
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+ZoneSchedule class
+Class to define the custom HR and pace zones by period, as zones change with the
+fitness, and to apply to each activity the zones in force at its start time.
+
+Each period starts at a date and lasts until the start of the next period, so
+the periods are a sorted array of start dates and the period of all activities
+is found at once with a searchsorted. When a period is changed, only the
+activities inside it have their time in zones computed again.
+
+Created on Thu Oct 29 09:26:38 2026
+
+@author: LeMoiAK
+"""
+
+#%% Import required modules
+import numpy as np
+import pandas as pd
+import pickle
+
+
+#%% Define the ZoneSchedule class
+class ZoneSchedule:
+    """
+    This class holds the HR and pace zones of each period, in the same format as
+    the customHRzones and customPaceZones of the ActivityImporter, and fills the
+    HR_Custom_Time_*, PaceZone_Time_* and PaceZoneGAP_Time_* columns of the
+    metrics table with them.
+    """
+
+    # Prefixes of the columns of the metrics table filled by the schedule
+    columnPrefixes = ['HR_Custom_Time_', 'PaceZone_Time_', 'PaceZoneGAP_Time_']
+
+    def __init__(self):
+        """
+        Constructor of an empty schedule, periods are added with setZones.
+        """
+        self.startDates = np.array([], dtype='datetime64[ns]')
+        self.HRzonesList = []
+        self.PaceZonesList = []
+
+        self.processedFiles = set()
+        self.changedRanges = [] # (start, end) of the periods changed since the last update
+
+    #%% Periods
+    @staticmethod
+    def toDatetime64(dates):
+        """
+        Converts dates (strings, datetimes, with or without time zone) to UTC
+        datetime64 without time zone, like the start dates of the periods.
+        """
+        dates = pd.to_datetime(pd.Series(dates))
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_convert(None)
+        return dates.values.astype('datetime64[ns]')
+
+    def getPeriodIndex(self, startTimes):
+        """
+        Returns the index of the period in force at each start time, -1 for the
+        start times before the first period.
+        """
+        return np.searchsorted(self.startDates, ZoneSchedule.toDatetime64(startTimes), side='right') - 1
+
+    def getPeriodEnd(self, idxPeriod):
+        """
+        Returns the end of a period: the start of the next one, or the far future.
+        """
+        if idxPeriod + 1 < len(self.startDates):
+            return self.startDates[idxPeriod + 1]
+        return np.datetime64('2262-01-01', 'ns')
+
+    def setZones(self, startDate, HRzones=None, PaceZones=None):
+        """
+        Sets the zones in force from startDate (UTC) until the next period.
+        The period is replaced if it already starts at startDate.
+        HRzones and PaceZones are dictionnaries like customHRzones and customPaceZones
+        of the ActivityImporter. If None, the zones in force before startDate are kept.
+        """
+        startDate = ZoneSchedule.toDatetime64([startDate])[0]
+        idxPrevious = self.getPeriodIndex([startDate])[0]
+        if HRzones is None:
+            HRzones = self.HRzonesList[idxPrevious] if idxPrevious >= 0 else dict()
+        if PaceZones is None:
+            PaceZones = self.PaceZonesList[idxPrevious] if idxPrevious >= 0 else dict()
+
+        if idxPrevious >= 0 and self.startDates[idxPrevious] == startDate:
+            idxPeriod = idxPrevious
+            self.HRzonesList[idxPeriod] = HRzones
+            self.PaceZonesList[idxPeriod] = PaceZones
+        else:
+            idxPeriod = idxPrevious + 1
+            self.startDates = np.insert(self.startDates, idxPeriod, startDate)
+            self.HRzonesList.insert(idxPeriod, HRzones)
+            self.PaceZonesList.insert(idxPeriod, PaceZones)
+        self.changedRanges.append((startDate, self.getPeriodEnd(idxPeriod)))
+
+    def removeZones(self, startDate):
+        """
+        Removes the period starting at startDate, its activities then use the
+        zones of the previous period.
+        """
+        startDate = ZoneSchedule.toDatetime64([startDate])[0]
+        idxPeriod = self.getPeriodIndex([startDate])[0]
+        if idxPeriod < 0 or self.startDates[idxPeriod] != startDate:
+            raise ValueError(f"No period of the ZoneSchedule starts on {startDate}")
+        self.changedRanges.append((startDate, self.getPeriodEnd(idxPeriod)))
+        self.startDates = np.delete(self.startDates, idxPeriod)
+        del self.HRzonesList[idxPeriod]
+        del self.PaceZonesList[idxPeriod]
+
+    def getZonesAt(self, startTime):
+        """
+        Returns the (HRzones, PaceZones) in force at a start time.
+        """
+        idxPeriod = self.getPeriodIndex([startTime])[0]
+        if idxPeriod < 0:
+            return (dict(), dict())
+        return (self.HRzonesList[idxPeriod], self.PaceZonesList[idxPeriod])
+
+    #%% Time in zones
+    def updateFromImporter(self, dataImporter, fullRefresh=False):
+        """
+        Computes the time in zones of the activities of a data importer that are
+        new or inside a period changed since the last update, with the zones of
+        their period, and updates their HR_Custom_Time_*, PaceZone_Time_* and
+        PaceZoneGAP_Time_* columns of activityMetricsDF at once. Zones not defined
+        in the period of an activity are NaN.
+        Returns the indices of the updated activities.
+        """
+        metricsDF = dataImporter.activityMetricsDF
+        startTimes = ZoneSchedule.toDatetime64(metricsDF['Metric_StartTime'])
+        isToUpdate = ~metricsDF['File_Path'].isin(self.processedFiles).values | fullRefresh
+        for (rangeStart, rangeEnd) in self.changedRanges:
+            isToUpdate |= (rangeStart <= startTimes) & (startTimes < rangeEnd)
+        idxUpdated = np.flatnonzero(isToUpdate)
+        idxPeriods = self.getPeriodIndex(startTimes[idxUpdated])
+
+        # Same functions as at import so the results are identical
+        rowsList = []
+        for idxActivity, idxPeriod in zip(idxUpdated, idxPeriods):
+            activity = dataImporter.activityImporters[idxActivity]
+            (HRzones, PaceZones) = (self.HRzonesList[idxPeriod], self.PaceZonesList[idxPeriod]) if idxPeriod >= 0 else (dict(), dict())
+            dfColumns = activity.data.columns
+            activity.customHRzones = HRzones
+            activity.customPaceZones = PaceZones
+            activity.timeInCustomHRzones = dict()
+            activity.timeInPaceZones = dict()
+            activity.timeInPaceZonesGAP = dict()
+            if HRzones and 'heart_rate' in dfColumns:
+                activity.processTimeinHRzones(HRzones)
+            if PaceZones and 'pace' in dfColumns:
+                activity.processTimeinPaceZones(PaceZones)
+            if PaceZones and 'pace_gap' in dfColumns:
+                activity.processTimeinPaceZones(PaceZones, gradeAdjusted=True)
+
+            rowDict = dict()
+            for (prefix, timeInZones) in zip(ZoneSchedule.columnPrefixes, [activity.timeInCustomHRzones, activity.timeInPaceZones, activity.timeInPaceZonesGAP]):
+                for zoneName, zoneTime in timeInZones.items():
+                    rowDict[prefix + zoneName] = zoneTime
+            rowsList.append(rowDict)
+
+        # Reset the zone columns of the updated activities then write the new times
+        if len(idxUpdated) > 0:
+            indexUpdated = metricsDF.index[idxUpdated]
+            zoneColumns = [columnName for columnName in metricsDF.columns if any(columnName.startswith(prefix) for prefix in ZoneSchedule.columnPrefixes)]
+            metricsDF.loc[indexUpdated, zoneColumns] = np.nan
+            dfUpdated = pd.DataFrame(rowsList, index=indexUpdated)
+            for columnName in dfUpdated.columns:
+                metricsDF.loc[indexUpdated, columnName] = dfUpdated[columnName].values
+
+        self.processedFiles.update(metricsDF['File_Path'])
+        self.changedRanges = []
+        return indexUpdated.tolist() if len(idxUpdated) > 0 else []
+
+    #%% Save and Load
+    def save(self, filePath):
+        """
+        Saves the schedule into a pickle file.
+        """
+        with open(filePath, 'wb') as saveFile:
+            pickle.dump(self.__dict__, saveFile)
+
+    @staticmethod
+    def load(filePath):
+        """
+        Loads a schedule saved with the save method.
+        """
+        zoneSchedule = ZoneSchedule()
+        with open(filePath, 'rb') as saveFile:
+            zoneSchedule.__dict__.update(pickle.load(saveFile))
+        return zoneSchedule